@@ -0,0 +1,416 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Simulated Storwize CIM provider (CIMOM) for load testing of svc_* scripts without Storwize hardware
+#
+# Serves CIM-XML over HTTP for namespace root/ibm, one simulated cluster per listen address (127.0.0.1, 127.0.0.2, ...):
+#   IBMTSSVC_StorageVolume, IBMTSSVC_BackendVolume, IBMTSSVC_ConcreteStoragePool,
+#   IBMTSSVC_StorageVolumeStatistics, IBMTSSVC_BackendVolumeStatistics
+# Supported operations: EnumerateInstances, ExecQuery (WQL "select <props>|* from <class> [where <prop> = '<value>' [or ...]]"),
+#   OpenEnumerateInstances, PullInstancesWithPath, CloseEnumeration
+#
+# Statistics counters of every volume/mdisk grow with its own IO rate, read/write mix, block sizes and latencies,
+# StatisticTime advances by --cadence seconds like Storwize "startstats -interval".
+# Credentials are not checked.
+#
+# Point svc_* scripts to simulator with SVC_WBEM_URL environment variable and use listen addresses as cluster names:
+#   svc_cimom_sim.py --clusters 10 --volumes 2000 --mdisks 100 &
+#   SVC_WBEM_URL=http://%s:5988 svc_perf_wbem.py --cluster 127.0.0.1 ... --cluster 127.0.0.10 --user x --password x --cachefile none
+#
+# Usage:
+# svc_cimom_sim.py [--debug] [--clusters <n>] [--address <ip>] [--port <port>] [--volumes <n>] [--mdisks <n>] [--pools <n>]
+#                  [--cadence <sec>] [--latency <sec>] [--object_latency <sec>] [--no_pull] [--seed <n>]
+#
+#   --debug    = Log every HTTP request to stderr
+#   --clusters = Number of simulated clusters (default 1), cluster N listens on --address + N - 1
+#   --address  = Listen address of first cluster (default 127.0.0.1)
+#   --port     = Listen port (default 5988)
+#   --volumes  = Volumes per cluster (default 500)
+#   --mdisks   = MDisks per cluster (default 20)
+#   --pools    = Storage pools per cluster (default 4), volumes and mdisks are spread over pools evenly
+#   --cadence  = StatisticTime interval in seconds (default 180)
+#   --latency  = Response delay of every request in seconds (default 0)
+#   --object_latency = Additional response delay per returned instance in seconds (default 0)
+#   --no_pull  = Answer pull operations with CIM_ERR_NOT_SUPPORTED like CIMOMs without DSP0200 1.3 support
+#   --seed     = Random seed of simulated element parameters (default 1)
+#
+import getopt, sys, time, datetime, random, re, socket, struct, threading, itertools
+import BaseHTTPServer, SocketServer
+import xml.etree.cElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+def usage():
+  print >> sys.stderr, "Usage: svc_cimom_sim.py [--debug] [--clusters <n>] [--address <ip>] [--port <port>] [--volumes <n>] [--mdisks <n>] [--pools <n>] [--cadence <sec>] [--latency <sec>] [--object_latency <sec>] [--no_pull] [--seed <n>]"
+
+NAMESPACE = 'root/ibm'
+CIM_ERR_FAILED = 1
+CIM_ERR_INVALID_PARAMETER = 4
+CIM_ERR_INVALID_CLASS = 5
+CIM_ERR_NOT_SUPPORTED = 7
+CIM_ERR_INVALID_ENUMERATION_CONTEXT = 21
+CIM_ERR_INVALID_QUERY = 15
+
+RAW_COUNTERS = ['KBytesRead', 'KBytesWritten', 'KBytesTransferred', 'ReadIOs', 'WriteIOs', 'TotalIOs', 'IOTimeCounter', 'ReadIOTimeCounter', 'WriteIOTimeCounter']
+MAX_OPEN_ENUMERATIONS = 100
+
+''' class -> (key properties, [(property, CIM type)]) '''
+CLASSES = {
+  'IBMTSSVC_StorageVolume': (['CreationClassName', 'DeviceID', 'SystemName'],
+    [('CreationClassName', 'string'), ('DeviceID', 'string'), ('SystemName', 'string'), ('ElementName', 'string'),
+     ('NativeStatus', 'uint16'), ('PoolName', 'string'), ('BlockSize', 'uint64'), ('NumberOfBlocks', 'uint64')]),
+  'IBMTSSVC_BackendVolume': (['CreationClassName', 'DeviceID', 'SystemName'],
+    [('CreationClassName', 'string'), ('DeviceID', 'string'), ('SystemName', 'string'), ('ElementName', 'string'),
+     ('NativeStatus', 'uint16'), ('PoolName', 'string'), ('BlockSize', 'uint64'), ('NumberOfBlocks', 'uint64')]),
+  'IBMTSSVC_ConcreteStoragePool': (['InstanceID'],
+    [('InstanceID', 'string'), ('PoolID', 'string'), ('ElementName', 'string'), ('Caption', 'string'), ('NativeStatus', 'uint16'),
+     ('VirtualCapacity', 'uint64'), ('TotalManagedSpace', 'uint64'), ('UsedCapacity', 'uint64'), ('RealCapacity', 'uint64')]),
+  'IBMTSSVC_StorageVolumeStatistics': (['InstanceID'],
+    [('InstanceID', 'string'), ('StatisticTime', 'datetime')] + [(k, 'uint64') for k in RAW_COUNTERS]),
+  'IBMTSSVC_BackendVolumeStatistics': (['InstanceID'],
+    [('InstanceID', 'string'), ('StatisticTime', 'datetime')] + [(k, 'uint64') for k in RAW_COUNTERS]),
+}
+
+''' statistics class -> (element class, InstanceID prefix) '''
+STATISTICS_CLASSES = {
+  'IBMTSSVC_StorageVolumeStatistics': ('IBMTSSVC_StorageVolume', 'StorageVolumeStats'),
+  'IBMTSSVC_BackendVolumeStatistics': ('IBMTSSVC_BackendVolume', 'BackendVolumeStats'),
+}
+
+class CIMError(Exception):
+  def __init__(self, code, description):
+    Exception.__init__(self, description)
+    self.code = code
+
+##############################################################
+class Element(object):
+  ''' Simulated volume or mdisk with its raw statistics counters '''
+  def __init__(self, rnd, deviceID, name, poolName, ioRate):
+    self.deviceID = deviceID
+    self.properties = {'DeviceID': deviceID, 'ElementName': name, 'NativeStatus': 2, 'PoolName': poolName}
+    self.ioRate = ioRate
+    self.readPct = rnd.uniform(0.4, 0.95)
+    self.readKB = rnd.choice([4, 8, 16, 32, 64, 256])
+    self.writeKB = rnd.choice([4, 8, 16, 32, 64])
+    self.readTime = rnd.uniform(0.5, 12.0) # ms per IO
+    self.writeTime = rnd.uniform(0.2, 4.0)
+    self.counters = dict((k, rnd.randint(0, 1 << 32)) for k in RAW_COUNTERS)
+    self.properties.update(BlockSize=512, NumberOfBlocks=rnd.randint(1, 1 << 14) << 11) # 1 MB .. 16 GB
+
+  def advance(self, rnd, seconds):
+    ''' Grow counters by IO done in seconds, IO rate and latencies vary from interval to interval '''
+    ios = self.ioRate * seconds * rnd.uniform(0.5, 1.5)
+    reads = int(ios * self.readPct)
+    writes = int(ios) - reads
+    readTime = int(reads * self.readTime * rnd.uniform(0.7, 1.5))
+    writeTime = int(writes * self.writeTime * rnd.uniform(0.7, 1.5))
+    c = self.counters
+    c['ReadIOs'] += reads
+    c['WriteIOs'] += writes
+    c['TotalIOs'] += reads + writes
+    c['KBytesRead'] += reads * self.readKB
+    c['KBytesWritten'] += writes * self.writeKB
+    c['KBytesTransferred'] += reads * self.readKB + writes * self.writeKB
+    c['ReadIOTimeCounter'] += readTime
+    c['WriteIOTimeCounter'] += writeTime
+    c['IOTimeCounter'] += readTime + writeTime
+
+class Cluster(object):
+  ''' Simulated Storwize cluster: pools, volumes, mdisks and their statistics '''
+  def __init__(self, name, volumes, mdisks, pools, cadence, seed):
+    self.name = name
+    self.cadence = cadence
+    self.rnd = random.Random('%s.%s' % (seed, name))
+    self.lock = threading.Lock()
+    self.enumerations = {} # enumeration context -> remaining instance XML list
+    self.contexts = itertools.count(1)
+
+    self.pools = []
+    for i in range(pools):
+      capacity = self.rnd.randint(10, 500) << 40
+      used = int(capacity * self.rnd.uniform(0.2, 0.9))
+      self.pools.append({'InstanceID': 'IBMTSSVC:StoragePool-%d' % i, 'PoolID': str(i), 'ElementName': 'pool%d' % i,
+                         'Caption': 'pool%d' % i, 'NativeStatus': 2, 'TotalManagedSpace': capacity,
+                         'VirtualCapacity': int(capacity * self.rnd.uniform(0.5, 2.0)), 'UsedCapacity': used, 'RealCapacity': used})
+
+    ''' IO rates are log-normal: a few busy elements and a long tail of idle ones '''
+    self.elements = {
+      'IBMTSSVC_StorageVolume': [Element(self.rnd, str(i), 'vol%d' % i, self.pools[i % pools]['ElementName'], self.rnd.lognormvariate(3, 1.5))
+                                 for i in range(volumes)],
+      'IBMTSSVC_BackendVolume': [Element(self.rnd, str(i), 'mdisk%d' % i, self.pools[i % pools]['ElementName'], self.rnd.lognormvariate(5, 1))
+                                 for i in range(mdisks)],
+    }
+    self.statisticTime = int(time.time()) // cadence * cadence
+
+  def advance(self):
+    ''' Publish new statistics sample if cadence interval has passed since StatisticTime of last one '''
+    now = int(time.time()) // self.cadence * self.cadence
+    if now > self.statisticTime:
+      for elements in self.elements.values():
+        for e in elements:
+          e.advance(self.rnd, now - self.statisticTime)
+      self.statisticTime = now
+
+  def instances(self, cimClass):
+    ''' Return list of property dicts of all instances of class '''
+    if cimClass == 'IBMTSSVC_ConcreteStoragePool':
+      return self.pools
+    if cimClass in self.elements:
+      systemName = {'CreationClassName': cimClass, 'SystemName': self.name}
+      return [dict(e.properties, **systemName) for e in self.elements[cimClass]]
+    if cimClass in STATISTICS_CLASSES:
+      elementClass, prefix = STATISTICS_CLASSES[cimClass]
+      with self.lock:
+        self.advance()
+        statisticTime = datetime.datetime.utcfromtimestamp(self.statisticTime)
+        return [dict(e.counters, InstanceID='%s %s' % (prefix, e.deviceID), StatisticTime=statisticTime)
+                for e in self.elements[elementClass]]
+    raise CIMError(CIM_ERR_INVALID_CLASS, 'class %s not found' % cimClass)
+
+  def openEnumeration(self, instances):
+    with self.lock:
+      if len(self.enumerations) >= MAX_OPEN_ENUMERATIONS:
+        self.enumerations.pop(min(self.enumerations, key=int))
+      context = str(self.contexts.next())
+      self.enumerations[context] = instances
+      return context
+
+  def pull(self, context, maxObjectCount):
+    ''' Return (next instances of enumeration, enumeration context or None at end of sequence) '''
+    with self.lock:
+      if context not in self.enumerations:
+        raise CIMError(CIM_ERR_INVALID_ENUMERATION_CONTEXT, 'invalid enumeration context %s' % context)
+      instances = self.enumerations[context]
+      if len(instances) <= maxObjectCount:
+        del self.enumerations[context]
+        return instances, None
+      self.enumerations[context] = instances[maxObjectCount:]
+      return instances[:maxObjectCount], context
+
+  def closeEnumeration(self, context):
+    with self.lock:
+      self.enumerations.pop(context, None)
+
+##############################################################
+def cimValue(value, cimType):
+  if cimType == 'datetime':
+    return value.strftime('%Y%m%d%H%M%S.%f') + '+000'
+  return escape(str(value))
+
+def instanceNameXML(cimClass, props):
+  keys = CLASSES[cimClass][0]
+  return '<INSTANCENAME CLASSNAME="%s">%s</INSTANCENAME>' % (cimClass, ''.join(
+    ['<KEYBINDING NAME="%s"><KEYVALUE VALUETYPE="string">%s</KEYVALUE></KEYBINDING>' % (k, escape(props[k])) for k in keys]))
+
+def instanceXML(cimClass, props, propertyList):
+  return '<INSTANCE CLASSNAME="%s">%s</INSTANCE>' % (cimClass, ''.join(
+    ['<PROPERTY NAME="%s" TYPE="%s"><VALUE>%s</VALUE></PROPERTY>' % (p, t, cimValue(props[p], t))
+     for (p, t) in CLASSES[cimClass][1] if (propertyList is None or p.lower() in propertyList) and props.get(p) is not None]))
+
+def instancePathXML(host, cimClass, props):
+  return '<INSTANCEPATH><NAMESPACEPATH><HOST>%s</HOST><LOCALNAMESPACEPATH>%s</LOCALNAMESPACEPATH></NAMESPACEPATH>%s</INSTANCEPATH>' % (
+    escape(host), ''.join(['<NAMESPACE NAME="%s"/>' % n for n in NAMESPACE.split('/')]), instanceNameXML(cimClass, props))
+
+def namedInstancesXML(cimClass, instances, propertyList):
+  ''' EnumerateInstances result '''
+  return ['<VALUE.NAMEDINSTANCE>%s%s</VALUE.NAMEDINSTANCE>' % (instanceNameXML(cimClass, i), instanceXML(cimClass, i, propertyList))
+          for i in instances]
+
+def instancesWithPathXML(host, cimClass, instances, propertyList, element):
+  ''' ExecQuery (VALUE.OBJECTWITHPATH) and pull operations (VALUE.INSTANCEWITHPATH) result '''
+  return ['<%s>%s%s</%s>' % (element, instancePathXML(host, cimClass, i), instanceXML(cimClass, i, propertyList), element)
+          for i in instances]
+
+def parseQuery(query):
+  ''' Parse simple WQL query, return (class, property list or None for "*", list of (property, value) conditions joined by OR) '''
+  m = re.match(r"\s*select\s+(.+?)\s+from\s+(\w+)(?:\s+where\s+(.+?))?\s*$", query, re.I | re.S)
+  if not m:
+    raise CIMError(CIM_ERR_INVALID_QUERY, 'unsupported query: %s' % query)
+  properties = [p.strip().lower() for p in m.group(1).split(',')]
+  conditions = []
+  if m.group(3):
+    for condition in re.split(r'\s+or\s+', m.group(3), flags=re.I):
+      c = re.match(r"\s*(\w+)\s*=\s*'([^']*)'\s*$", condition)
+      if not c:
+        raise CIMError(CIM_ERR_INVALID_QUERY, 'unsupported condition: %s' % condition)
+      conditions.append((c.group(1), c.group(2)))
+  return m.group(2), (None if '*' in properties else properties), conditions
+
+##############################################################
+class CIMOMHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  ''' CIM-XML operation request handler (DSP0200) '''
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    if debug:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+  def do_POST(self):
+    started = time.time()
+    body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+    cluster = self.server.cluster
+    messageID = '1'
+    method = None
+    objects = 0
+    try:
+      message = ElementTree.fromstring(body).find('MESSAGE')
+      messageID = message.get('ID')
+      call = message.find('SIMPLEREQ/IMETHODCALL')
+      method = call.get('NAME')
+      params = {}
+      for p in call.findall('IPARAMVALUE'):
+        if p.find('CLASSNAME') is not None:
+          params[p.get('NAME')] = p.find('CLASSNAME').get('NAME')
+        elif p.find('VALUE.ARRAY') is not None:
+          params[p.get('NAME')] = [v.text or '' for v in p.findall('VALUE.ARRAY/VALUE')]
+        elif p.find('VALUE') is not None:
+          params[p.get('NAME')] = p.find('VALUE').text or ''
+      response, objects = self.operation(cluster, method, params)
+    except CIMError, err:
+      response = '<ERROR CODE="%d" DESCRIPTION=%s/>' % (err.code, quoteattr(str(err)))
+    except Exception, err:
+      response = '<ERROR CODE="%d" DESCRIPTION=%s/>' % (CIM_ERR_FAILED, quoteattr(str(err)))
+
+    data = ('<?xml version="1.0" encoding="utf-8" ?><CIM CIMVERSION="2.0" DTDVERSION="2.0"><MESSAGE ID=%s PROTOCOLVERSION="1.0">'
+            '<SIMPLERSP><IMETHODRESPONSE NAME=%s>%s</IMETHODRESPONSE></SIMPLERSP></MESSAGE></CIM>') % (
+            quoteattr(messageID or '1'), quoteattr(method or ''), response)
+
+    ''' simulated CIMOM processing time '''
+    delay = latency + objects * object_latency - (time.time() - started)
+    if delay > 0:
+      time.sleep(delay)
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/xml; charset="utf-8"')
+    self.send_header('Content-Length', str(len(data)))
+    self.send_header('CIMOperation', 'MethodResponse')
+    self.end_headers()
+    self.wfile.write(data)
+
+  def operation(self, cluster, method, params):
+    ''' Return (IMETHODRESPONSE contents, number of returned instances) '''
+    host = '%s:%d' % self.server.server_address
+    propertyList = params.get('PropertyList')
+    if propertyList is not None:
+      propertyList = set(p.lower() for p in propertyList)
+
+    if method == 'EnumerateInstances':
+      cimClass = params.get('ClassName')
+      result = namedInstancesXML(cimClass, cluster.instances(cimClass), propertyList)
+      return '<IRETURNVALUE>%s</IRETURNVALUE>' % ''.join(result), len(result)
+
+    if method == 'ExecQuery':
+      if params.get('QueryLanguage', '').upper() != 'WQL':
+        raise CIMError(CIM_ERR_NOT_SUPPORTED, 'query language %s is not supported' % params.get('QueryLanguage'))
+      cimClass, properties, conditions = parseQuery(params.get('Query', ''))
+      instances = cluster.instances(cimClass)
+      if conditions:
+        instances = [i for i in instances if any(str(i.get(p)) == v for (p, v) in conditions)]
+      result = instancesWithPathXML(host, cimClass, instances, properties and set(properties), 'VALUE.OBJECTWITHPATH')
+      return '<IRETURNVALUE>%s</IRETURNVALUE>' % ''.join(result), len(result)
+
+    if method in ('OpenEnumerateInstances', 'PullInstancesWithPath', 'CloseEnumeration') and no_pull:
+      raise CIMError(CIM_ERR_NOT_SUPPORTED, '%s is not supported' % method)
+
+    if method == 'OpenEnumerateInstances':
+      cimClass = params.get('ClassName')
+      result = instancesWithPathXML(host, cimClass, cluster.instances(cimClass), propertyList, 'VALUE.INSTANCEWITHPATH')
+      context = cluster.openEnumeration(result)
+      return self.pullResponse(cluster, context, int(params.get('MaxObjectCount') or 0))
+
+    if method == 'PullInstancesWithPath':
+      if 'MaxObjectCount' not in params:
+        raise CIMError(CIM_ERR_INVALID_PARAMETER, 'MaxObjectCount is required')
+      return self.pullResponse(cluster, params.get('EnumerationContext'), int(params['MaxObjectCount']))
+
+    if method == 'CloseEnumeration':
+      cluster.closeEnumeration(params.get('EnumerationContext'))
+      return '', 0
+
+    raise CIMError(CIM_ERR_NOT_SUPPORTED, 'operation %s is not supported' % method)
+
+  def pullResponse(self, cluster, context, maxObjectCount):
+    result, context = cluster.pull(context, maxObjectCount)
+    return ('<IRETURNVALUE>%s</IRETURNVALUE><PARAMVALUE NAME="EnumerationContext"><VALUE>%s</VALUE></PARAMVALUE>'
+            '<PARAMVALUE NAME="EndOfSequence"><VALUE>%s</VALUE></PARAMVALUE>') % (
+            ''.join(result), context or '', 'FALSE' if context else 'TRUE'), len(result)
+
+class CIMOMServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address, cluster):
+    BaseHTTPServer.HTTPServer.__init__(self, address, CIMOMHandler)
+    self.cluster = cluster
+
+##############################################################
+
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "address=", "port=", "volumes=", "mdisks=", "pools=", "cadence=",
+                                                        "latency=", "object_latency=", "no_pull", "seed=", "debug"])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  clusters = 1
+  address = '127.0.0.1'
+  port = 5988
+  volumes = 500
+  mdisks = 20
+  pools = 4
+  cadence = 180
+  latency = 0.0
+  object_latency = 0.0
+  no_pull = False
+  seed = 1
+  debug = False
+  for o, a in opts:
+    if o == "--clusters":
+      clusters = int(a)
+    elif o == "--address":
+      address = a
+    elif o == "--port":
+      port = int(a)
+    elif o == "--volumes":
+      volumes = int(a)
+    elif o == "--mdisks":
+      mdisks = int(a)
+    elif o == "--pools":
+      pools = int(a)
+    elif o == "--cadence":
+      cadence = int(a)
+    elif o == "--latency":
+      latency = float(a)
+    elif o == "--object_latency":
+      object_latency = float(a)
+    elif o == "--no_pull":
+      no_pull = True
+    elif o == "--seed":
+      seed = int(a)
+    elif o == "--debug":
+      debug = True
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if pools < 1 or cadence < 1:
+    print >> sys.stderr, '--pools and --cadence must be positive'
+    usage()
+    sys.exit(2)
+
+  first = struct.unpack('!I', socket.inet_aton(address))[0]
+  for i in range(clusters):
+    name = socket.inet_ntoa(struct.pack('!I', first + i))
+    server = CIMOMServer((name, port), Cluster(name, volumes, mdisks, pools, cadence, seed))
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    print >> sys.stderr, 'Simulated cluster %s: %d volumes, %d mdisks, %d pools on http://%s:%d' % (name, volumes, mdisks, pools, name, port)
+
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    pass
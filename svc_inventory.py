@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# IBM SVC/Storwize V7000 inventory snapshot refresher
+#
+# Enumerates volumes, mdisks and storage pools of each cluster once and writes local snapshot file
+# <snapshot_dir>/svc_inventory.<cluster>.json, other svc_* scripts read it instead of querying the cluster:
+#   svc_perf_wbem.py (element names and pools), svc_perf_graph.py (pool members), svc_mon.py (status and capacity),
+#   svc_perf_discovery_sender.py (LLD lists)
+# Scripts query the cluster themselves (and rewrite the snapshot) only when the snapshot is missing or older than max age.
+#
+# Snapshot format (SNAPSHOT_VERSION):
+# {"version": 1, "cluster": "svc1", "refreshed": 1356526942,
+#  "volume": {"<DeviceID>": {"name": ..., "pool": <pool name>, "status": <NativeStatus>, "capacity": <bytes>}, ...},
+#  "mdisk":  {"<DeviceID>": {"name": ..., "pool": <pool name>, "status": <NativeStatus>, "capacity": <bytes>}, ...},
+#  "pool":   {"<PoolID>": {"name": ..., "status": <NativeStatus>, "capacity": <TotalManagedSpace>,
+#                          "virtualCapacity": ..., "usedCapacity": ..., "realCapacity": ...}, ...}}
+#
+# Collector self-telemetry is returned as svc.collector.*[inventory,*] items in zabbix_sender format (see svc_telemetry.py)
+#
+# Usage: svc_inventory.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> [--snapshot_dir <path>]
+#
+#   --debug        = Enable debug output
+#   --clusters     = Comma-separated Storwize node list (DNS name/IP)
+#   --user         = Storwize V7000 user account
+#   --password     = Storwize password
+#   --snapshot_dir = Directory of snapshot files (default /var/cache/zabbix)
+#   SVC_WBEM_URL environment variable = CIM provider URL template, %s is replaced with cluster name (default https://%s)
+#
+import pywbem
+import getopt, sys, os, time, json
+from svc_telemetry import Telemetry
+
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_DIR = '/var/cache/zabbix'
+DEFAULT_MAX_AGE = 900 # seconds, run svc_inventory at shorter intervals
+
+''' element type -> (CIM class, ID property, properties) '''
+INVENTORY_CLASSES = {
+  'volume': ('IBMTSSVC_StorageVolume', 'DeviceID', ['ElementName', 'PoolName', 'NativeStatus', 'BlockSize', 'NumberOfBlocks']),
+  'mdisk': ('IBMTSSVC_BackendVolume', 'DeviceID', ['ElementName', 'PoolName', 'NativeStatus', 'BlockSize', 'NumberOfBlocks']),
+  'pool': ('IBMTSSVC_ConcreteStoragePool', 'PoolID', ['ElementName', 'NativeStatus', 'TotalManagedSpace', 'VirtualCapacity', 'UsedCapacity', 'RealCapacity']),
+}
+
+def snapshotPath(snapshot_dir, cluster):
+  return os.path.join(snapshot_dir, 'svc_inventory.%s.json' % cluster)
+
+def propertyValue(obj, name):
+  ''' Return property value or None if CIM provider did not return property '''
+  prop = obj.properties.get(name)
+  return prop.value if prop is not None else None
+
+def enumElements(conn, elementType):
+  ''' Return dict{id: element} of all elements of type (volume, mdisk or pool) '''
+  cimClass, idProperty, properties = INVENTORY_CLASSES[elementType]
+  elements = {}
+  for obj in conn.ExecQuery('WQL', 'select %s, %s from %s' % (idProperty, ', '.join(properties), cimClass)):
+    elementID = propertyValue(obj, idProperty)
+    if elementID is None:
+      continue
+    element = {'name': propertyValue(obj, 'ElementName'), 'status': propertyValue(obj, 'NativeStatus')}
+    if elementType == 'pool':
+      element['capacity'] = propertyValue(obj, 'TotalManagedSpace')
+      element['virtualCapacity'] = propertyValue(obj, 'VirtualCapacity')
+      element['usedCapacity'] = propertyValue(obj, 'UsedCapacity')
+      element['realCapacity'] = propertyValue(obj, 'RealCapacity')
+    else:
+      element['pool'] = propertyValue(obj, 'PoolName')
+      blockSize, blocks = propertyValue(obj, 'BlockSize'), propertyValue(obj, 'NumberOfBlocks')
+      element['capacity'] = blockSize * blocks if blockSize is not None and blocks is not None else None
+    elements[str(elementID)] = element
+  return elements
+
+def enumInventory(conn, cluster):
+  ''' Return new snapshot of cluster inventory '''
+  snapshot = {'version': SNAPSHOT_VERSION, 'cluster': cluster, 'refreshed': int(time.time())}
+  for elementType in INVENTORY_CLASSES:
+    snapshot[elementType] = enumElements(conn, elementType)
+  return snapshot
+
+def saveSnapshot(snapshot_dir, snapshot):
+  ''' Replace snapshot file atomically, readers never see partially written snapshot '''
+  path = snapshotPath(snapshot_dir, snapshot['cluster'])
+  tmp = '%s.%d.tmp' % (path, os.getpid())
+  f = open(tmp, 'w')
+  json.dump(snapshot, f)
+  f.close()
+  os.rename(tmp, path)
+
+def loadSnapshot(snapshot_dir, cluster, max_age=DEFAULT_MAX_AGE):
+  ''' Return snapshot of cluster or None if there is no snapshot of current version younger than max_age seconds '''
+  try:
+    snapshot = json.load(open(snapshotPath(snapshot_dir, cluster), 'r'))
+  except (IOError, ValueError):
+    return None
+  if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('cluster') != cluster or \
+     time.time() - snapshot.get('refreshed', 0) > max_age:
+    return None
+  return snapshot
+
+def getInventory(snapshot_dir, cluster, connect, max_age=DEFAULT_MAX_AGE):
+  ''' Return snapshot of cluster, enumerate cluster with connect() connection if snapshot is stale.
+      Snapshot is not used (and not written) if snapshot_dir is None '''
+  snapshot = loadSnapshot(snapshot_dir, cluster, max_age) if snapshot_dir else None
+  if snapshot is None:
+    snapshot = enumInventory(connect(), cluster)
+    if snapshot_dir:
+      try:
+        saveSnapshot(snapshot_dir, snapshot)
+      except Exception, err:
+        print >> sys.stderr, "Can't save inventory snapshot:", str(err)
+  return snapshot
+
+#####################################################################################################
+# main
+#####################################################################################################
+
+def usage():
+  print >> sys.stderr, "Usage: svc_inventory.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> [--snapshot_dir <path>]"
+
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug", "snapshot_dir="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  debug = False
+  clusters = []
+  user = None
+  password = None
+  snapshot_dir = DEFAULT_SNAPSHOT_DIR
+  for o, a in opts:
+    if o == "--clusters" and not a.startswith('--'):
+      clusters.extend( a.split(','))
+    elif o == "--user" and not a.startswith('--'):
+      user = a
+    elif o == "--password" and not a.startswith('--'):
+      password = a
+    elif o == "--snapshot_dir" and not a.startswith('--'):
+      snapshot_dir = a
+    elif o == "--debug":
+      debug = True
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if not clusters:
+    print >> sys.stderr, '--clusters option must be set'
+    usage()
+    sys.exit(2)
+
+  if not user or not password:
+    print >> sys.stderr, '--user and --password options must be set'
+    usage()
+    sys.exit(2)
+
+  for cluster in clusters:
+    telemetry = Telemetry('inventory', cluster)
+    try:
+      with telemetry.phase('connect'):
+        conn = pywbem.WBEMConnection(os.environ.get('SVC_WBEM_URL', 'https://%s') % cluster, (user, password), 'root/ibm')
+        conn.debug = True
+
+      with telemetry.phase('names'):
+        snapshot = enumInventory(conn, cluster)
+      telemetry.count('elements', sum(len(snapshot[t]) for t in INVENTORY_CLASSES))
+
+      with telemetry.phase('cache'):
+        saveSnapshot(snapshot_dir, snapshot)
+      if debug:
+        print >> sys.stderr, '%s: %s' % (cluster, ', '.join('%d %ss' % (len(snapshot[t]), t) for t in sorted(INVENTORY_CLASSES)))
+    except Exception, err:
+      print >> sys.stderr, 'Inventory of %s failed: %s' % (cluster, str(err))
+
+    #collector self-telemetry: svc.collector.*[inventory,*]
+    print '\n'.join(telemetry.lines())
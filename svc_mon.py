@@ -8,28 +8,36 @@
 # Returns storage pool/volume space stats in zabbix_sender format (http://www.zabbix.com/documentation/2.2/manpages/zabbix_sender):
 # <hostname> <key> <timestamp> <value>
 #
+# Collector self-telemetry is returned as svc.collector.*[mon,*] items (see svc_telemetry.py)
+#
 # Use with template _Special_Storwize_Perf
 #
 # Data is collected with SVC CIM provider (WBEM):
 # http://pic.dhe.ibm.com/infocenter/storwize/unified_ic/index.jsp?topic=%2Fcom.ibm.storwize.v7000.unified.doc%2Fsvc_umlblockprofile.html
 # http://pic.dhe.ibm.com/infocenter/storwize/unified_ic/index.jsp?topic=%2Fcom.ibm.storwize.v7000.unified.doc%2Fsvc_cim_main.html
 #
-# Usage: svc_mon.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd>
+# Usage: svc_mon.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> [--inventory_dir <path> [--inventory_max_age <sec>]]
 #
 #   --debug = Enable debug output
 #   --clusters = Comma-separated Storwize node list (DNS name/IP)
 #   --user    = Storwize V7000 user account
 #   --password = Storwize password
+#   --inventory_dir = Directory of inventory snapshots written by svc_inventory.py. Status and capacity are taken from snapshot
+#                     instead of querying the cluster, unless snapshot is older than --inventory_max_age seconds (default 900).
+#                     Values are timestamped with snapshot time.
+#   SVC_WBEM_URL environment variable = CIM provider URL template, %s is replaced with cluster name (default https://%s)
 #
 import pywbem
-import getopt, sys
+import getopt, sys, os
 import datetime, time, calendar
+from svc_telemetry import Telemetry
+import svc_inventory
 
 def usage():
-  print >> sys.stderr, "Usage: svc_mon.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd>"
+  print >> sys.stderr, "Usage: svc_mon.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> [--inventory_dir <path> [--inventory_max_age <sec>]]"
 
 try:
-  opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug"])
+  opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug", "inventory_dir=", "inventory_max_age="])
 except getopt.GetoptError, err:
   print >> sys.stderr, str(err)
   usage()
@@ -39,6 +47,8 @@ debug = False
 clusters = []
 user = None
 password = None
+inventory_dir = None
+inventory_max_age = svc_inventory.DEFAULT_MAX_AGE
 
 for o, a in opts:
   if o == "--clusters" and not a.startswith('--'):
@@ -47,6 +57,10 @@ for o, a in opts:
     user = a
   elif o == "--password" and not a.startswith('--'):
     password = a
+  elif o == "--inventory_dir" and not a.startswith('--'):
+    inventory_dir = a
+  elif o == "--inventory_max_age":
+    inventory_max_age = int(a)
   elif o == "--debug":
     debug = True
   elif o in ("-h", "--help"):
@@ -72,15 +86,23 @@ if not user or not password:
 #####################################################################################################
 
 for cluster in clusters:
-  ''' connect to Storwize CIM provider '''
-  conn = pywbem.WBEMConnection('https://'+cluster, (user, password), 'root/ibm') 
-  conn.debug = True
-
-  pools = conn.ExecQuery('WQL', 'select * from IBMTSSVC_ConcreteStoragePool')
-  for pool in pools:  
-    timestamp = int(time.time())
-    poolID = pool.properties['PoolID'].value
-    
+  telemetry = Telemetry('mon', cluster)
+
+  def connect():
+    ''' connect to Storwize CIM provider '''
+    with telemetry.phase('connect'):
+      conn = pywbem.WBEMConnection(os.environ.get('SVC_WBEM_URL', 'https://%s') % cluster, (user, password), 'root/ibm') 
+      conn.debug = True
+    return conn
+
+  ''' status and capacity are taken from inventory snapshot if it is fresh, values are timestamped with snapshot time '''
+  with telemetry.phase('stats'):
+    inventory = svc_inventory.getInventory(inventory_dir, cluster, connect, inventory_max_age)
+  timestamp = inventory['refreshed']
+
+  pools = inventory['pool']
+  telemetry.count('elements', len(pools))
+  for poolID, pool in sorted(pools.items()):
     #<hostname> <key> <timestamp> <value>
     # svc1-blk svc.pool.nativeStatus[8] 1356526942 1
     # svc1-blk svc.pool.overallocation[8] 1356526942 2.2936499048
@@ -92,25 +114,27 @@ for cluster in clusters:
     def printPool(key, value):
       print '%s svc.pool.%s[%s] %d %s' % ( cluster, key, poolID, timestamp, value )
 
-    printPool( 'nativeStatus', pool.properties['nativeStatus'].value)
-    printPool( 'overallocation', float(pool.properties['VirtualCapacity'].value)/float(pool.properties['TotalManagedSpace'].value)*100 )
-    printPool( 'totalSpace', pool.properties['TotalManagedSpace'].value )
-    printPool( 'usedCapacity', pool.properties['UsedCapacity'].value )
-    printPool( 'realCapacity', pool.properties['RealCapacity'].value )
-    printPool( 'freeCapacity', pool.properties['TotalManagedSpace'].value - pool.properties['RealCapacity'].value )
+    printPool( 'nativeStatus', pool['status'])
+    printPool( 'overallocation', float(pool['virtualCapacity'])/float(pool['capacity'])*100 )
+    printPool( 'totalSpace', pool['capacity'] )
+    printPool( 'usedCapacity', pool['usedCapacity'] )
+    printPool( 'realCapacity', pool['realCapacity'] )
+    printPool( 'freeCapacity', pool['capacity'] - pool['realCapacity'] )
 
 
   #<hostname> <key> <timestamp> <value>
   #svc1-blk svc.volume.nativeStatus[35] 1365594894 1
-  for vol in conn.ExecQuery('WQL', 'select DeviceID, NativeStatus from IBMTSSVC_StorageVolume'):
-    print '%s svc.volume.%s[%s] %d %s' % ( cluster, 'nativeStatus', vol.properties['DeviceID'].value, timestamp, vol.properties['NativeStatus'].value )
+  vols = inventory['volume']
+  telemetry.count('elements', len(vols))
+  for deviceID, vol in sorted(vols.items()):
+    print '%s svc.volume.%s[%s] %d %s' % ( cluster, 'nativeStatus', deviceID, timestamp, vol['status'] )
 
   #<hostname> <key> <timestamp> <value>
   #svc1-blk svc.mdisk.nativeStatus[35] 1365594894 1
-  for md in conn.ExecQuery('WQL', 'select DeviceID, NativeStatus from IBMTSSVC_BackendVolume'):
-    print '%s svc.mdisk.%s[%s] %d %s' % ( cluster, 'nativeStatus', md.properties['DeviceID'].value, timestamp, md.properties['NativeStatus'].value )
-    
-   
-
-
+  mdisks = inventory['mdisk']
+  telemetry.count('elements', len(mdisks))
+  for deviceID, md in sorted(mdisks.items()):
+    print '%s svc.mdisk.%s[%s] %d %s' % ( cluster, 'nativeStatus', deviceID, timestamp, md['status'] )
 
+  #collector self-telemetry: svc.collector.*[mon,*]
+  print '\n'.join(telemetry.lines())
@@ -21,240 +21,581 @@
 #
 # Item values: Normal(0),  Degraded(1),  Error(2);
 #
+# With --statefile GUI session cookies and the last seen event id of each cluster are kept between runs
+# (file is locked while it is read and updated, concurrent runs for other clusters may share it):
+# only events newer than the last seen one are requested, login is repeated only when GUI rejects the session.
+# The whole event backlog is read once after each login (event ids start again after cluster restart).
+# Poll response is parsed while it is read, only ConnectionStatusEvent events are kept in memory
+# (backlog of other events may be large).
+#
+# Several clusters are polled concurrently with --targets, values of all clusters are sent to Zabbix at once.
+# A failed cluster does not stop the others, exit status is 1 if any cluster failed.
+#
+# Usage: svc_mon2.py [--debug] --svc <Storwize name|IP> [--unified] --user <username> --password <pwd> [--host <Storwize host in Zabbix=svc>] [--statefile <path>] [--timeout <sec>] [--deadline <sec>]
+#        svc_mon2.py [--debug] --targets <svc>[/<host>][/unified][,...] --user <username> --password <pwd> [--statefile <path>] [--timeout <sec>] [--deadline <sec>]
+#
+#   --targets = Comma-separated list of clusters: <Storwize name|IP>[/<Storwize host in Zabbix=svc>][/unified]
+#   --statefile = Path to session state file (default: no file, login and read all events on every run)
+#   --timeout = Connect and read timeout of each GUI request in seconds (default 30)
+#   --deadline = Time limit of polling of each cluster in seconds (default 120), clusters not polled by then are reported as failed
 #
 # Requirements:
 #  requests, zbxsend
 #
 ######################################################################################################
-import getopt, sys, logging, pprint, datetime
-import requests, json
+import getopt, sys, os, fcntl, time, logging, pprint, datetime, threading, traceback
+import requests, json, re, codecs
 from zbxsend import Metric, send_to_zabbix
 
 SVC_CONN_STATUS_TMPL='custom.svc.status.%s'
 UNIFIED_CONN_STATUS_TMPL='custom.svc.unified.status.%s'
+DEFAULT_TIMEOUT = 30 # seconds
+DEFAULT_DEADLINE = 120 # seconds
 
 def usage():
-  print >> sys.stderr, "Usage: svc_mon2.py [--debug] --svc <Storwize name|IP> [--unified] --user <username> --password <pwd> [--host <Storwize host in Zabbix=svc>]"
+  print >> sys.stderr, "Usage: svc_mon2.py [--debug] --svc <Storwize name|IP> [--unified] --user <username> --password <pwd> [--host <Storwize host in Zabbix=svc>] [--statefile <path>] [--timeout <sec>] [--deadline <sec>]"
+  print >> sys.stderr, "       svc_mon2.py [--debug] --targets <svc>[/<host>][/unified][,...] --user <username> --password <pwd> [--statefile <path>] [--timeout <sec>] [--deadline <sec>]"
 
 def debug_print(message):
   if debug:
     print >> sys.stderr, message
 
-try:
-  opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "svc=", "unified", "user=", "password=", "host", "debug"])
-except getopt.GetoptError, err:
-  print >> sys.stderr, str(err)
-  usage()
-  sys.exit(2)
-
-debug = False
-svc = None
-unified = False
-user = None
-password = None
-host = None
-for o, a in opts:
-  if o == "--svc" and not a.startswith('--'):
-    svc = a
-  elif o == "--unified":
-    unified = True
-  elif o == "--user" and not a.startswith('--'):
-    user = a
-  elif o == "--password" and not a.startswith('--'):
-    password = a
-  elif o == "--host" and not a.startswith('--'):
-    host = a
-  elif o == "--debug":
-    debug = True
-  elif o in ("-h", "--help"):
-    usage()
-    sys.exit()
+class RPCError(Exception):
+  pass
 
-if not svc:
-  print >> sys.stderr, '--svc option must be set'
-  usage()
-  sys.exit(2)
+def makeTarget(svc, host=None, unified=False):
+  ''' @return dict: svc, host (default zabbix host object name = svc name), unified, url (GUI API url) '''
+  if unified:
+    url = 'https://%s:1081' % svc
+  else:
+    url = 'https://%s' % svc
+  return {'svc': svc, 'host': host or svc, 'unified': unified, 'url': url}
 
-if not user or not password:
-  print >> sys.stderr, '--user and --password options must be set'
-  usage()
-  sys.exit(2)
+def parseTarget(spec):
+  ''' <svc>[/<host>][/unified] -> target '''
+  parts = spec.split('/')
+  names = [p for p in parts[1:] if p != 'unified']
+  return makeTarget(parts[0], names[0] if names else None, 'unified' in parts[1:])
 
-#default zabbix host object name = svc name
-host = host or svc
-  
 ######################################################################################################
 
-# build API url
-if unified:
-  svc_url = 'https://%s:1081' % svc
-else:
-  svc_url = 'https://%s' % svc
-debug_print('Connecting to '+svc_url)
+def lockState():
+  ''' Exclusive lock of state file, runs for other clusters (block and unified, --targets) may share the file.
+      Lock is released when returned file is closed '''
+  lock = open(statefile + '.lock', 'a')
+  fcntl.flock(lock, fcntl.LOCK_EX)
+  return lock
 
-# use shared session with auth cookies
-s = requests.Session()
+def readState():
+  if os.path.exists(statefile):
+    return json.load(open(statefile, 'r'))
+  return {}
 
-# authenticate user
-r = s.post(svc_url+'/login', params={'login': user, 'password': password, 'tzoffset': '-240'}, verify=False)
-if debug:
-  print "Auth request status: ", r.status_code
-  
-# check authentication response for errors
-r.raise_for_status()
+def loadState():
+  ''' @return dict: svc url -> {user, cookies, lastEventId} '''
+  if not statefile:
+    return {}
+  try:
+    lock = lockState()
+    try:
+      return readState()
+    finally:
+      lock.close()
+  except Exception, err:
+    print >> sys.stderr, "Can't load state:", str(err)
+  return {}
 
+def saveState(updates):
+  ''' Merge states of polled clusters (svc url -> state) into state file.
+      File is read again under lock, so states saved meanwhile by other runs are kept.
+      File is replaced atomically, it holds session cookies so it is readable by owner only '''
+  if not statefile:
+    return
+  try:
+    lock = lockState()
+    try:
+      try:
+        state = readState()
+      except ValueError, err:
+        print >> sys.stderr, "Can't load state:", str(err)
+        state = {}
+      state.update(updates)
+      fd = os.open(statefile + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+      f = os.fdopen(fd, 'w')
+      json.dump(state, f)
+      f.close()
+      os.rename(statefile + '.tmp', statefile)
+    finally:
+      lock.close()
+  except Exception, err:
+    print >> sys.stderr, "Can't save state:", str(err)
 
-# prepare JSON-RPC to "public static com.ibm.evo.events.PollingManager.PollResponse poll(long lastEventId, boolean blocking, long pid)"
-rpc_request = {}
-if unified:
-  #{"clazz":"com.ibm.ifs.gui.rpc.IfsRPCRequest","methodClazz":"com.ibm.evo.events.PollingManager","methodName":"poll","methodArgs":[0,false,0]}
-  rpc_request['clazz'] = 'com.ibm.ifs.gui.rpc.IfsRPCRequest'
-else:
-  #{"clazz":"com.ibm.evo.rpc.RPCRequest","methodClazz":"com.ibm.evo.events.PollingManager","methodName":"poll","methodArgs":[0,false,0]}
-  rpc_request['clazz'] = 'com.ibm.evo.rpc.RPCRequest'
+CONNECTION_STATUS_EVENTS = ['com.ibm.sonas.gui.events.pods.ConnectionStatusEvent', 'com.ibm.svc.gui.events.ConnectionStatusEvent']
+READ_CHUNK = 65536
 
-rpc_request['methodClazz'] = 'com.ibm.evo.events.PollingManager'
-rpc_request['methodName'] = 'poll'
-rpc_request['methodArgs'] = (1, False, 0) #lastEventId=1 to get all fresh events every time
+class PollResponseParser(object):
+  ''' Incremental parser of PollingManager.poll JSON-RPC response.
+      Response text is fed in chunks, non-standard "\<newline>" escapes are removed on the fly.
+      Members of the top-level object and of its "result" object are parsed one by one, elements of result.events
+      one at a time, all values are parsed by C scanner of json module (JSONDecoder.raw_decode).
+      Events are dropped right after their top-level "id" is read, unless their clazz is one of CONNECTION_STATUS_EVENTS.
+      Memory use depends on the largest single event and on the kept events, not on the number of events.
+      Response that is not a JSON object is kept as is and parsed by response(). '''
+  WHITESPACE = re.compile(r'[ \t\n\r]*')
+  NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
 
-# get Storwize status  
-r = s.post(svc_url+'/RPCAdapter', headers={'content-type': 'application/json'}, data=json.dumps(rpc_request), verify=False)
-  
-if debug:
-  #print r.request.headers
-  #print r.headers
-  #pprint.pprint(r.cookies)
-  #print r.text
-  print "RPC request status: ", r.status_code
-  
-# check rpc response for errors
-r.raise_for_status()
+  def __init__(self):
+    self.decoder = json.JSONDecoder()
+    self.carry = u''         # trailing backslash of previous chunk, may start "\<newline>"
+    self.buffer = u''        # text not parsed yet
+    self.need = 0            # length of buffer needed to retry parsing of incomplete value
+    self.state = 'start'     # expected token: start, key, colon, value, comma, event, event_comma, end or raw (not an object)
+    self.first = False       # current object or array has no members yet
+    self.objects = []        # [object, key of current member] of open top-level and result objects
+    self.root = None         # top-level object
+    self.events = []         # kept events
+    self.count = 0           # number of events read
+    self.last_id = None      # max top-level "id" of events
+
+  def feed(self, chunk, final=False):
+    text = self.carry + chunk
+    self.carry = u''
+    if text.endswith(u'\\') and not final:
+      ''' "\<newline>" may continue in the next chunk '''
+      text, self.carry = text[:-1], u'\\'
+    self.buffer += text.replace(u'\\\n', u'')
+    if self.state != 'raw' and (final or len(self.buffer) >= self.need):
+      self.buffer = self.buffer[self.parse(final):]
+
+  def parse(self, final):
+    ''' Parse buffer as far as possible, return position of unparsed text '''
+    buf = self.buffer
+    n = len(buf)
+    pos = 0
+    while True:
+      pos = self.WHITESPACE.match(buf, pos).end()
+      if pos == n:
+        return pos
+      c = buf[pos]
+      state = self.state
+      if state == 'start':
+        if c != '{':
+          self.state = 'raw'
+          return 0
+        self.root = {}
+        self.open(self.root)
+        pos += 1
+      elif state == 'key' and c == '}' and self.first:
+        pos = self.close(pos)
+      elif state == 'key':
+        if c != '"':
+          raise ValueError('Expecting property name at char %d' % pos)
+        key, end = self.decode(buf, pos, final)
+        if end is None:
+          return pos
+        self.objects[-1][1] = key
+        self.state = 'colon'
+        pos = end
+      elif state == 'colon':
+        if c != ':':
+          raise ValueError('Expecting : delimiter at char %d' % pos)
+        self.state = 'value'
+        pos += 1
+      elif state == 'value':
+        obj, key = self.objects[-1]
+        path = [o[1] for o in self.objects]
+        if c == '{' and path == ['result']:
+          obj[key] = {}
+          self.open(obj[key])
+          pos += 1
+        elif c == '[' and path == ['result', 'events']:
+          obj[key] = self.events
+          self.state = 'event'
+          self.first = True
+          pos += 1
+        else:
+          value, end = self.decode(buf, pos, final)
+          if end is None:
+            return pos
+          obj[key] = value
+          self.state = 'comma'
+          pos = end
+      elif state == 'comma':
+        if c == ',':
+          self.state = 'key'
+          self.first = False
+          pos += 1
+        elif c == '}':
+          pos = self.close(pos)
+        else:
+          raise ValueError('Expecting , delimiter at char %d' % pos)
+      elif state == 'event' and c == ']' and self.first:
+        self.state = 'comma'
+        pos += 1
+      elif state == 'event':
+        event, end = self.decode(buf, pos, final)
+        if end is None:
+          return pos
+        self.endEvent(event)
+        self.state = 'event_comma'
+        pos = end
+      elif state == 'event_comma':
+        if c == ',':
+          self.state = 'event'
+          self.first = False
+          pos += 1
+        elif c == ']':
+          self.state = 'comma'
+          pos += 1
+        else:
+          raise ValueError('Expecting , delimiter at char %d' % pos)
+      else:
+        raise ValueError('Extra data at char %d' % pos)
+
+  def open(self, obj):
+    self.objects.append([obj, None])
+    self.state = 'key'
+    self.first = True
+
+  def close(self, pos):
+    self.objects.pop()
+    self.state = 'comma' if self.objects else 'end'
+    return pos + 1
 
-# parse JSON-RPC response into JSON object tree
-try:
-  #fix non-standard "\<newline>" escapes in JSON-RPC response
-  json_text = r.text.replace(u'\\\n',u'')
+  def decode(self, buf, pos, final):
+    ''' Return (value, end position) of JSON value at pos or (None, None) if value may continue in the next chunk '''
+    try:
+      value, end = self.decoder.raw_decode(buf, pos)
+      ''' number followed by end of buffer or by a number tail ("1." of "1.5") may continue in the next chunk '''
+      if final or self.NUMBER_TAIL.match(buf, end).end() < len(buf):
+        self.need = 0
+        return value, end
+    except ValueError:
+      if final:
+        raise
+    ''' value is parsed again when buffer is twice as long, so a large value is not parsed for every chunk '''
+    self.need = 2 * (len(buf) - pos)
+    return None, None
+
+  def endEvent(self, event):
+    self.count += 1
+    if isinstance(event, dict):
+      event_id = event.get('id')
+      if isinstance(event_id, (int, long)) and not isinstance(event_id, bool):
+        self.last_id = max(self.last_id, event_id) if self.last_id is not None else event_id
+      if event.get('clazz') in CONNECTION_STATUS_EVENTS:
+        self.events.append(event)
+
+  def response(self):
+    ''' Return parsed response, result.events holds kept events only. Raises ValueError if response is not JSON '''
+    if self.state == 'raw':
+      return json.loads(self.buffer)
+    if self.state != 'end':
+      raise ValueError('Unexpected end of response')
+    return self.root
+
+def requestTimeout():
+  ''' Timeout of the next GUI request or read: --timeout, but not past deadline of the run '''
+  left = deadline - time.time()
+  if left <= 0:
+    raise RPCError('Deadline of %s seconds exceeded' % run_deadline)
+  return min(timeout, left)
+
+def login(s, target):
+  ''' authenticate user, session cookies are set by response '''
+  r = s.post(target['url']+'/login', params={'login': user, 'password': password, 'tzoffset': '-240'}, verify=False, timeout=requestTimeout())
+  debug_print('%s: auth request status: %s' % (target['svc'], r.status_code))
   
-  json_data = json.loads(json_text)
+  # check authentication response for errors
+  r.raise_for_status()
+
+def poll(s, target, lastEventId, saved_session=False):
+  ''' Return (parsed JSON-RPC response of PollingManager.poll, number of events, max event id)
+      or None if saved session is not authenticated any more.
+      Response is parsed while it is read, result.events holds ConnectionStatusEvent events only '''
+  # prepare JSON-RPC to "public static com.ibm.evo.events.PollingManager.PollResponse poll(long lastEventId, boolean blocking, long pid)"
+  rpc_request = {}
+  if target['unified']:
+    #{"clazz":"com.ibm.ifs.gui.rpc.IfsRPCRequest","methodClazz":"com.ibm.evo.events.PollingManager","methodName":"poll","methodArgs":[0,false,0]}
+    rpc_request['clazz'] = 'com.ibm.ifs.gui.rpc.IfsRPCRequest'
+  else:
+    #{"clazz":"com.ibm.evo.rpc.RPCRequest","methodClazz":"com.ibm.evo.events.PollingManager","methodName":"poll","methodArgs":[0,false,0]}
+    rpc_request['clazz'] = 'com.ibm.evo.rpc.RPCRequest'
 
-  #if debug:
-    #print json.dumps(json_data, sort_keys = True, indent = 4).decode('utf-8')
+  rpc_request['methodClazz'] = 'com.ibm.evo.events.PollingManager'
+  rpc_request['methodName'] = 'poll'
+  rpc_request['methodArgs'] = (lastEventId, False, 0) #events newer than lastEventId
+
+  # get Storwize status  
+  r = s.post(target['url']+'/RPCAdapter', headers={'content-type': 'application/json'}, data=json.dumps(rpc_request), verify=False, allow_redirects=False, stream=True, timeout=requestTimeout())
     
-except ValueError as e:
-  print >> sys.stderr, 'ERROR: ValueError raised on JSON parsing: %s' % e
-  print >> sys.stderr, json_text
-  exit(1)
-
-'''
-Storwize Unified poll response:
-{
-    "clazz": "com.ibm.evo.rpc.RPCResponse", 
-    "messages": null, 
-    "result": {
-        "clazz": "com.ibm.evo.events.PollResponse", 
-        "events": [
-            {
-                "arguments": [
-                    "12402640704823473333"
-                ], 
-                "clazz": "com.ibm.sonas.gui.events.pods.ConnectionStatusEvent", 
-                "id": 359877, 
-                "items": {
-                    "clusterConfig": "1", 
-                    "clusterManagement": "0", 
-                    "fileServices": "0", 
-                    "fileSystem": "0", 
-                    "hardware": "0", 
-                    "network": "0", 
-                    "nodeState": "0", 
-                    "performance": "0", 
-                    "storageConnection": "0", 
-                    "unknown": "0"
-                }, 
-                "timestamp": 1409662691741, 
-                "topic": "CONNECTION_STATUS"
-            }, 
-            {
-                "arguments": null, 
-                "clazz": "com.ibm.evo.events.ResourceEvent",
-                ...
-            }...
-}
-
-Storwize block module poll response:
-{
-    "clazz": "com.ibm.evo.rpc.RPCResponse", 
-    "messages": null, 
-    "result": {
-        "clazz": "com.ibm.evo.events.PollResponse", 
-        "events": [
-            {
-                "arguments": null, 
-                "ccuInProgress": false, 
-                "clazz": "com.ibm.svc.gui.events.ConnectionStatusEvent", 
-                "externalStorage": "0", 
-                "id": 4202319, 
-                "internalStorage": "0", 
-                "remotePartnerships": "0", 
-                "timestamp": 1409819425770, 
-                "topic": "CONNECTION_STATUS", 
-                "trials": "0"
-            },
-            {}...
-}
-'''
-#parse RPCResponse
-if json_data.get('clazz') != 'com.ibm.evo.rpc.RPCResponse':
-  print >> sys.stderr, 'ERROR: Unexpected class "%s" in RPC response' % json_data.get('clazz')
-  print >> sys.stderr, json.dumps(json_data, sort_keys = True, indent = 4).decode('utf-8')
-  exit(1)
-
-if not json_data.get('result'):
-  print >> sys.stderr, "ERROR: RPC returned no result"
-  if json_data.get('messages'): print >> sys.stderr, json_data.get('messages')
-  exit(1)
-
-#parse PollResponse  
-if json_data['result'].get('clazz') != 'com.ibm.evo.events.PollResponse':
-  print >> sys.stderr, 'ERROR: Unexpected class "%s" in RPC response' % json_data['result'].get('clazz')
-  print >> sys.stderr, json.dumps(json_data, sort_keys = True, indent = 4).decode('utf-8')
-  exit(1)
-
-zabbix_metrics = []
-events = json_data['result']['events']
-for e in events:
-  
-  #Storwize Unified cluster status
-  if e.get('clazz') == 'com.ibm.sonas.gui.events.pods.ConnectionStatusEvent':
-    timestamp = float(e['timestamp'])/1000
-    debug_print('%s %s %s' % (e.get('clazz'), e.get('id'), str(datetime.datetime.fromtimestamp(timestamp)) ) )
-    for i in e['items'].keys():
-      zabbix_item_key = UNIFIED_CONN_STATUS_TMPL % i
-      zabbix_item_value = e['items'][i]
-      #debug_print('host=%s, key=%s, value=%s, timestamp=%s' % (host, zabbix_item_key, zabbix_item_value, str(datetime.datetime.fromtimestamp(timestamp))))
-      zabbix_metrics.append( Metric(host, zabbix_item_key, zabbix_item_value, timestamp))
-
-  #Storwize block cluster status
-  if e.get('clazz') == 'com.ibm.svc.gui.events.ConnectionStatusEvent':
-    timestamp = float(e['timestamp'])/1000
-    debug_print('%s %s %s' % (e.get('clazz'), e.get('id'), str(datetime.datetime.fromtimestamp(timestamp)) ) )
-    for i in ['externalStorage', 'internalStorage', 'remotePartnerships']:
-      zabbix_item_key = SVC_CONN_STATUS_TMPL % i
-      zabbix_item_value = e[i]
-      #debug_print('host=%s, key=%s, value=%s, timestamp=%s' % (host, zabbix_item_key, zabbix_item_value, str(datetime.datetime.fromtimestamp(timestamp))))
-      zabbix_metrics.append( Metric(host, zabbix_item_key, zabbix_item_value, timestamp))
-
-if debug:
-  for m in zabbix_metrics:
-    print str(m)
-
-#send data to zabbix with zbxsend module
-if len(zabbix_metrics):
+  debug_print('%s: RPC request status: %s' % (target['svc'], r.status_code))
+
+  # expired session is redirected to login page or rejected
+  if saved_session and r.status_code in (301, 302, 303, 307, 401, 403):
+    return None
+    
+  # check rpc response for errors
+  r.raise_for_status()
+
+  # parse JSON-RPC response into JSON object tree while it is read
+  parser = PollResponseParser()
+  decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')('replace')
+  try:
+    for chunk in r.iter_content(READ_CHUNK):
+      ''' read timeout applies to each read, a slowly trickling response is stopped by the deadline '''
+      requestTimeout()
+      parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode('', True), final=True)
+    json_data = parser.response()
+      
+  except ValueError as e:
+    if saved_session:
+      ''' login page instead of JSON '''
+      debug_print('%s: not a JSON response, session expired?' % target['svc'])
+      return None
+    print >> sys.stderr, parser.buffer
+    raise RPCError('ValueError raised on JSON parsing: %s' % e)
+
+  if saved_session and not json_data.get('result'):
+    debug_print('%s: RPC returned no result, session expired?' % target['svc'])
+    return None
+  return json_data, parser.count, parser.last_id
+
+def monitorTarget(target, state, results):
+  ''' Poll events of target newer than the last seen one, append (target, Metric list, new state of target) to results '''
+  svc_url = target['url']
+  debug_print('Connecting to '+svc_url)
+
+  # use session with auth cookies, reuse cookies of the previous run
+  # login and poll requests of the session share a keep-alive connection
+  cluster_state = state.get(svc_url)
+  if not cluster_state or cluster_state.get('user') != user:
+    cluster_state = {'user': user, 'cookies': {}, 'lastEventId': 1}
+  cluster_state = dict(cluster_state)
+  s = requests.Session()
+  requests.utils.add_dict_to_cookiejar(s.cookies, cluster_state['cookies'])
+
+  polled = None
+  if cluster_state['cookies']:
+    debug_print('%s: polling events after %s with saved session' % (target['svc'], cluster_state['lastEventId']))
+    polled = poll(s, target, cluster_state['lastEventId'], saved_session=True)
+
+  if polled is None:
+    ''' new session reads the whole event backlog: lastEventId=1 to get all fresh events '''
+    s.cookies.clear()
+    login(s, target)
+    cluster_state['lastEventId'] = 1
+    polled = poll(s, target, cluster_state['lastEventId'])
+    if polled is None:
+      raise RPCError('RPC request rejected after login')
+  json_data, events_read, last_id = polled
+
+  '''
+  Storwize Unified poll response:
+  {
+      "clazz": "com.ibm.evo.rpc.RPCResponse", 
+      "messages": null, 
+      "result": {
+          "clazz": "com.ibm.evo.events.PollResponse", 
+          "events": [
+              {
+                  "arguments": [
+                      "12402640704823473333"
+                  ], 
+                  "clazz": "com.ibm.sonas.gui.events.pods.ConnectionStatusEvent", 
+                  "id": 359877, 
+                  "items": {
+                      "clusterConfig": "1", 
+                      "clusterManagement": "0", 
+                      "fileServices": "0", 
+                      "fileSystem": "0", 
+                      "hardware": "0", 
+                      "network": "0", 
+                      "nodeState": "0", 
+                      "performance": "0", 
+                      "storageConnection": "0", 
+                      "unknown": "0"
+                  }, 
+                  "timestamp": 1409662691741, 
+                  "topic": "CONNECTION_STATUS"
+              }, 
+              {
+                  "arguments": null, 
+                  "clazz": "com.ibm.evo.events.ResourceEvent",
+                  ...
+              }...
+  }
+
+  Storwize block module poll response:
+  {
+      "clazz": "com.ibm.evo.rpc.RPCResponse", 
+      "messages": null, 
+      "result": {
+          "clazz": "com.ibm.evo.events.PollResponse", 
+          "events": [
+              {
+                  "arguments": null, 
+                  "ccuInProgress": false, 
+                  "clazz": "com.ibm.svc.gui.events.ConnectionStatusEvent", 
+                  "externalStorage": "0", 
+                  "id": 4202319, 
+                  "internalStorage": "0", 
+                  "remotePartnerships": "0", 
+                  "timestamp": 1409819425770, 
+                  "topic": "CONNECTION_STATUS", 
+                  "trials": "0"
+              },
+              {}...
+  }
+  '''
+  #parse RPCResponse
+  if json_data.get('clazz') != 'com.ibm.evo.rpc.RPCResponse':
+    print >> sys.stderr, json.dumps(json_data, sort_keys = True, indent = 4).decode('utf-8')
+    raise RPCError('Unexpected class "%s" in RPC response' % json_data.get('clazz'))
+
+  if not json_data.get('result'):
+    if json_data.get('messages'): print >> sys.stderr, json_data.get('messages')
+    raise RPCError('RPC returned no result')
+
+  #parse PollResponse  
+  if json_data['result'].get('clazz') != 'com.ibm.evo.events.PollResponse':
+    print >> sys.stderr, json.dumps(json_data, sort_keys = True, indent = 4).decode('utf-8')
+    raise RPCError('Unexpected class "%s" in RPC response' % json_data['result'].get('clazz'))
+
+  metrics = []
+  events = json_data['result']['events'] or []
+  if last_id is not None:
+    ''' ids of all events, including skipped ones '''
+    cluster_state['lastEventId'] = max(cluster_state['lastEventId'], last_id)
+  for e in events:
+    #Storwize Unified cluster status
+    if e.get('clazz') == 'com.ibm.sonas.gui.events.pods.ConnectionStatusEvent':
+      timestamp = float(e['timestamp'])/1000
+      debug_print('%s: %s %s %s' % (target['svc'], e.get('clazz'), e.get('id'), str(datetime.datetime.fromtimestamp(timestamp)) ) )
+      for i in e['items'].keys():
+        zabbix_item_key = UNIFIED_CONN_STATUS_TMPL % i
+        zabbix_item_value = e['items'][i]
+        #debug_print('host=%s, key=%s, value=%s, timestamp=%s' % (target['host'], zabbix_item_key, zabbix_item_value, str(datetime.datetime.fromtimestamp(timestamp))))
+        metrics.append( Metric(target['host'], zabbix_item_key, zabbix_item_value, timestamp))
+
+    #Storwize block cluster status
+    if e.get('clazz') == 'com.ibm.svc.gui.events.ConnectionStatusEvent':
+      timestamp = float(e['timestamp'])/1000
+      debug_print('%s: %s %s %s' % (target['svc'], e.get('clazz'), e.get('id'), str(datetime.datetime.fromtimestamp(timestamp)) ) )
+      for i in ['externalStorage', 'internalStorage', 'remotePartnerships']:
+        zabbix_item_key = SVC_CONN_STATUS_TMPL % i
+        zabbix_item_value = e[i]
+        #debug_print('host=%s, key=%s, value=%s, timestamp=%s' % (target['host'], zabbix_item_key, zabbix_item_value, str(datetime.datetime.fromtimestamp(timestamp))))
+        metrics.append( Metric(target['host'], zabbix_item_key, zabbix_item_value, timestamp))
+
+  debug_print('%s: %d new events, %d status events, last event id %s' % (target['svc'], events_read, len(events), cluster_state['lastEventId']))
+  cluster_state['cookies'] = requests.utils.dict_from_cookiejar(s.cookies)
+  with results_lock:
+    results.append((target, metrics, cluster_state))
+
+def monitor(target, state, results):
+  try:
+    monitorTarget(target, state, results)
+  except Exception:
+    ''' traceback is printed at once, so tracebacks of threads are not mixed '''
+    sys.stderr.write('ERROR: Monitoring of %s failed:\n%s' % (target['url'], traceback.format_exc()))
+
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "svc=", "unified", "user=", "password=", "host=", "debug", "statefile=", "targets=", "timeout=", "deadline="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  debug = False
+  svc = None
+  unified = False
+  user = None
+  password = None
+  host = None
+  statefile = None
+  targets = []
+  timeout = DEFAULT_TIMEOUT
+  run_deadline = DEFAULT_DEADLINE
+  for o, a in opts:
+    if o == "--svc" and not a.startswith('--'):
+      svc = a
+    elif o == "--unified":
+      unified = True
+    elif o == "--user" and not a.startswith('--'):
+      user = a
+    elif o == "--password" and not a.startswith('--'):
+      password = a
+    elif o == "--host" and not a.startswith('--'):
+      host = a
+    elif o == "--statefile" and not a.startswith('--'):
+      statefile = a
+    elif o == "--targets" and not a.startswith('--'):
+      targets.extend(parseTarget(t) for t in a.split(',') if t)
+    elif o == "--timeout":
+      timeout = float(a)
+    elif o == "--deadline":
+      run_deadline = float(a)
+    elif o == "--debug":
+      debug = True
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if svc:
+    targets.append(makeTarget(svc, host, unified))
+
+  if not targets:
+    print >> sys.stderr, '--svc or --targets option must be set'
+    usage()
+    sys.exit(2)
+
+  if not user or not password:
+    print >> sys.stderr, '--user and --password options must be set'
+    usage()
+    sys.exit(2)
+
+  ''' clusters are polled concurrently, values of all clusters are sent with one zabbix_sender connection '''
+  state = loadState()
+  results = []
+  results_lock = threading.Lock()
+  threads = []
+  deadline = time.time() + run_deadline
+  for target in targets:
+    t = threading.Thread(target=monitor, args=(target, state, results))
+    ''' thread still running after deadline does not keep the process alive '''
+    t.daemon = True
+    t.start()
+    threads.append(t)
+  for t in threads:
+    t.join(max(0, deadline - time.time()))
+  with results_lock:
+    finished = list(results)
+  for target, t in zip(targets, threads):
+    if t.is_alive():
+      print >> sys.stderr, 'ERROR: Monitoring of %s not finished in %s seconds' % (target['url'], run_deadline)
+
+  zabbix_metrics = []
+  updates = {}
+  for (target, metrics, cluster_state) in finished:
+    zabbix_metrics.extend(metrics)
+    updates[target['url']] = cluster_state
+  saveState(updates)
+
   if debug:
-    logging.basicConfig(level=logging.INFO)
-  else:
-    logging.basicConfig(level=logging.WARNING)
-  send_to_zabbix(zabbix_metrics, 'localhost', 10051)
+    for m in zabbix_metrics:
+      print str(m)
 
+  #send data to zabbix with zbxsend module
+  if len(zabbix_metrics):
+    if debug:
+      logging.basicConfig(level=logging.INFO)
+    else:
+      logging.basicConfig(level=logging.WARNING)
+    send_to_zabbix(zabbix_metrics, 'localhost', 10051)
 
-  
+  if len(finished) < len(targets):
+    sys.exit(1)
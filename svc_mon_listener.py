@@ -0,0 +1,343 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# IBM SVC/Storwize V7000 status change listener (event-driven alternative to svc_mon.py status polling)
+#
+# Subscribes to CIM indications of every cluster and returns volume/mdisk/pool NativeStatus in zabbix_sender format
+# (http://www.zabbix.com/documentation/2.2/manpages/zabbix_sender) only when status changes:
+# <hostname> <key> <timestamp> <value>
+# svc1-blk svc.mdisk.nativeStatus[35] 1365594894 6
+#
+# Indications:
+#   CIM_InstModification/CIM_InstCreation of IBMTSSVC_StorageVolume, IBMTSSVC_BackendVolume, IBMTSSVC_ConcreteStoragePool
+#     - status of SourceInstance is returned if it differs from the last known one
+#   CIM_InstDeletion of these classes - element is forgotten
+#   CIM_AlertIndication - cluster is reconciled within ALERT_DELAY seconds
+# Reconciliation enumerates status of all elements of cluster and returns all of them (backstop for lost indications and
+# for clusters whose CIM provider rejects subscriptions), it runs at start and every --reconcile seconds.
+# Subscriptions are created again after failed reconciliation and when any of them is missing in CIM provider (checked on
+# every reconciliation, e.g. after CIM provider restart). Subscriptions are owned by the listener and removed on exit,
+# subscriptions left by killed listener are recovered by the next one (same subscription manager ID).
+# Failed subscription or reconciliation is an error: it is logged and cluster is reconciled and subscribed again every
+# SUBSCRIBE_RETRY seconds (svc.collector.count[listener,subscribed] is 0 meanwhile).
+# Indications are matched to cluster by sender address (cluster DNS name and node/service IPs of its IP protocol endpoints)
+# or by SourceInstanceHost, indications of unknown senders are logged and ignored.
+#
+# Collector self-telemetry is returned as svc.collector.*[listener,*] items on every reconciliation (see svc_telemetry.py)
+#
+# Use with template _Special_Storwize_Perf
+#
+# Usage: svc_mon_listener.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> --listen_host <host> [--listen_port <port>] [--reconcile <sec>] [--inventory_dir <path>]
+#
+#   --debug = Enable debug output
+#   --clusters = Comma-separated Storwize node list (DNS name/IP)
+#   --user    = Storwize V7000 user account
+#   --password = Storwize password
+#   --listen_host = DNS name/IP of this host reachable from Storwize clusters (indication destination)
+#   --listen_port = HTTP port of indication listener (default 5990)
+#   --reconcile = Full status reconciliation interval in seconds (default 3600)
+#   --inventory_dir = Directory of inventory snapshots (see svc_inventory.py), reconciled inventory is written there
+#   SVC_WBEM_URL environment variable = CIM provider URL template, %s is replaced with cluster name (default https://%s)
+#
+import pywbem
+import getopt, sys, os, time, socket, signal, threading, Queue, traceback
+from svc_telemetry import Telemetry
+import svc_inventory
+
+def usage():
+  print >> sys.stderr, "Usage: svc_mon_listener.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> --listen_host <host> [--listen_port <port>] [--reconcile <sec>] [--inventory_dir <path>]"
+
+DEFAULT_LISTEN_PORT = 5990
+DEFAULT_RECONCILE = 3600
+ALERT_DELAY = 10 # seconds, alerts usually come in bursts
+SUBSCRIBE_RETRY = 600 # seconds, status polling interval of svc_mon.py
+SUBSCRIPTION_MANAGER_ID = 'svc_mon'
+FILTER_ID = 'svc_mon_listener_%d' # per INDICATION_QUERIES index, must not contain ':'
+
+''' CIM class -> element type (item key svc.<type>.nativeStatus[<id>]) and ID property '''
+STATUS_CLASSES = {
+  'IBMTSSVC_StorageVolume': ('volume', 'DeviceID'),
+  'IBMTSSVC_BackendVolume': ('mdisk', 'DeviceID'),
+  'IBMTSSVC_ConcreteStoragePool': ('pool', 'PoolID'),
+}
+
+INDICATION_QUERIES = ['SELECT * FROM CIM_InstModification WHERE SourceInstance ISA %s' % c for c in sorted(STATUS_CLASSES)] + \
+                     ['SELECT * FROM CIM_InstCreation WHERE SourceInstance ISA %s' % c for c in sorted(STATUS_CLASSES)] + \
+                     ['SELECT * FROM CIM_InstDeletion WHERE SourceInstance ISA %s' % c for c in sorted(STATUS_CLASSES)] + \
+                     ['SELECT * FROM CIM_AlertIndication']
+
+##############################################################
+def debug_print(message):
+  if debug:
+    print >> sys.stderr, message
+
+def output(lines):
+  ''' Print values in zabbix_sender format, stdout is a pipe to zabbix_sender in real-time mode '''
+  if lines:
+    with output_lock:
+      print '\n'.join(lines)
+      sys.stdout.flush()
+
+def statusLine(cluster, elementType, elementID, status, timestamp):
+  return '%s svc.%s.nativeStatus[%s] %d %s' % (cluster, elementType, elementID, timestamp, status)
+
+class ClusterState(object):
+  ''' Last known status of cluster elements and its indication subscription '''
+  def __init__(self, cluster):
+    self.cluster = cluster
+    self.addresses = set()
+    self.status = {} # (element type, id) -> NativeStatus
+    self.lock = threading.Lock()
+    self.subscription_manager = None
+    self.server_id = None
+    self.next_reconcile = 0
+    self.events = 0
+    self.changed = 0
+
+  def resolve(self, conn):
+    ''' Indications are matched to cluster by sender address. Indications may be sent from any node or service IP,
+        so addresses of cluster IP protocol endpoints are added to addresses of cluster DNS name '''
+    addresses = set()
+    try:
+      addresses.update(a[4][0] for a in socket.getaddrinfo(self.cluster, None))
+    except socket.error, err:
+      print >> sys.stderr, "Can't resolve %s: %s" % (self.cluster, str(err))
+    try:
+      for endpoint in conn.EnumerateInstances('CIM_IPProtocolEndpoint', PropertyList=['IPv4Address', 'IPv6Address']):
+        addresses.update(endpoint[p] for p in ('IPv4Address', 'IPv6Address') if endpoint.get(p))
+    except pywbem.Error, err:
+      print >> sys.stderr, "Can't enumerate IP addresses of %s, indications are matched by DNS name only: %s" % (self.cluster, str(err))
+    if addresses:
+      self.addresses = addresses
+    debug_print('%s: addresses %s' % (self.cluster, ', '.join(sorted(self.addresses))))
+
+##############################################################
+def connect(cluster):
+  conn = pywbem.WBEMConnection(os.environ.get('SVC_WBEM_URL', 'https://%s') % cluster, (user, password), 'root/ibm')
+  conn.debug = True
+  return conn
+
+def subscribe(state, conn):
+  ''' Register cluster with new subscription manager and subscribe listener to INDICATION_QUERIES.
+      Each subscription manager holds one cluster, so it is dropped even if its subscriptions can't be removed '''
+  subscription_manager = pywbem.WBEMSubscriptionManager(SUBSCRIPTION_MANAGER_ID)
+  server_id = conn.url
+  try:
+    subscription_manager.add_server(pywbem.WBEMServer(conn))
+    destinations = subscription_manager.add_listener_destinations(server_id, 'http://%s:%d' % (listen_host, listen_port))
+    for i, query in enumerate(INDICATION_QUERIES):
+      indication_filter = subscription_manager.add_filter(server_id, 'root/ibm', query, filter_id=FILTER_ID % i)
+      subscription_manager.add_subscriptions(server_id, indication_filter.path, [d.path for d in destinations])
+  except Exception:
+    ''' server is registered even if add_server fails '''
+    try:
+      subscription_manager.remove_server(server_id)
+    except Exception:
+      pass
+    raise
+  state.subscription_manager = subscription_manager
+  state.server_id = server_id
+  debug_print('%s: subscribed to %d indication filters' % (state.cluster, len(INDICATION_QUERIES)))
+
+def subscriptionKey(path):
+  return (path.keybindings['Filter'].keybindings.get('Name'), path.keybindings['Handler'].keybindings.get('Name'))
+
+def subscribed(state):
+  ''' Return True if all subscriptions of cluster exist in CIM provider '''
+  owned = state.subscription_manager.get_owned_subscriptions(state.server_id)
+  existing = set(subscriptionKey(s.path) for s in state.subscription_manager.get_all_subscriptions(state.server_id))
+  return len(owned) >= len(INDICATION_QUERIES) and all(subscriptionKey(s.path) in existing for s in owned)
+
+def unsubscribe(state):
+  if state.server_id is not None:
+    try:
+      state.subscription_manager.remove_server(state.server_id)
+    except Exception, err:
+      print >> sys.stderr, "Can't remove subscriptions of %s: %s" % (state.cluster, str(err))
+    state.subscription_manager = None
+    state.server_id = None
+
+def reconcile(state):
+  ''' Enumerate status of all elements of cluster, return all of them and subscribe to indications if not subscribed yet
+      or if subscriptions are missing in CIM provider '''
+  telemetry = Telemetry('listener', state.cluster)
+  try:
+    with telemetry.phase('connect'):
+      conn = connect(state.cluster)
+    with telemetry.phase('stats'):
+      inventory = svc_inventory.enumInventory(conn, state.cluster)
+  except Exception, err:
+    print >> sys.stderr, 'Reconciliation of %s failed, retrying in %d sec: %s' % (state.cluster, SUBSCRIBE_RETRY, str(err))
+    unsubscribe(state)
+    state.next_reconcile = min(state.next_reconcile, time.time() + SUBSCRIBE_RETRY)
+    telemetry.count('subscribed', 0)
+    output(telemetry.lines())
+    return
+
+  if inventory_dir:
+    try:
+      svc_inventory.saveSnapshot(inventory_dir, inventory)
+    except Exception, err:
+      print >> sys.stderr, "Can't save inventory snapshot:", str(err)
+
+  lines = []
+  with state.lock:
+    state.status = {}
+    for elementType in ('pool', 'volume', 'mdisk'):
+      for elementID, element in sorted(inventory[elementType].items()):
+        state.status[(elementType, elementID)] = element['status']
+        lines.append(statusLine(state.cluster, elementType, elementID, element['status'], inventory['refreshed']))
+    telemetry.count('elements', len(state.status))
+    telemetry.count('events', state.events)
+    telemetry.count('changed', state.changed)
+    state.events = state.changed = 0
+  output(lines)
+
+  with telemetry.phase('stats'):
+    state.resolve(conn)
+  if state.server_id is not None:
+    try:
+      if not subscribed(state):
+        print >> sys.stderr, 'Subscriptions of %s are missing, subscribing again' % state.cluster
+        unsubscribe(state)
+    except Exception, err:
+      print >> sys.stderr, "Can't check subscriptions of %s, subscribing again: %s" % (state.cluster, str(err))
+      unsubscribe(state)
+  if state.server_id is None:
+    try:
+      subscribe(state, conn)
+    except Exception:
+      print >> sys.stderr, "Error: can't subscribe to indications of %s, retrying in %d sec:\n%s" % (state.cluster, SUBSCRIBE_RETRY, traceback.format_exc())
+      state.next_reconcile = min(state.next_reconcile, time.time() + SUBSCRIBE_RETRY)
+  telemetry.count('subscribed', 1 if state.server_id is not None else 0)
+  output(telemetry.lines())
+
+def handleIndication(state, indication):
+  ''' Return status of changed element, forget deleted one, schedule reconciliation on alert '''
+  classname = indication.classname.lower()
+  if 'alert' in classname:
+    debug_print('%s: alert %s' % (state.cluster, indication.get('Description')))
+    state.next_reconcile = min(state.next_reconcile, time.time() + ALERT_DELAY)
+    return
+
+  source = indication.get('SourceInstance')
+  if not isinstance(source, pywbem.CIMInstance) or source.classname not in STATUS_CLASSES:
+    return
+  elementType, idProperty = STATUS_CLASSES[source.classname]
+  elementID = source.get(idProperty)
+  if elementID is None:
+    return
+  key = (elementType, str(elementID))
+
+  with state.lock:
+    state.events += 1
+    if 'deletion' in classname:
+      state.status.pop(key, None)
+      return
+    status = source.get('NativeStatus')
+    if status is None or state.status.get(key) == status:
+      return
+    state.status[key] = status
+    state.changed += 1
+  output([statusLine(state.cluster, elementType, key[1], status, int(time.time()))])
+
+def matchCluster(states, indication, host):
+  ''' Return state of cluster that sent indication or None '''
+  for state in states:
+    if host in state.addresses:
+      return state
+  source_host = indication.get('SourceInstanceHost')
+  if source_host:
+    for state in states:
+      if source_host.lower() == state.cluster.lower() or source_host in state.addresses:
+        return state
+  return None
+
+def indicationCallback(indication, host):
+  ''' Called by listener thread, indications are handled in main thread '''
+  indications.put((indication, host))
+
+def terminate(signum, frame):
+  sys.exit(0)
+
+def run():
+  states = [ClusterState(cluster) for cluster in clusters]
+  listener = pywbem.WBEMListener(host='', http_port=listen_port)
+  listener.add_callback(indicationCallback)
+  listener.start()
+  signal.signal(signal.SIGTERM, terminate)
+  try:
+    while True:
+      now = time.time()
+      for state in states:
+        if state.next_reconcile <= now:
+          state.next_reconcile = now + reconcile_interval
+          reconcile(state)
+
+      ''' short waits keep main thread responsive to signals '''
+      timeout = max(0, min([s.next_reconcile for s in states] + [now + 5]) - time.time())
+      try:
+        indication, host = indications.get(True, timeout)
+      except Queue.Empty:
+        continue
+      state = matchCluster(states, indication, host)
+      if state is None:
+        print >> sys.stderr, 'Warning: %s indication from unknown host %s ignored' % (indication.classname, host)
+        continue
+      try:
+        handleIndication(state, indication)
+      except Exception:
+        traceback.print_exc()
+  finally:
+    listener.stop()
+    for state in states:
+      unsubscribe(state)
+
+##############################################################
+
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug", "listen_host=", "listen_port=", "reconcile=", "inventory_dir="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  debug = False
+  clusters = []
+  user = None
+  password = None
+  listen_host = None
+  listen_port = DEFAULT_LISTEN_PORT
+  reconcile_interval = DEFAULT_RECONCILE
+  inventory_dir = None
+  for o, a in opts:
+    if o == "--clusters" and not a.startswith('--'):
+      clusters.extend( a.split(','))
+    elif o == "--user" and not a.startswith('--'):
+      user = a
+    elif o == "--password" and not a.startswith('--'):
+      password = a
+    elif o == "--listen_host" and not a.startswith('--'):
+      listen_host = a
+    elif o == "--listen_port":
+      listen_port = int(a)
+    elif o == "--reconcile":
+      reconcile_interval = int(a)
+    elif o == "--inventory_dir" and not a.startswith('--'):
+      inventory_dir = a
+    elif o == "--debug":
+      debug = True
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if not clusters or not user or not password or not listen_host:
+    print >> sys.stderr, '--clusters, --user, --password and --listen_host options must be set'
+    usage()
+    sys.exit(2)
+
+  output_lock = threading.Lock()
+  indications = Queue.Queue()
+  run()
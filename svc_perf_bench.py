@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Offline micro-benchmark of svc_perf_wbem.py perf pipeline
+#
+# Drives svc_perf_wbem.py functions with synthetic statistics instances, no Storwize or Zabbix is needed:
+#   calculateStats = per-element stats calculation (calculateStats for every element)
+#   collect        = per-element loop of collectStats: paged enumeration, name lookup, cache read, calculation, pool totals, output
+#   format         = formatting of values in zabbix_sender format (outputMetrics)
+#   cacheSave      = writing raw counters of all elements to a new cache file (CounterCache.update, saveCache)
+#   cacheLoad      = opening cache file and reading raw counters of all elements (loadCache, CounterCache.get)
+#
+# Each element count is measured in a forked process, so peak memory (max RSS) is reported per element count.
+# Output values go to /dev/null.
+#
+# Usage:
+# svc_perf_bench.py [--elements <n>[,<n>...]] [--repeat <n>] [--page_size <n>] [--tmpdir <path>]
+#
+#   --elements  = Comma-separated element counts (default 100,1000,10000,50000)
+#   --repeat    = Run every benchmark n times and report the best time (default 3)
+#   --page_size = Statistics instances per page in collect benchmark (default DEFAULT_PAGE_SIZE of svc_perf_wbem.py)
+#   --tmpdir    = Directory for benchmark cache files (default system temp directory)
+#
+# Example output:
+# elements benchmark            total, s   per element, us   peak RSS, MB
+#    10000 calculateStats         0.0549              5.49           75.0
+#    10000 collect                1.0686            106.86          444.0
+#
+# Peak RSS of collect includes synthetic instances of all elements (like a single EnumerateInstances response).
+#
+import pywbem
+import getopt, sys, os, time, datetime, json, resource, tempfile, shutil, threading
+import svc_perf_wbem
+from svc_perf_wbem import RAW_COUNTERS, VOLUME_COUNTERS
+from svc_telemetry import Telemetry
+from zbxsend import Metric
+
+def usage():
+  print >> sys.stderr, "Usage: svc_perf_bench.py [--elements <n>[,<n>...]] [--repeat <n>] [--page_size <n>] [--tmpdir <path>]"
+
+DEFAULT_ELEMENTS = [100, 1000, 10000, 50000]
+DEFAULT_REPEAT = 3
+CLUSTER = 'bench'
+INTERVAL = 180 # seconds between synthetic samples
+
+##############################################################
+def rawCounters(elementID, sample):
+  ''' Return synthetic raw counters of element for sample number, counters grow with sample number like real ones '''
+  n = sample + 1
+  reads = (elementID % 97 + 1) * 1000 * n
+  writes = (elementID % 89 + 1) * 500 * n
+  return {'timestamp': 1356526800 + sample * INTERVAL,
+          'KBytesRead': reads * 16, 'KBytesWritten': writes * 32, 'KBytesTransferred': reads * 16 + writes * 32,
+          'ReadIOs': reads, 'WriteIOs': writes, 'TotalIOs': reads + writes,
+          'IOTimeCounter': reads * 5 + writes * 9, 'ReadIOTimeCounter': reads * 5, 'WriteIOTimeCounter': writes * 9}
+
+def makeInstances(elements, sample):
+  ''' Return list of synthetic IBMTSSVC_StorageVolumeStatistics instances with properties requested by svc_perf_wbem.py '''
+  instances = []
+  for i in xrange(elements):
+    counters = rawCounters(i, sample)
+    inst = pywbem.CIMInstance('IBMTSSVC_StorageVolumeStatistics')
+    inst['InstanceID'] = 'StorageVolumeStats %d' % i
+    inst['StatisticTime'] = pywbem.CIMDateTime(datetime.datetime.utcfromtimestamp(counters['timestamp']))
+    for k in RAW_COUNTERS[1:]:
+      inst[k] = pywbem.Uint64(counters[k])
+    instances.append(inst)
+  return instances
+
+class PullResult(object):
+  def __init__(self, instances, eos, context):
+    self.instances = instances
+    self.eos = eos
+    self.context = context
+
+class BenchConnection(object):
+  ''' In-memory replacement of WBEMConnection serving prebuilt statistics instances with pull operations '''
+  def __init__(self, instances):
+    self.instances = instances
+
+  def OpenEnumerateInstances(self, ClassName, MaxObjectCount=None, **kwargs):
+    return self.PullInstancesWithPath(0, MaxObjectCount)
+
+  def PullInstancesWithPath(self, context, MaxObjectCount):
+    end = context + MaxObjectCount
+    return PullResult(self.instances[context:end], end >= len(self.instances), end)
+
+  def CloseEnumeration(self, context):
+    pass
+
+  def EnumerateInstances(self, ClassName, **kwargs):
+    return self.instances
+
+##############################################################
+def measure(func, repeat):
+  ''' Return best wall clock time of func() '''
+  best = None
+  for i in range(repeat):
+    started = time.time()
+    func()
+    elapsed = time.time() - started
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def peakRSS():
+  ''' Peak resident memory of current process in MB (ru_maxrss is in KB on Linux) '''
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def runBenchmarks(elements, repeat, page_size, tmpdir):
+  ''' Run all benchmarks for element count, return list of (benchmark, seconds, peak RSS MB) '''
+  results = []
+  def bench(name, func):
+    results.append((name, measure(func, repeat), peakRSS()))
+
+  ''' svc_perf_wbem.py globals normally set by its command line '''
+  m = svc_perf_wbem
+  m.output_lock = threading.Lock()
+  m.cache_lock = threading.Lock()
+  m.zabbix_server = None
+  m.sender_chunk = m.DEFAULT_SENDER_CHUNK
+  m.names_ttl = m.DEFAULT_NAMES_TTL
+  m.page_size = page_size
+  m.sent = None
+  m.history = None
+  m.sinks = [m.ZabbixSink()]
+  m.inventory_dir = None
+  m.cachefile = os.path.join(tmpdir, 'svc_perf.bench.cache')
+  m.names_cache = {'%s.volume' % CLUSTER: {'refreshed': int(time.time()),
+                                           'names': dict((str(i), 'vol%d' % i) for i in xrange(elements)),
+                                           'pools': dict((str(i), 'pool%d' % (i % 8)) for i in xrange(elements))}}
+
+  old = [rawCounters(i, 0) for i in xrange(elements)]
+  new = [rawCounters(i, 1) for i in xrange(elements)]
+  samples = zip(old, new)
+
+  bench('calculateStats', lambda: [m.calculateStats(o, n) for (o, n) in samples])
+
+  metrics = []
+  for e, (o, n) in enumerate(samples):
+    values = m.calculateStats(o, n)
+    for s in VOLUME_COUNTERS:
+      metrics.append(Metric(CLUSTER, 'svc.%s[volume,%d]' % (s, e), values[s], n['timestamp']))
+  bench('format', lambda: m.outputMetrics(metrics))
+  metrics = None
+
+  updates = dict(('%s.volume.vol%d' % (CLUSTER, i), old[i]) for i in xrange(elements))
+  def cacheSave():
+    if os.path.exists(m.cachefile):
+      os.remove(m.cachefile)
+    m.cache = m.loadCache()
+    m.cache.update(updates)
+    m.saveCache()
+  bench('cacheSave', cacheSave)
+
+  keys = updates.keys()
+  def cacheLoad():
+    m.cache = m.loadCache()
+    for key in keys:
+      m.cache.get(key)
+  bench('cacheLoad', cacheLoad)
+  updates = keys = None
+
+  ''' collect runs against cache with previous samples of all elements '''
+  conn = BenchConnection(makeInstances(elements, 1))
+  m.cache = m.loadCache()
+  def collect():
+    telemetry = Telemetry('perf', CLUSTER)
+    m.collectStats(conn, CLUSTER, 'volume', 'IBMTSSVC_StorageVolume', 'IBMTSSVC_StorageVolumeStatistics',
+                   VOLUME_COUNTERS, {}, time.time() + 3600, telemetry)
+  bench('collect', collect)
+
+  return results
+
+def runForked(elements, repeat, page_size, tmpdir):
+  ''' Run benchmarks in child process so peak RSS of each element count is measured separately '''
+  r, w = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(r)
+    code = 0
+    try:
+      ''' values are formatted as in production but not printed '''
+      sys.stdout = open(os.devnull, 'w')
+      os.write(w, json.dumps(runBenchmarks(elements, repeat, page_size, tmpdir)))
+    except Exception:
+      import traceback
+      traceback.print_exc()
+      code = 1
+    os._exit(code)
+
+  os.close(w)
+  data = []
+  while True:
+    chunk = os.read(r, 65536)
+    if not chunk:
+      break
+    data.append(chunk)
+  os.close(r)
+  pid, status = os.waitpid(pid, 0)
+  if status:
+    raise Exception('benchmark of %d elements failed' % elements)
+  return json.loads(''.join(data))
+
+##############################################################
+
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "elements=", "repeat=", "page_size=", "tmpdir="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  elements = DEFAULT_ELEMENTS
+  repeat = DEFAULT_REPEAT
+  page_size = svc_perf_wbem.DEFAULT_PAGE_SIZE
+  tmpdir = None
+  for o, a in opts:
+    if o == "--elements":
+      elements = [int(n) for n in a.split(',')]
+    elif o == "--repeat":
+      repeat = int(a)
+    elif o == "--page_size":
+      page_size = int(a)
+    elif o == "--tmpdir":
+      tmpdir = a
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  workdir = tempfile.mkdtemp(prefix='svc_perf_bench.', dir=tmpdir)
+  try:
+    print '%8s %-16s %12s %17s %14s' % ('elements', 'benchmark', 'total, s', 'per element, us', 'peak RSS, MB')
+    for n in elements:
+      for name, seconds, rss in runForked(n, repeat, page_size, workdir):
+        print '%8d %-16s %12.4f %17.2f %14.1f' % (n, name, seconds, seconds / n * 1e6, rss)
+      sys.stdout.flush()
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
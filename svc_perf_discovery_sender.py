@@ -5,110 +5,205 @@
 #
 # 2013 Matvey Marinin
 #
-# Sends volume/mdisk/pool LLD JSON data to LLD trapper items "svc.discovery.<volume-mdisk|volume|mdisk|pool>"
+# Sends volume/mdisk/pool LLD JSON data to LLD trapper items "svc.discovery.<volume-mdisk|volume|mdisk|pool|pool-perf>"
+# (pool-perf is the pool list for pool aggregate perf items of _Special_Storwize_Perf template)
 # Use with "_Special_Storwize_Perf" Zabbix template
 #
+# Collector self-telemetry is sent as svc.collector.*[discovery,*] items (see svc_telemetry.py)
+#
+# Volumes, mdisks and pools of each cluster are enumerated once, clusters are enumerated in parallel threads.
+# LLD values of all clusters are sent with one zabbix_sender connection after all clusters are done.
+# With --statefile LLD value is sent only when it differs from the last sent one or the last send is older than --max_age.
+#
 # See also http://www.zabbix.com/documentation/2.0/manual/discovery/low_level_discovery
 #
 # Usage:
-# svc_perf_discovery_sender.py [--debug] --clusters <svc1>[,<svc2>...] --user <username> --password <pwd>
+# svc_perf_discovery_sender.py [--debug] --clusters <svc1>[,<svc2>...] --user <username> --password <pwd> [--statefile <path>] [--max_age <sec>] [--inventory_dir <path> [--inventory_max_age <sec>]]
 #
 #   --debug    = Enable debug output
 #   --clusters = Comma-separated Storwize node list
 #   --user     = Storwize V7000 user account with Administrator role (it seems that Monitor role is not enough)
 #   --password = User password
+#   --statefile = Path to file with md5 of last sent LLD values (default: no file, values are sent on every run)
+#   --max_age  = Send unchanged LLD value again after this number of seconds (default 86400).
+#                Keep it well below "Keep lost resources period" (lifetime) of template discovery rules (3 days)
+#   --inventory_dir = Directory of inventory snapshots written by svc_inventory.py. Volumes, mdisks and pools are taken from snapshot
+#                instead of enumerating them on the cluster, unless snapshot is older than --inventory_max_age seconds (default 900).
+#   SVC_WBEM_URL environment variable = CIM provider URL template, %s is replaced with cluster name (default https://%s)
 #
 import pywbem
-import getopt, sys
+import getopt, sys, os, json, threading, traceback, time, hashlib
 from zbxsend import Metric, send_to_zabbix
 import logging
+from svc_telemetry import Telemetry
+import svc_inventory
 
 def usage():
-  print >> sys.stderr, "Usage: svc_perf_discovery_sender.py [--debug] --clusters <svc1>[,<svc2>...] --user <username> --password <pwd>"
-
-DISCOVERY_TYPES = ['volume-mdisk','volume','mdisk','pool']
-
-try:
-  opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug"])
-except getopt.GetoptError, err:
-  print >> sys.stderr, str(err)
-  usage()
-  sys.exit(2)
-
-debug = False
-clusters = []
-user = None
-password = None
-for o, a in opts:
-  if o == "--clusters" and not a.startswith('--'):
-    clusters.extend( a.split(','))
-  elif o == "--user" and not a.startswith('--'):
-    user = a
-  elif o == "--password" and not a.startswith('--'):
-    password = a
-  elif o == "--debug":
-    debug = True
-  elif o in ("-h", "--help"):
-    usage()
-    sys.exit()
+  print >> sys.stderr, "Usage: svc_perf_discovery_sender.py [--debug] --clusters <svc1>[,<svc2>...] --user <username> --password <pwd> [--statefile <path>] [--max_age <sec>] [--inventory_dir <path> [--inventory_max_age <sec>]]"
 
-if not clusters:
-  print >> sys.stderr, '--clusters option must be set'
-  usage()
-  sys.exit(2)
-
-if not user or not password:
-  print >> sys.stderr, '--user and --password options must be set'
-  usage()
-  sys.exit(2)
+DISCOVERY_TYPES = ['volume-mdisk','volume','mdisk','pool','pool-perf']
 
 def debug_print(message):
   if debug:
     print message
 
-for cluster in clusters:
-  debug_print('Connecting to: %s' % cluster)
-  conn = pywbem.WBEMConnection('https://'+cluster, (user, password), 'root/ibm') 
-  conn.debug = True
-
+def getElements(inventory, elementType):
+  ''' @return list of LLD entries {"{#TYPE}", "{#NAME}", "{#ID}"} of all elements of type in inventory snapshot '''
+  return [{'{#TYPE}': elementType, '{#NAME}': element['name'], '{#ID}': elementID}
+          for (elementID, element) in inventory[elementType].iteritems()]
+
+def loadState():
+  ''' @return dict: cluster -> {trapper_key: [payload md5, last send time]} '''
+  try:
+    if statefile and os.path.exists(statefile):
+      return json.load(open(statefile, 'r'))
+  except Exception, err:
+    print >> sys.stderr, "Can't load state:", str(err)
+  return {}
+
+def saveState(state):
+  ''' Replace state file atomically '''
+  if not statefile:
+    return
+  try:
+    f = open(statefile + '.tmp', 'w')
+    json.dump(state, f)
+    f.close()
+    os.rename(statefile + '.tmp', statefile)
+  except Exception, err:
+    print >> sys.stderr, "Can't save state:", str(err)
+
+def discoverCluster(cluster, results):
+  ''' Enumerate volumes, mdisks and pools of cluster once, build LLD values of all DISCOVERY_TYPES.
+      Appends (telemetry, LLD values to send, {trapper_key: [md5, time]} of these values) to results.
+      Value is not sent if its md5 is the same as md5 of value sent less than max_age seconds ago. '''
+  telemetry = Telemetry('discovery', cluster)
+
+  def connect():
+    debug_print('Connecting to: %s' % cluster)
+    with telemetry.phase('connect'):
+      conn = pywbem.WBEMConnection(os.environ.get('SVC_WBEM_URL', 'https://%s') % cluster, (user, password), 'root/ibm') 
+      conn.debug = True
+    return conn
+
+  ''' elements are taken from inventory snapshot if it is fresh '''
+  with telemetry.phase('names'):
+    inventory = svc_inventory.getInventory(inventory_dir, cluster, connect, inventory_max_age)
+    volumes = getElements(inventory, 'volume')
+    mdisks = getElements(inventory, 'mdisk')
+    pools = getElements(inventory, 'pool')
+  telemetry.count('elements', len(volumes) + len(mdisks) + len(pools))
+
+  data = {'volume-mdisk': volumes + mdisks, 'volume': volumes, 'mdisk': mdisks, 'pool': pools, 'pool-perf': pools}
+  now = int(time.time())
+  cluster_state = state.get(cluster, {})
+  cluster_metrics = []
+  hashes = {}
   for discovery in DISCOVERY_TYPES:
-    output = []
-
-    if discovery == 'volume-mdisk' or discovery == 'volume':
-      for vol in conn.ExecQuery('WQL', 'select DeviceID, ElementName from IBMTSSVC_StorageVolume'):
-        output.append( '{"{#TYPE}":"%s", "{#NAME}":"%s", "{#ID}":"%s"}' % ('volume', vol.properties['ElementName'].value, vol.properties['DeviceID'].value) )
-
-    if discovery == 'volume-mdisk' or discovery == 'mdisk':
-      for mdisk in conn.ExecQuery('WQL', 'select DeviceID, ElementName from IBMTSSVC_BackendVolume'):
-        output.append( '{"{#TYPE}":"%s", "{#NAME}":"%s", "{#ID}":"%s"}' % ('mdisk', mdisk.properties['ElementName'].value, mdisk.properties['DeviceID'].value) )
-
-    if discovery == 'pool':
-      for pool in conn.ExecQuery('WQL', 'select PoolID, ElementName from IBMTSSVC_ConcreteStoragePool'):
-        output.append( '{"{#TYPE}":"%s","{#NAME}":"%s","{#ID}":"%s"}' % ('pool', pool.properties['ElementName'].value, pool.properties['PoolID'].value) )
-
-    json = []
-    json.append('{"data":[')
-
-    for i, v in enumerate( output ):
-      if i < len(output)-1:
-        json.append(v+',')
-      else:
-        json.append(v)
-    json.append(']}')
-
-    json_string = ''.join(json)
-    debug_print(json_string)
-
+    ''' entries are sorted so the same inventory always gives the same payload '''
+    json_string = json.dumps({'data': sorted(data[discovery], key=lambda e: (e['{#TYPE}'], e['{#ID}']))}, sort_keys=True)
+    digest = hashlib.md5(json_string).hexdigest()
     trapper_key = 'svc.discovery.%s' % discovery
-    debug_print('Sending to host=%s, key=%s' % (cluster, trapper_key))
-
-    #send json to LLD trapper item with zbxsend module
-    if debug:
-      logging.basicConfig(level=logging.INFO)
-    else:
-      logging.basicConfig(level=logging.WARNING)
-    send_to_zabbix([Metric(cluster, trapper_key, json_string)], 'localhost', 10051)
-    debug_print('')
-
+    last = cluster_state.get(trapper_key)
+    if last and last[0] == digest and now - last[1] < max_age:
+      debug_print('host=%s, key=%s: not changed' % (cluster, trapper_key))
+      telemetry.count('unchanged')
+      continue
+    debug_print('host=%s, key=%s: %s' % (cluster, trapper_key, json_string))
+    cluster_metrics.append(Metric(cluster, trapper_key, json_string))
+    hashes[trapper_key] = [digest, now]
+  telemetry.count('unchanged', 0)
+
+  with results_lock:
+    results.append((cluster, telemetry, cluster_metrics, hashes))
+
+def discover(cluster, results):
+  try:
+    discoverCluster(cluster, results)
+  except Exception:
+    print >> sys.stderr, 'Discovery of %s failed:' % cluster
+    traceback.print_exc()
+
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug", "statefile=", "max_age=", "inventory_dir=", "inventory_max_age="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  debug = False
+  clusters = []
+  user = None
+  password = None
+  statefile = None
+  max_age = 86400
+  inventory_dir = None
+  inventory_max_age = svc_inventory.DEFAULT_MAX_AGE
+  for o, a in opts:
+    if o == "--clusters" and not a.startswith('--'):
+      clusters.extend( a.split(','))
+    elif o == "--user" and not a.startswith('--'):
+      user = a
+    elif o == "--password" and not a.startswith('--'):
+      password = a
+    elif o == "--statefile" and not a.startswith('--'):
+      statefile = a
+    elif o == "--max_age":
+      max_age = int(a)
+    elif o == "--inventory_dir" and not a.startswith('--'):
+      inventory_dir = a
+    elif o == "--inventory_max_age":
+      inventory_max_age = int(a)
+    elif o == "--debug":
+      debug = True
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if not clusters:
+    print >> sys.stderr, '--clusters option must be set'
+    usage()
+    sys.exit(2)
 
+  if not user or not password:
+    print >> sys.stderr, '--user and --password options must be set'
+    usage()
+    sys.exit(2)
 
+  #send json to LLD trapper items with zbxsend module
+  if debug:
+    logging.basicConfig(level=logging.INFO)
+  else:
+    logging.basicConfig(level=logging.WARNING)
+
+  ''' clusters are enumerated concurrently, values of all clusters are sent with one zabbix_sender connection '''
+  state = loadState()
+  results = []
+  results_lock = threading.Lock()
+  threads = []
+  for cluster in clusters:
+    t = threading.Thread(target=discover, args=(cluster, results))
+    t.start()
+    threads.append(t)
+  for t in threads:
+    t.join()
+
+  metrics = [m for (cluster, telemetry, cluster_metrics, hashes) in results for m in cluster_metrics]
+  if metrics:
+    debug_print('Sending %d values' % len(metrics))
+    started = time.time()
+    sent = send_to_zabbix(metrics, 'localhost', 10051)
+    for (cluster, telemetry, cluster_metrics, hashes) in results:
+      telemetry.duration('send', time.time() - started)
+      ''' payloads are sent again on next run if Zabbix did not accept them '''
+      if sent:
+        state.setdefault(cluster, {}).update(hashes)
+    if sent:
+      saveState(state)
+
+  #collector self-telemetry: svc.collector.*[discovery,*]
+  telemetry_metrics = [m for (cluster, telemetry, cluster_metrics, hashes) in results for m in telemetry.metrics()]
+  if telemetry_metrics:
+    send_to_zabbix(telemetry_metrics, 'localhost', 10051)
@@ -3,6 +3,8 @@
 #
 # IBM SVC/Storwize V7000 graph generation script for Zabbix.
 # Generates pool performance summary graphs with Zabbix API.
+# Graphs show storage pool totals calculated by svc_perf_wbem.py (svc.pool.<counter>[volume|mdisk,<pool name>] items),
+# so each graph has one item per counter regardless of the number of volumes/mdisks in the pool.
 # Graphs is named:
 # "Pool - <pool name> - Volume IOPS"
 # "Pool - <pool name> - Volume Throughput"
@@ -10,10 +12,12 @@
 # "Pool - <pool name> - MDisk IOPS"
 # "Pool - <pool name> - MDisk Throughput"
 # "Pool - <pool name> - MDisk IO Time"
+# Existing graphs of node are read with one API call, only changed graphs are created/updated/deleted (in batches).
+# Graphs of deleted pools are removed.
 #
 # 2013 Matvey Marinin
 #
-# Usage: svc_perf_graph.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> --zabbix_url <http://zabbix.domain.com> --zabbix_user <username> --zabbix_password <password>
+# Usage: svc_perf_graph.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> --zabbix_url <http://zabbix.domain.com> --zabbix_user <username> --zabbix_password <password> [--cachefile <path>] [--items_ttl <sec>] [--inventory_dir <path> [--inventory_max_age <sec>]]
 #
 #   --debug = Enable debug output
 #   --clusters = Comma-separated Storwize node list (DNS name/IP)
@@ -22,73 +26,34 @@
 #   --zabbix_url = Zabbix API url in <http://zabbix.domain.com> format
 #   --zabbix_user = Zabbix account with admin permissions to SVC nodes
 #   --zabbix_password = Zabbix password
+#   --cachefile = Path to Zabbix API session and item map cache file (default: no cache, login and read items on every run)
+#                 Cached item map of node is read again if number or highest itemid of svc.pool.* items of node changes
+#                 (LLD added/removed items), if graph update fails with cached map or cached map is older than --items_ttl.
+#                 Cached session is replaced if Zabbix rejects it.
+#   --items_ttl = Max age of cached item map in seconds (default 86400)
+#   --inventory_dir = Directory of inventory snapshots written by svc_inventory.py. Pool volumes/mdisks are taken from snapshot
+#                 instead of enumerating them on the cluster, unless snapshot is older than --inventory_max_age seconds (default 900).
+#   SVC_WBEM_URL environment variable = CIM provider URL template, %s is replaced with cluster name (default https://%s)
 #
+# Collector self-telemetry is sent as svc.collector.*[graph,*] items (see svc_telemetry.py)
 #
 import pywbem
-import getopt, sys
+import getopt, sys, os
 import itertools
 import traceback
+import json, time
 from pyzabbix import ZabbixAPI,ZabbixAPIException
+from zbxsend import send_to_zabbix
+from svc_telemetry import Telemetry
+import svc_inventory
 
 def usage():
-  print >> sys.stderr, "Usage: svc_perf_graph.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> --zabbix_url <http://zabbix.domain.com> --zabbix_user <username> --zabbix_password <password>"
-
-try:
-  opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug", "zabbix_url=", "zabbix_user=", "zabbix_password="])
-except getopt.GetoptError, err:
-  print >> sys.stderr, str(err)
-  usage()
-  sys.exit(2)
-
-debug = False
-clusters = []
-user = None
-password = None
-zabbix_url = None
-zabbix_user = None
-zabbix_password = None
-
-for o, a in opts:
-  if o == "--clusters" and not a.startswith('--'):
-    clusters.extend( a.split(','))
-  elif o == "--user" and not a.startswith('--'):
-    user = a
-  elif o == "--password" and not a.startswith('--'):
-    password = a
-  elif o == "--debug":
-    debug = True
-  elif o == "--zabbix_url" and not a.startswith('--'):
-    zabbix_url = a
-  elif o == "--zabbix_user" and not a.startswith('--'):
-    zabbix_user = a
-  elif o == "--zabbix_password" and not a.startswith('--'):
-    zabbix_password = a
-  elif o in ("-h", "--help"):
-    usage()
-    sys.exit()
+  print >> sys.stderr, "Usage: svc_perf_graph.py [--debug] --clusters <svc1>[,<svc2>...] --user <svc_username> --password <svc_pwd> --zabbix_url <http://zabbix.domain.com> --zabbix_user <username> --zabbix_password <password> [--cachefile <path>] [--items_ttl <sec>] [--inventory_dir <path> [--inventory_max_age <sec>]]"
 
 def debug_print(message):
   if debug:
     print message
 
-
-debug_print('clusters: %s' % clusters)
-
-if not clusters:
-  print >> sys.stderr, '--clusters option must be set'
-  usage()
-  sys.exit(2)
-
-if not user or not password:
-  print >> sys.stderr, '--user and --password options must be set'
-  usage()
-  sys.exit(2)
-
-if not zabbix_url or not zabbix_user or not zabbix_password:
-  print >> sys.stderr, '--zabbix_url, --zabbix_user and --zabbix_password options must be set'
-  usage()
-  sys.exit(2)
-
 ##############################################################
 # Color table from lld_all_graph.pl
 # https://www.zabbix.com/forum/showthread.php?t=26678
@@ -146,118 +111,300 @@ GRAPH_LAYOUT_STACKED = 1
 GRAPH_LAYOUT_PIE = 2
 GRAPH_LAYOUT_EXPLODED = 3
 
+''' item keys of pool graphs, %s is replaced with pool name '''
 VOLUME_GRAPHS = (
-  {'name':'Volume IOPS', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.TotalIORate[volume,%s]']},
-  {'name':'Volume Throughput', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.TotalRateKB[volume,%s]']},
-  {'name':'Volume IO Time', 'graphtype':GRAPH_LAYOUT_NORMAL, 'items':['svc.ReadIOTime[volume,%s]', 'svc.WriteIOTime[volume,%s]']}
+  {'name':'Volume IOPS', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.pool.ReadIORate[volume,%s]', 'svc.pool.WriteIORate[volume,%s]']},
+  {'name':'Volume Throughput', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.pool.ReadRateKB[volume,%s]', 'svc.pool.WriteRateKB[volume,%s]']},
+  {'name':'Volume IO Time', 'graphtype':GRAPH_LAYOUT_NORMAL, 'items':['svc.pool.ReadIOTime[volume,%s]', 'svc.pool.WriteIOTime[volume,%s]']}
   )
 MDISK_GRAPHS = (
-  {'name':'MDisk IOPS', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.TotalIORate[mdisk,%s]']},
-  {'name':'MDisk Throughput', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.TotalRateKB[mdisk,%s]']},
-  {'name':'MDisk IO Time', 'graphtype':GRAPH_LAYOUT_NORMAL, 'items':['svc.ReadIOTime[mdisk,%s]', 'svc.WriteIOTime[mdisk,%s]']}
+  {'name':'MDisk IOPS', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.pool.ReadIORate[mdisk,%s]', 'svc.pool.WriteIORate[mdisk,%s]']},
+  {'name':'MDisk Throughput', 'graphtype':GRAPH_LAYOUT_STACKED, 'items':['svc.pool.ReadRateKB[mdisk,%s]', 'svc.pool.WriteRateKB[mdisk,%s]']},
+  {'name':'MDisk IO Time', 'graphtype':GRAPH_LAYOUT_NORMAL, 'items':['svc.pool.ReadIOTime[mdisk,%s]', 'svc.pool.WriteIOTime[mdisk,%s]']}
   )
 
+GRAPH_PREFIX = 'Pool - '
+GRAPH_HEIGHT = 200
+GRAPH_WIDTH = 900
+GRAPH_BATCH = 100 # graphs per graph.create/update/delete API call
+
+''' keys of graphed items start with these prefixes. Zabbix is asked for ITEM_KEY_SEARCH items only
+    (search by a list of patterns is not supported by older Zabbix API versions) '''
+ITEM_KEY_PREFIXES = tuple(sorted(set(i.split('[')[0] + '[' for t in VOLUME_GRAPHS + MDISK_GRAPHS for i in t['items'])))
+ITEM_KEY_SEARCH = 'svc.pool.'
+
 ## graph: graphid, name, height, width, graphtype, gitems[]
 ## graph_item: gitemid, color, itemid, drawtype + item_key
 
-''' create or update graphs for pool '''
-def updateGraphs(poolName, pool_elements, graph_templates, zabbix, zabbix_items):
-  ''' pool_elements - list of (volume/mdisk_id, name) tuples for use in item_keys. It may be None, if pool has no volumes/mdisks
-      graph_templates - one of VOLUME_GRAPHS/MDISK_GRAPHS
-      zabbix - instance of ZabbixAPI
+''' build graphs of pool '''
+def buildGraphs(poolName, graph_templates, zabbix_items):
+  ''' graph_templates - one of VOLUME_GRAPHS/MDISK_GRAPHS
       zabbix_items - dict: item_key -> (itemid, item_name)
+      @return list of graphs (graph may have no gitems if pool has no volumes/mdisks, so no pool total items in Zabbix)
   '''
-  
-  ''' sort volumes/mdisks by name '''
-  if pool_elements: 
-    pool_elements = sorted(pool_elements, key=lambda id_name_tuple: id_name_tuple[1])
-    
+  graphs = []
   for graph_template in graph_templates:
-    graph_name = 'Pool - %s - %s' % (poolName, graph_template['name'])
+    graph_name = '%s%s - %s' % (GRAPH_PREFIX, poolName, graph_template['name'])
     gitems = []
     gitem_sortorder = 0
     colors = itertools.cycle(COLORS)
-    if pool_elements: # if pool has any volumes/mdisks
-      for (object_id, object_name) in pool_elements:
-        for item_template in graph_template['items']:
-          item_key = item_template % object_id
-          if item_key in zabbix_items:
-            item_id, item_name = zabbix_items[item_key]
-            if item_id and item_name:
-              gitems.append( dict(color=colors.next(), itemid=item_id, sortorder=gitem_sortorder))
-              gitem_sortorder = gitem_sortorder + 1
-    graph = dict(name=graph_name, height=200, width=900, graphtype=graph_template['graphtype'], gitems=gitems)
-
-    ## update Zabbix
-    try:
-      result = zabbix.graph.get(filter={'name':graph_name}, output='graphid')
-      if len(result)>0:
-        ### if existing graph found
-        graph['graphid'] = result[0].get('graphid')
-        if graph['gitems']:
-          debug_print('Updating graph: %s' % graph_name)
-          zabbix.graph.update(graph)
-        else:
-          debug_print('Removing empty graph: %s' % graph_name)
-          zabbix.graph.delete(graph['graphid'])
-      else:
-        #graph not found, create new one
-        if graph['gitems']:
-          debug_print('Creating graph: %s' % graph_name)
-          zabbix.graph.create(graph)
-    except ZabbixAPIException as e:
-      print >> sys.stderr, 'ZabbixAPIException thrown on graph: %s' % graph_name
-      traceback.print_exc()
-            
-            
+    for item_template in graph_template['items']:
+      item_key = item_template % poolName
+      if item_key in zabbix_items:
+        item_id, item_name = zabbix_items[item_key]
+        if item_id and item_name:
+          gitems.append( dict(color=colors.next(), itemid=item_id, sortorder=gitem_sortorder))
+          gitem_sortorder = gitem_sortorder + 1
+    graphs.append(dict(name=graph_name, height=GRAPH_HEIGHT, width=GRAPH_WIDTH, graphtype=graph_template['graphtype'], gitems=gitems))
+  return graphs
+
+def graphState(graph):
+  ''' comparable state of graph: graph properties and (itemid, color, sortorder) of graph items, API returns values as strings '''
+  return (str(graph['height']), str(graph['width']), str(graph['graphtype']),
+          sorted((str(i['itemid']), str(i['color']).upper(), int(i['sortorder'])) for i in graph['gitems']))
+
+''' create, update and delete graphs of host in Zabbix '''
+def syncGraphs(zabbix, hostid, graphs, telemetry):
+  ''' graphs - list of desired graphs of host from buildGraphs
+      Existing "Pool - *" graphs of host are fetched with a single API call, only graphs that differ are written
+      with batched graph.create/graph.update/graph.delete calls of GRAPH_BATCH graphs.
+      Graphs of pools that no longer exist and graphs without items are deleted.
+      @return number of failed API calls
+  '''
+  graph_names = set(t['name'] for t in VOLUME_GRAPHS + MDISK_GRAPHS)
+  existing = {}
+  with telemetry.phase('items'):
+    for g in zabbix.graph.get(hostids=hostid, search={'name': GRAPH_PREFIX}, startSearch=True,
+                              output=['graphid', 'name', 'height', 'width', 'graphtype'], selectGraphItems=['itemid', 'color', 'sortorder']):
+      ''' skip user graphs named like ours '''
+      if g['name'].rsplit(' - ', 1)[-1] in graph_names:
+        g['gitems'] = g.pop('gitems', None) or g.pop('graphitems', [])
+        existing[g['name']] = g
+
+  create, update, delete = [], [], []
+  for graph in graphs:
+    old = existing.pop(graph['name'], None)
+    if old is None:
+      if graph['gitems']:
+        debug_print('Creating graph: %s' % graph['name'])
+        create.append(graph)
+    elif not graph['gitems']:
+      debug_print('Removing empty graph: %s' % graph['name'])
+      delete.append(old['graphid'])
+    elif graphState(graph) != graphState(old):
+      debug_print('Updating graph: %s' % graph['name'])
+      update.append(dict(graph, graphid=old['graphid']))
+  for name, old in existing.items():
+    debug_print('Removing graph of deleted pool: %s' % name)
+    delete.append(old['graphid'])
+
+  telemetry.count('changed', len(create) + len(update) + len(delete))
+  failed = 0
+  with telemetry.phase('send'):
+    for method, objects in ((zabbix.graph.create, create), (zabbix.graph.update, update), (zabbix.graph.delete, delete)):
+      for i in range(0, len(objects), GRAPH_BATCH):
+        try:
+          method(*objects[i:i + GRAPH_BATCH])
+        except ZabbixAPIException as e:
+          print >> sys.stderr, 'ZabbixAPIException thrown on graphs: %s' % ', '.join([o['name'] if isinstance(o, dict) else o for o in objects[i:i + GRAPH_BATCH]])
+          traceback.print_exc()
+          failed += 1
+  return failed
+
+''' Zabbix API session and item map cache '''
+def loadCache():
+  ''' @return dict: auth, url, user, hosts{cluster: {hostid, refreshed, count, items{item_key: (itemid, item_name)}}} '''
+  try:
+    if cachefile and os.path.exists(cachefile):
+      return json.load(open(cachefile, 'r'))
+  except Exception, err:
+    print >> sys.stderr, "Can't load cache:", str(err)
+  return {}
+
+def saveCache(cache):
+  ''' Replace cache file atomically, file holds Zabbix session id so it is readable by owner only '''
+  if not cachefile:
+    return
+  try:
+    fd = os.open(cachefile + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    f = os.fdopen(fd, 'w')
+    json.dump(cache, f)
+    f.close()
+    os.rename(cachefile + '.tmp', cachefile)
+  except Exception, err:
+    print >> sys.stderr, "Can't save cache:", str(err)
+
+def login(zabbix, cache):
+  ''' Reuse cached session of the same Zabbix user or log in '''
+  if cache.get('auth') and cache.get('url') == zabbix_url and cache.get('user') == zabbix_user:
+    debug_print('Using cached Zabbix API session')
+    zabbix.auth = cache['auth']
+  else:
+    relogin(zabbix, cache)
+
+def relogin(zabbix, cache):
+  debug_print('Logging in to Zabbix API')
+  zabbix.login(zabbix_user, zabbix_password)
+  cache.update(auth=zabbix.auth, url=zabbix_url, user=zabbix_user)
+  saveCache(cache)
+
+def getItems(zabbix, hostid, cached):
+  ''' @return (dict: item_key -> (itemid, item_name), host cache entry) of graphed items of host.
+      Only itemid, key_ and name of svc.pool.* items are read, items with ITEM_KEY_PREFIXES keys are kept.
+      Cached map is reused while it is younger than items_ttl and host has the same number and the same highest itemid
+      of svc.pool.* items (new items get higher itemids, so items deleted and created between runs change it). '''
+  search = dict(hostids=hostid, search={'key_': ITEM_KEY_SEARCH}, startSearch=True)
+  count = int(zabbix.item.get(countOutput=True, **search))
+  last = zabbix.item.get(output=['itemid'], sortfield='itemid', sortorder='DESC', limit=1, **search)
+  maxid = last[0]['itemid'] if last else None
+  if cached and cached.get('hostid') == hostid and cached.get('count') == count and cached.get('maxid') == maxid and time.time() - cached.get('refreshed', 0) < items_ttl:
+    debug_print('Using cached item map: %d items' % count)
+    return dict((k, tuple(v)) for (k, v) in cached['items'].items()), cached
+
+  zabbix_items = {}
+  for i in zabbix.item.get(output=['itemid', 'key_', 'name'], **search):
+    if i['key_'].startswith(ITEM_KEY_PREFIXES):
+      zabbix_items[ i['key_'] ] = ( i['itemid'], i['name'] )
+  debug_print('Read %d items' % len(zabbix_items))
+  return zabbix_items, {'hostid': hostid, 'count': count, 'maxid': maxid, 'refreshed': int(time.time()), 'items': zabbix_items}
 
 #####################################################################################################
 # main 
 #####################################################################################################
 
-## connect to Zabbix API ##
-zabbix = ZabbixAPI(zabbix_url)
-zabbix.login(zabbix_user, zabbix_password)
-debug_print('Connected to Zabbix API Version %s' % zabbix.api_version())
-
-for cluster in clusters:
-  zabbix_items = {} # item_key -> (itemid, item_name)
-  
-  debug_print('Searching Zabbix items of node %s' % cluster)
-  items = zabbix.item.getObjects(host=cluster)
-  if not items:
-    print 'WARNING: Cannot find items of Storwize node %s in Zabbix. Check Storwize node name and check Zabbix API user permissions to administer node %s in Zabbix.' % (cluster, cluster)
-         
-  for i in items:
-    if ('key_' in i) and ('itemid' in i) and ('name' in i):
-      zabbix_items[ i['key_'] ] = ( i['itemid'], i['name'] )
-  items = None
-
-    
-  ''' connect to Storwize CIM provider '''
-  conn = pywbem.WBEMConnection('https://'+cluster, (user, password), 'root/ibm') 
-  conn.debug = True
-
-  def getStorageObjects(wbemConnection, wbemClass):
-    ''' @return array pool_volumes["pool1"] = [ (volume_id1, volume_name1) , (volume_id2, volume_name2), ...] '''
-    storage_objects = {}
-    for obj in wbemConnection.ExecQuery('WQL', 'select DeviceID, ElementName, PoolName from %s' % wbemClass):
-      device_id = obj.properties['DeviceID'].value
-      element_name = obj.properties['ElementName'].value
-      pool_name = obj.properties['PoolName'].value
-      if device_id and pool_name and element_name:
-        if pool_name in storage_objects:
-          storage_objects[pool_name].append((device_id, element_name))
-        else:
-          storage_objects[pool_name] = [(device_id, element_name)]
-    return storage_objects
-
-  pool_volumes = getStorageObjects(conn, 'IBMTSSVC_StorageVolume')
-  pool_mdisks = getStorageObjects(conn, 'IBMTSSVC_BackendVolume')
-
-  for p in conn.ExecQuery('WQL', 'select Caption from IBMTSSVC_ConcreteStoragePool'):
-    pool = p.properties['Caption'].value
-    if pool:
-      updateGraphs(pool, pool_volumes.get(pool), VOLUME_GRAPHS, zabbix, zabbix_items)
-      updateGraphs(pool, pool_mdisks.get(pool), MDISK_GRAPHS, zabbix, zabbix_items)
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "user=", "password=", "debug", "zabbix_url=", "zabbix_user=", "zabbix_password=", "cachefile=", "items_ttl=", "inventory_dir=", "inventory_max_age="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  debug = False
+  clusters = []
+  user = None
+  password = None
+  zabbix_url = None
+  zabbix_user = None
+  zabbix_password = None
+  cachefile = None
+  items_ttl = 86400
+  inventory_dir = None
+  inventory_max_age = svc_inventory.DEFAULT_MAX_AGE
+
+  for o, a in opts:
+    if o == "--clusters" and not a.startswith('--'):
+      clusters.extend( a.split(','))
+    elif o == "--user" and not a.startswith('--'):
+      user = a
+    elif o == "--password" and not a.startswith('--'):
+      password = a
+    elif o == "--debug":
+      debug = True
+    elif o == "--zabbix_url" and not a.startswith('--'):
+      zabbix_url = a
+    elif o == "--zabbix_user" and not a.startswith('--'):
+      zabbix_user = a
+    elif o == "--zabbix_password" and not a.startswith('--'):
+      zabbix_password = a
+    elif o == "--cachefile" and not a.startswith('--'):
+      cachefile = a
+    elif o == "--items_ttl" and not a.startswith('--'):
+      items_ttl = int(a)
+    elif o == "--inventory_dir" and not a.startswith('--'):
+      inventory_dir = a
+    elif o == "--inventory_max_age" and not a.startswith('--'):
+      inventory_max_age = int(a)
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+
+  debug_print('clusters: %s' % clusters)
+
+  if not clusters:
+    print >> sys.stderr, '--clusters option must be set'
+    usage()
+    sys.exit(2)
+
+  if not user or not password:
+    print >> sys.stderr, '--user and --password options must be set'
+    usage()
+    sys.exit(2)
+
+  if not zabbix_url or not zabbix_user or not zabbix_password:
+    print >> sys.stderr, '--zabbix_url, --zabbix_user and --zabbix_password options must be set'
+    usage()
+    sys.exit(2)
+
+  ## connect to Zabbix API ##
+  cache = loadCache()
+  cache.setdefault('hosts', {})
+  zabbix = ZabbixAPI(zabbix_url)
+  login(zabbix, cache)
+
+  for cluster in clusters:
+    telemetry = Telemetry('graph', cluster)
+    zabbix_items = {} # item_key -> (itemid, item_name)
+
+    debug_print('Searching Zabbix items of node %s' % cluster)
+    with telemetry.phase('items'):
+      try:
+        hosts = zabbix.host.get(filter={'host': cluster}, output=['hostid'])
+      except ZabbixAPIException:
+        ''' cached session expired '''
+        relogin(zabbix, cache)
+        hosts = zabbix.host.get(filter={'host': cluster}, output=['hostid'])
+      cached_items = False
+      if hosts:
+        cached = cache['hosts'].get(cluster)
+        zabbix_items, cache['hosts'][cluster] = getItems(zabbix, hosts[0]['hostid'], cached)
+        cached_items = cache['hosts'][cluster] is cached
+        saveCache(cache)
+    telemetry.count('items', len(zabbix_items))
+    if not hosts or not zabbix_items:
+      print 'WARNING: Cannot find items of Storwize node %s in Zabbix. Check Storwize node name and check Zabbix API user permissions to administer node %s in Zabbix.' % (cluster, cluster)
+
+
+    def connect():
+      ''' connect to Storwize CIM provider '''
+      with telemetry.phase('connect'):
+        conn = pywbem.WBEMConnection(os.environ.get('SVC_WBEM_URL', 'https://%s') % cluster, (user, password), 'root/ibm') 
+        conn.debug = True
+      return conn
+
+    ''' pools are taken from inventory snapshot if it is fresh '''
+    with telemetry.phase('names'):
+      inventory = svc_inventory.getInventory(inventory_dir, cluster, connect, inventory_max_age)
+      pools = [p['name'] for p in inventory['pool'].values()]
+    telemetry.count('elements', len(pools))
+
+    def poolGraphs(zabbix_items):
+      graphs = []
+      for pool in pools:
+        if pool:
+          graphs.extend(buildGraphs(pool, VOLUME_GRAPHS, zabbix_items))
+          graphs.extend(buildGraphs(pool, MDISK_GRAPHS, zabbix_items))
+      return graphs
+
+    graphs = poolGraphs(zabbix_items)
+    telemetry.count('graphs', len(graphs))
+
+    if hosts:
+      try:
+        failed = syncGraphs(zabbix, hosts[0]['hostid'], graphs, telemetry)
+        if failed and cached_items:
+          ''' cached map may hold itemids of deleted items, read items again and retry failed graphs '''
+          print >> sys.stderr, 'Graph update of node %s failed with cached item map, reading items again' % cluster
+          with telemetry.phase('items'):
+            zabbix_items, cache['hosts'][cluster] = getItems(zabbix, hosts[0]['hostid'], None)
+            saveCache(cache)
+          syncGraphs(zabbix, hosts[0]['hostid'], poolGraphs(zabbix_items), telemetry)
+      except ZabbixAPIException as e:
+        print >> sys.stderr, 'ZabbixAPIException thrown on graphs of node %s' % cluster
+        traceback.print_exc()
+
+    #collector self-telemetry: svc.collector.*[graph,*]
+    send_to_zabbix(telemetry.metrics(), 'localhost', 10051)
 
@@ -18,43 +18,198 @@
 # svc1-blk svc.WriteIOTime[mdisk,40] 1356526942 9.65088563306
 # svc1-blk svc.ReadIOPct[mdisk,40] 1356526942 83.3247489642
 #
+# Storage pool totals of volumes/mdisks are returned as svc.pool.<counter>[<volume|mdisk>,<pool name>] items:
+# svc1-blk svc.pool.TotalIORate[volume,pool1] 1356526942 5310.52
+# IO rates and throughput are summed over pool elements, ReadIOTime/WriteIOTime are averaged weighted by element read/write IO rates.
+#
+# With --rollups hourly rollups of recent volume/mdisk stats are returned as svc.<counter>.<max|p95|avg>[<volume|mdisk>,<id>] items
+# once an hour (ROLLUP_WINDOW), timestamped with the end of the hour:
+# svc1-blk svc.ReadIOTime.p95[volume,46] 1356530400 7.25
+# Rollups: max and p95 of ReadIOTime/WriteIOTime, max and average of TotalIORate (ROLLUPS).
+# They are calculated from a ring buffer of the last samples of every element kept in <cachefile>.history (see HistoryCache),
+# so raw history of svc.* items may be kept short in Zabbix and long-term trends taken from rollups.
+#
+# Collector self-telemetry is returned as svc.collector.* items (see svc_telemetry.py)
+#
+# Values go to output sinks (--outputs): zabbix (default, zabbix_sender format or Zabbix trapper) and/or openmetrics.
+# openmetrics sink keeps the latest value of every item in memory and serves them at http://<host>:<port>/metrics
+# in OpenMetrics text format for another monitoring system, scrapes never query the CIM provider:
+# svc_ReadIOTime{cluster="svc1-blk",type="mdisk",id="40",name="mdisk40",pool="pool1"} 5.29899839722 1356526942
+# svc_pool_TotalIORate{cluster="svc1-blk",type="volume",pool="pool1"} 5310.52 1356526942
+# svc_collector_duration{cluster="svc1-blk",collector="perf",phase="total"} 5.0176 1356526942
+#
 # Use with template _Special_Storwize_Perf
 #
 # Performance stats is collected with SVC CIM provider (WBEM):
 # http://pic.dhe.ibm.com/infocenter/storwize/unified_ic/index.jsp?topic=%2Fcom.ibm.storwize.v7000.unified.doc%2Fsvc_umlblockprofile.html
 # http://pic.dhe.ibm.com/infocenter/storwize/unified_ic/index.jsp?topic=%2Fcom.ibm.storwize.v7000.unified.doc%2Fsvc_cim_main.html
-# 
+#
 # Usage:
-# svc_perf_wbem.py --cluster <cluster1> [--cluster <cluster2>...] --user <username> --password <pwd> --cachefile <path>|none
+# svc_perf_wbem.py --cluster <cluster1> [--cluster <cluster2>...] --user <username> --password <pwd> --cachefile <path>|none [--workers <n>] [--timeout <sec>] [--zabbix_server <host[:port]> [--chunk <n>]] [--names_ttl <sec>] [--page_size <n>] [--deadband <value>] [--deadband_pct <pct>] [--heartbeat <n>] [--inventory_dir <path> [--inventory_max_age <sec>]] [--rollups] [--daemon] [--interval <sec>] [--outputs <sink>[,<sink>...]] [--openmetrics_listen [<host>:]<port>]
 #
 #   --cluster = Dns name or IP of Storwize V7000 block node (not Storwize V7000 Unified mgmt node!). May be used several times to monitor some clusters.
 #   --user    = Storwize V7000 user account with Administrator role (it seems that Monitor role is not enough)
 #   --password = User password
 #   --cachefile = Path to timestamp cache file or "none" to not use cache. Used to prevent submitting duplicate values to Zabbix.
 #                 Duplicates detected by statistics timestamp supplied by Storwize.
+#                 Cache file is a binary table of raw counters updated in place (see CounterCache), JSON cache of older versions is converted.
+#                 Volume/mdisk names are cached in <path>.names file.
+#   --workers  = Number of clusters polled in parallel (default 4). Volume and mdisk stats of each cluster are always collected in parallel.
+#   --timeout  = Cluster poll deadline in seconds (default 150). Stats of a cluster not collected in time are dropped.
+#   --zabbix_server = Send values to Zabbix trapper directly with sender protocol instead of printing them in zabbix_sender format.
+#   --chunk    = Max number of values sent to Zabbix in one sender request (default 1000)
+#   --names_ttl = Max age of cached volume/mdisk names in seconds (default 3600). Names of unknown IDs are queried as soon as they appear in stats.
+#   --page_size = Number of statistics instances requested at once with CIM pull operations (default 500), 0 to get all instances with single request.
+#                 Each page is processed and sent before next one is requested, so memory usage does not depend on cluster size.
+#   --deadband = Send a value only if it differs from the last value sent for the item by more than <value> (absolute).
+#   --deadband_pct = Send a value only if it differs from the last value sent for the item by more than <pct> percent of it.
+#                Values of idle elements (0 run after run) are not sent with --deadband 0.
+#                Last sent values are kept in <cachefile>.sent (in memory if cachefile is "none").
+#   --heartbeat = With deadband, send all values of element every <n> runs anyway (default 10) to keep nodata() triggers working.
+#                Deadband applies to zabbix sink only, openmetrics sink always gets all values.
+#   --inventory_dir = Directory of inventory snapshots written by svc_inventory.py. Volume/mdisk names and pools are taken from snapshot
+#                 instead of enumerating them on the cluster, unless snapshot is older than --inventory_max_age seconds (default 900).
+#   --rollups  = Return hourly rollups of volume/mdisk stats, recent samples are kept in <cachefile>.history (in memory if cachefile is "none").
+#   --daemon   = Run forever and keep counter cache and WBEMConnection objects of every cluster in memory.
+#                pywbem before 1.0 still opens a new HTTPS connection for every CIM operation, TLS sessions are reused with pywbem 1.0+ only.
+#                Each cluster is polled when its next StatisticTime is due instead of at fixed cron minutes.
+#                Cache is saved to disk every CACHE_SAVE_INTERVAL seconds and on exit (SIGTERM/SIGINT).
+#   --interval = Storwize stats interval in seconds ("startstats -interval", default 180). Used in daemon mode and to size rollup history.
+#   --outputs  = Comma-separated output sinks (OUTPUT_SINKS): zabbix, openmetrics (default zabbix). openmetrics needs --daemon.
+#   --openmetrics_listen = Listen address of openmetrics sink HTTP endpoint (default port 9745 on all addresses).
+#
+# Environment:
+#   SVC_WBEM_URL = CIM provider URL template, %s is replaced with cluster name (default https://%s)
 #
 #
 import pywbem
-import getopt, sys, datetime, time, calendar, json
+import getopt, sys, datetime, time, calendar, json, signal, math
+import threading, Queue, traceback
+import socket, struct, re, os, mmap, zlib, gzip, cStringIO
+import BaseHTTPServer, SocketServer
+from zbxsend import Metric
+from svc_telemetry import Telemetry
+import svc_inventory
 
 def usage():
-  print >> sys.stderr, "Usage: svc_perf_wbem.py --cluster <cluster1> [--cluster <cluster2>...] --user <username> --password <pwd> --cachefile <path>|none"
+  print >> sys.stderr, "Usage: svc_perf_wbem.py --cluster <cluster1> [--cluster <cluster2>...] --user <username> --password <pwd> --cachefile <path>|none [--workers <n>] [--timeout <sec>] [--zabbix_server <host[:port]> [--chunk <n>]] [--names_ttl <sec>] [--page_size <n>] [--deadband <value>] [--deadband_pct <pct>] [--heartbeat <n>] [--inventory_dir <path> [--inventory_max_age <sec>]] [--rollups] [--daemon] [--interval <sec>] [--outputs <sink>[,<sink>...]] [--openmetrics_listen [<host>:]<port>]"
 
 ##############################################################
 
 RAW_COUNTERS = ['timestamp', 'KBytesRead', 'KBytesWritten', 'KBytesTransferred', 'ReadIOs', 'WriteIOs', 'TotalIOs', 'IOTimeCounter', 'ReadIOTimeCounter', 'WriteIOTimeCounter']
 MDISK_COUNTERS = ['ReadRateKB', 'WriteRateKB', 'TotalRateKB', 'ReadIORate', 'WriteIORate', 'TotalIORate', 'ReadIOTime', 'WriteIOTime', 'ReadIOPct']
 VOLUME_COUNTERS = ['ReadRateKB', 'WriteRateKB', 'TotalRateKB', 'ReadIORate', 'WriteIORate', 'TotalIORate', 'ReadIOTime', 'WriteIOTime', 'ReadIOPct']
-  
+
+''' pool aggregates: summed rates and IO-weighted latencies (latency -> weight) '''
+POOL_RATES = ['ReadRateKB', 'WriteRateKB', 'TotalRateKB', 'ReadIORate', 'WriteIORate', 'TotalIORate']
+POOL_LATENCIES = [('ReadIOTime', 'ReadIORate'), ('WriteIOTime', 'WriteIORate')]
+
+''' properties of *Statistics classes read by collectStats '''
+STATISTICS_PROPERTIES = ['InstanceID', 'StatisticTime'] + [k for k in RAW_COUNTERS if k != 'timestamp']
+
+''' (element type, element class, statistics class, counters) '''
+STATISTICS_CLASSES = (('volume', 'IBMTSSVC_StorageVolume', 'IBMTSSVC_StorageVolumeStatistics', VOLUME_COUNTERS),
+                      ('mdisk', 'IBMTSSVC_BackendVolume', 'IBMTSSVC_BackendVolumeStatistics', MDISK_COUNTERS))
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_WORKERS = 4
+DEFAULT_CLUSTER_TIMEOUT = 150 # must be less than stats interval
+
+''' in-process Zabbix sender '''
+ZABBIX_TRAPPER_PORT = 10051
+DEFAULT_SENDER_CHUNK = 1000
+SENDER_TIMEOUT = 30
+
+''' daemon mode schedule, seconds '''
+DEFAULT_STATS_INTERVAL = 180 # Storwize "startstats -interval 3"
+POLL_DELAY = 15              # give CIM provider some time to publish a sample after its StatisticTime
+RETRY_DELAY = 20             # poll again after this delay if cluster returned no new samples or failed
+CACHE_SAVE_INTERVAL = 900
+
+''' element name cache '''
+DEFAULT_NAMES_TTL = 3600
+NAMES_QUERY_BATCH = 50
+
+''' deadband mode: last sent values of element (SENT_FIELDS) are kept in <cachefile>.sent,
+    'age' is number of runs since all values of element were sent '''
+DEFAULT_HEARTBEAT = 10
+SENT_FIELDS = VOLUME_COUNTERS + ['age']
+
+''' rollups of recent element stats '''
+ROLLUP_WINDOW = 3600 # seconds
+ROLLUPS = [('ReadIOTime', 'max'), ('ReadIOTime', 'p95'), ('WriteIOTime', 'max'), ('WriteIOTime', 'p95'), ('TotalIORate', 'max'), ('TotalIORate', 'avg')]
+HISTORY_FIELDS = sorted(set(s for (s, f) in ROLLUPS))
+
+''' output sinks '''
+DEFAULT_OUTPUTS = ['zabbix']
+DEFAULT_OPENMETRICS_PORT = 9745
+OPENMETRICS_STALE_INTERVALS = 3 # series not updated for this many stats intervals are dropped (rollups: for ROLLUP_WINDOW + interval)
+
+''' CIM provider URL of cluster, SVC_WBEM_URL=http://%s:5988 points script to svc_cimom_sim.py '''
+WBEM_URL = os.environ.get('SVC_WBEM_URL', 'https://%s')
+
 ##############################################################
-def enumNames(cimClass):
-  ''' Enum storage objects and return dict{id:name} '''
+def enumNames(conn, cimClass, deviceIDs=None):
+  ''' Enum storage objects and return (dict{id:name}, dict{id:pool name}). Query only objects listed in deviceIDs if it is set '''
+  query = 'SELECT DeviceID, ElementName, PoolName FROM %s' % (cimClass)
+  if deviceIDs:
+    query += ' WHERE ' + ' OR '.join(["DeviceID = '%s'" % i for i in deviceIDs])
+
   names = {}
-  for obj in conn.ExecQuery( 'WQL', 'SELECT DeviceID, ElementName FROM %s' % (cimClass) ):
+  pools = {}
+  for obj in conn.ExecQuery( 'WQL', query ):
     deviceID = obj.properties['DeviceID'].value
     if deviceID:
       names[str(deviceID)] = obj.properties['ElementName'].value
-  return names
+      pools[str(deviceID)] = obj.properties['PoolName'].value
+  return names, pools
+
+def snapshotNames(cluster, elementType):
+  ''' Return name cache entry built from inventory snapshot of cluster or None if there is no fresh snapshot '''
+  if not inventory_dir:
+    return None
+  snapshot = svc_inventory.loadSnapshot(inventory_dir, cluster, inventory_max_age)
+  if snapshot is None:
+    return None
+  elements = snapshot[elementType]
+  return {'refreshed': snapshot['refreshed'],
+          'names': dict((i, e['name']) for (i, e) in elements.iteritems()),
+          'pools': dict((i, e['pool']) for (i, e) in elements.iteritems())}
+
+def lookupNames(conn, cluster, elementType, elementClass, elementIDs):
+  ''' Return (dict{id:name}, dict{id:pool name}) from persistent name cache.
+      Names are taken from inventory snapshot or enumerated again when cached map is older than names_ttl,
+      unknown IDs are looked up in newer snapshot or queried by batches of NAMES_QUERY_BATCH.
+      Cached entries are never changed in place, new entries are stored under cache_lock (saveCache serializes the cache) '''
+  key = '%s.%s' % (cluster, elementType)
+  with cache_lock:
+    entry = names_cache.get(key)
+  if entry is None or 'pools' not in entry or time.time() - entry['refreshed'] > names_ttl:
+    entry = snapshotNames(cluster, elementType)
+    if entry is None:
+      names, pools = enumNames(conn, elementClass)
+      entry = {'refreshed': int(time.time()), 'names': names, 'pools': pools}
+    with cache_lock:
+      names_cache[key] = entry
+
+  names, pools = entry['names'], entry['pools']
+  missing = [i for i in elementIDs if i not in names]
+  if missing:
+    snapshot_entry = snapshotNames(cluster, elementType)
+    if snapshot_entry and snapshot_entry['refreshed'] > entry['refreshed']:
+      entry = snapshot_entry
+      names, pools = entry['names'], entry['pools']
+      missing = [i for i in elementIDs if i not in names]
+    if missing:
+      names, pools = dict(names), dict(pools)
+    for i in range(0, len(missing), NAMES_QUERY_BATCH):
+      print >> sys.stderr, 'Refreshing %d %s names of %s' % (len(missing[i:i + NAMES_QUERY_BATCH]), elementType, cluster)
+      new_names, new_pools = enumNames(conn, elementClass, missing[i:i + NAMES_QUERY_BATCH])
+      names.update(new_names)
+      pools.update(new_pools)
+    with cache_lock:
+      names_cache[key] = {'refreshed': entry['refreshed'], 'names': names, 'pools': pools}
+  return names, pools
 
 ##############################################################
 def calculateStats(old_counters, new_counters):
@@ -74,7 +229,7 @@ def calculateStats(old_counters, new_counters):
       deltaTotalIO = float(new_counters['TotalIOs'] - old_counters['TotalIOs'])
       deltaReadIOTimeCounter = float(new_counters['ReadIOTimeCounter'] - old_counters['ReadIOTimeCounter'])
       deltaWriteIOTimeCounter = float(new_counters['WriteIOTimeCounter'] - old_counters['WriteIOTimeCounter'])
-      
+
       stats['ReadRateKB']  = deltaReadKB  / timespan
       stats['WriteRateKB'] = deltaWriteKB / timespan
       stats['TotalRateKB'] = deltaTotalKB / timespan
@@ -84,50 +239,385 @@ def calculateStats(old_counters, new_counters):
 
       if (deltaReadIO > 0) and (deltaReadIOTimeCounter > 0):
         stats['ReadIOTime'] = deltaReadIOTimeCounter / deltaReadIO
-      
+
       if (deltaWriteIO > 0) and (deltaWriteIOTimeCounter > 0):
         stats['WriteIOTime'] = deltaWriteIOTimeCounter / deltaWriteIO
-      
+
       if (deltaTotalIO > 0) and (deltaReadIO > 0):
         stats['ReadIOPct'] = deltaReadIO / deltaTotalIO * 100
-                      
+
     else:
       print >> sys.stderr, 'timespan between samples is 0, skipping'
-      
+
   else:
       print >> sys.stderr, 'no timestamp in previous sample, skipping'
-    
+
   return stats
 
+def deadbandFilter(last, values):
+  ''' Drop values that differ from last sent ones by no more than deadband threshold.
+      last - last sent values record of element (SENT_FIELDS dict) or None
+      values - dict{counter: value} of defined values
+      Return (dict{counter: value} to send, new last sent values record).
+      All values are sent every heartbeat runs '''
+  if last is None or last.get('age', 0) + 1 >= heartbeat:
+    return values, dict(values, age=0)
+
+  send = {}
+  for s, value in values.iteritems():
+    old = last.get(s)
+    if old is None or abs(value - old) > max(deadband, deadband_pct / 100.0 * abs(old)):
+      send[s] = value
+  record = dict(last)
+  record.update(send)
+  record['age'] = last['age'] + 1
+  return send, record
+
+def addPoolStats(totals, timestamp, stats):
+  ''' Add perf statistic values of one pool element to pool totals dict, undefined (None) values are skipped '''
+  for s in POOL_RATES:
+    value = stats.get(s)
+    if value is not None:
+      totals[s] = totals.get(s, 0.0) + value
+  for s, weight in POOL_LATENCIES:
+    value, w = stats.get(s), stats.get(weight)
+    if value is not None and w:
+      totals[s] = totals.get(s, 0.0) + value * w
+      totals[s + '.weight'] = totals.get(s + '.weight', 0.0) + w
+  if totals.get('timestamp') is None or timestamp > totals['timestamp']:
+    totals['timestamp'] = timestamp
+
+def poolMetrics(cluster, elementType, pools):
+  ''' Return (Metrics to send, all Metrics) lists of svc.pool.* items from dict{pool name: totals} built with addPoolStats,
+      Metrics to send are those passing deadband filter '''
+  metrics = []
+  all_metrics = []
+  sent_updates = {}
+  for pool, totals in sorted(pools.items()):
+    values = dict((s, totals[s]) for s in POOL_RATES if s in totals)
+    for s, weight in POOL_LATENCIES:
+      if totals.get(s + '.weight'):
+        values[s] = totals[s] / totals[s + '.weight']
+
+    sent_values = values
+    if sent is not None:
+      key = '%s.pool.%s.%s' % (cluster, elementType, pool)
+      sent_values, sent_updates[key] = deadbandFilter(sent.get(key), values)
+
+    for s in POOL_RATES + [l for (l, w) in POOL_LATENCIES]:
+      if s in values:
+        metric = Metric(cluster, 'svc.pool.%s[%s,%s]' % (s, elementType, pool), values[s], totals['timestamp'])
+        all_metrics.append(metric)
+        if s in sent_values:
+          metrics.append(metric)
+
+  if sent_updates:
+    with cache_lock:
+      sent.update(sent_updates)
+  return metrics, all_metrics
+
+def percentile(series, pct):
+  ''' Nearest-rank percentile of sorted list '''
+  return series[max(0, int(math.ceil(pct / 100.0 * len(series))) - 1)]
+
+ROLLUP_FUNCTIONS = {
+  'max': lambda series: series[-1],
+  'p95': lambda series: percentile(series, 95),
+  'avg': lambda series: sum(series) / len(series),
+}
+
+def historySlots():
+  ''' Number of samples kept per element: one rollup window of stats intervals and some spare for late samples '''
+  return ROLLUP_WINDOW // interval + 4
+
+def rollupStats(samples, timestamp, values):
+  ''' Append stats sample to element history.
+      samples - list of (timestamp, dict{counter: value}) from oldest to newest
+      values - dict{counter: value} of defined values of the new sample
+      Return (new history, (window end, dict{(counter, function): value}) of the window finished by the new sample or None) '''
+  rollups = None
+  if samples and samples[-1][0] // ROLLUP_WINDOW < timestamp // ROLLUP_WINDOW:
+    start = samples[-1][0] // ROLLUP_WINDOW * ROLLUP_WINDOW
+    window = [v for (t, v) in samples if t >= start]
+    rollups = (start + ROLLUP_WINDOW, {})
+    for s, function in ROLLUPS:
+      series = sorted(v[s] for v in window if s in v)
+      if series:
+        rollups[1][(s, function)] = ROLLUP_FUNCTIONS[function](series)
+  new = dict((s, values[s]) for s in HISTORY_FIELDS if s in values)
+  return (samples + [(timestamp, new)])[-historySlots():], rollups
+
 ##############################################################
-def collectStats(connection, elementType, elementClass, statisticsClass, elementCounters):
+class DeadlineExceeded(Exception):
+  pass
 
-  ##enumerate element names
-  names = enumNames(elementClass)
+def sendToZabbix(metrics):
+  ''' Send metrics to Zabbix trapper with sender protocol (https://www.zabbix.com/documentation/2.2/manual/appendix/items/activepassive)
+      Return (processed, failed, total) counters reported by Zabbix '''
+  data = json.dumps({'request': 'sender data',
+                     'data': [{'host': m.host, 'key': m.key, 'value': '%s' % m.value, 'clock': m.clock} for m in metrics]})
+  s = socket.create_connection(zabbix_server, SENDER_TIMEOUT)
+  try:
+    s.sendall('ZBXD\x01' + struct.pack('<Q', len(data)) + data)
+    response = ''
+    while True:
+      chunk = s.recv(4096)
+      if not chunk:
+        break
+      response += chunk
+  finally:
+    s.close()
+
+  if not response.startswith('ZBXD\x01') or len(response) < 13:
+    raise IOError('invalid Zabbix response header')
+  response = json.loads(response[13:13 + struct.unpack('<Q', response[5:13])[0]])
+  if response.get('response') != 'success':
+    raise IOError('Zabbix error response: %s' % response)
+
+  ''' info = "processed: 10; failed: 0; total: 10; seconds spent: 0.000123" '''
+  counters = re.search(r'processed:? *(\d+);? *failed:? *(\d+);? *total:? *(\d+)', response.get('info', ''), re.I)
+  if not counters:
+    return (len(metrics), 0, len(metrics))
+  return tuple(int(c) for c in counters.groups())
+
+class ZabbixSink(object):
+  ''' Output sink sending metrics to Zabbix trapper (--zabbix_server) or printing them in zabbix_sender format '''
+  deadband = True # gets only values passing deadband filter
+
+  def write(self, metrics, names=None, pools=None):
+    if zabbix_server:
+      for i in range(0, len(metrics), sender_chunk):
+        chunk = metrics[i:i + sender_chunk]
+        try:
+          processed, failed, total = sendToZabbix(chunk)
+        except Exception, err:
+          print >> sys.stderr, 'Error sending %d values to Zabbix: %s' % (len(chunk), err)
+          continue
+        print >> sys.stderr, 'Sent %d values to Zabbix: processed %d, failed %d, total %d' % (len(chunk), processed, failed, total)
+      return
+
+    ''' do not interleave with lines of other threads '''
+    with output_lock:
+      sys.stdout.write(''.join(['%s %s %d %s\n' % (m.host, m.key, m.clock, m.value) for m in metrics]))
+
+class OpenMetricsSink(object):
+  ''' Output sink keeping the latest value of every item and serving them over HTTP in OpenMetrics text format.
+      Item key svc.<name>[<args>] becomes family svc_<name> with labels cluster and:
+        svc.pool.*      - type, pool
+        svc.collector.* - collector, phase (duration) or counter (count)
+        other           - type, id, name, pool (element name and pool from name cache)
+      Series text is rendered when values are written, exposition is rebuilt (and compressed) at most once per write,
+      so concurrent scrapes only copy a cached string.
+      Series not updated for OPENMETRICS_STALE_INTERVALS stats intervals are dropped, rollups (written once an hour)
+      are kept until the next rollup window is due. '''
+  CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+  deadband = False # gets all values, so series of idle elements suppressed by deadband do not go stale
+  KEY = re.compile(r'^svc\.([^\[]+)\[(.*)\]$')
+
+  def __init__(self, address):
+    self.series = {} # (family, labels) -> (series text, expiry time)
+    self.lock = threading.Lock()
+    self.exposition = None # (text, gzipped text) of current series, None if series changed
+    self.server = OpenMetricsServer(address, OpenMetricsHandler)
+    self.server.sink = self
+    t = threading.Thread(target=self.server.serve_forever)
+    t.daemon = True
+    t.start()
+    print >> sys.stderr, 'OpenMetrics endpoint at http://%s:%d/metrics' % self.server.server_address[:2]
+
+  @staticmethod
+  def number(value):
+    value = float(value)
+    if value != value:
+      return 'NaN'
+    if value in (float('inf'), float('-inf')):
+      return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+  @staticmethod
+  def label(value):
+    if not isinstance(value, unicode):
+      value = str(value).decode('utf-8', 'replace')
+    return value.replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+  def labels(self, host, name, args, names, pools):
+    if name.startswith('pool.'):
+      labels = [('cluster', host), ('type', args[0]), ('pool', ','.join(args[1:]))]
+    elif name.startswith('collector.'):
+      labels = [('cluster', host), ('collector', args[0]), ('counter' if name == 'collector.count' else 'phase', ','.join(args[1:]))]
+    else:
+      elementID = ','.join(args[1:])
+      labels = [('cluster', host), ('type', args[0]), ('id', elementID)]
+      if names and elementID in names:
+        labels.append(('name', names[elementID]))
+      if pools and pools.get(elementID):
+        labels.append(('pool', pools[elementID]))
+    return u','.join(u'%s="%s"' % (k, self.label(v)) for (k, v) in labels)
+
+  def write(self, metrics, names=None, pools=None):
+    now = time.time()
+    expires = now + OPENMETRICS_STALE_INTERVALS * interval
+    rollup_expires = now + ROLLUP_WINDOW + interval
+    updates = {}
+    for m in metrics:
+      match = self.KEY.match(m.key)
+      if not match:
+        continue
+      name, args = match.group(1), match.group(2).split(',')
+      family = 'svc_' + name.replace('.', '_')
+      labels = self.labels(m.host, name, args, names, pools)
+      rollup = name.rsplit('.', 1)[-1] in ROLLUP_FUNCTIONS
+      updates[(family, labels)] = (u'%s{%s} %s %d\n' % (family, labels, self.number(m.value), m.clock), rollup_expires if rollup else expires)
+    with self.lock:
+      self.series.update(updates)
+      self.exposition = None
+
+  def render(self):
+    ''' Return (text, gzipped text) of all series, cached until next write. Stale series are dropped '''
+    with self.lock:
+      if self.exposition is None:
+        now = time.time()
+        for key in [k for (k, (text, expires)) in self.series.iteritems() if expires < now]:
+          del self.series[key]
+        lines = []
+        family = None
+        for key in sorted(self.series):
+          if key[0] != family:
+            family = key[0]
+            lines.append(u'# TYPE %s gauge\n' % family)
+          lines.append(self.series[key][0])
+        lines.append(u'# EOF\n')
+        text = u''.join(lines).encode('utf-8')
+        buf = cStringIO.StringIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=5)
+        f.write(text)
+        f.close()
+        self.exposition = (text, buf.getvalue())
+      return self.exposition
+
+class OpenMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class OpenMetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    text, gzipped = self.server.sink.render()
+    body = text
+    self.send_response(200)
+    self.send_header('Content-Type', OpenMetricsSink.CONTENT_TYPE)
+    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+      body = gzipped
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+''' output sink name -> factory '''
+OUTPUT_SINKS = {
+  'zabbix': lambda: ZabbixSink(),
+  'openmetrics': lambda: OpenMetricsSink(openmetrics_listen),
+}
+
+def outputMetrics(metrics, names=None, pools=None, all_metrics=None):
+  ''' Write metrics of one worker thread to all output sinks.
+      names, pools - dict{element ID: name}, dict{element ID: pool name} of elements of metrics, if known
+      all_metrics - metrics including values suppressed by deadband filter (default metrics), written to sinks without deadband '''
+  if all_metrics is None:
+    all_metrics = metrics
+  for sink in sinks:
+    sink_metrics = metrics if sink.deadband else all_metrics
+    if sink_metrics:
+      sink.write(sink_metrics, names, pools)
+
+##############################################################
+def enumStatistics(conn, statisticsClass, deadline):
+  ''' Yield statistics instances by pages of page_size instances with CIM pull operations,
+      so that a page can be processed and released before next page is requested.
+      Whole enumeration is returned as a single page if paging is disabled or not supported by CIM provider.
+      Only properties used by script are transferred. '''
+  if page_size:
+    try:
+      result = conn.OpenEnumerateInstances(statisticsClass, PropertyList=STATISTICS_PROPERTIES, IncludeClassOrigin=False, MaxObjectCount=page_size)
+    except pywbem.CIMError, err:
+      if err.args[0] != pywbem.CIM_ERR_NOT_SUPPORTED:
+        raise
+      print >> sys.stderr, 'Pull operations are not supported, enumerating %s at once' % statisticsClass
+    else:
+      try:
+        yield result.instances
+        while not result.eos:
+          if time.time() > deadline:
+            raise DeadlineExceeded('deadline exceeded')
+          result = conn.PullInstancesWithPath(result.context, MaxObjectCount=page_size)
+          yield result.instances
+      finally:
+        if not result.eos:
+          try:
+            conn.CloseEnumeration(result.context)
+          except Exception, err:
+            print >> sys.stderr, "Can't close %s enumeration: %s" % (statisticsClass, err)
+      return
+
+  yield conn.EnumerateInstances(statisticsClass, PropertyList=STATISTICS_PROPERTIES, IncludeQualifiers=False, IncludeClassOrigin=False)
+
+def collectStats(conn, cluster, elementType, elementClass, statisticsClass, elementCounters, updates, deadline, telemetry):
+  ''' Output stats of one element type page by page and put new raw counters to updates dict.
+      Pool totals are output after the last page.
+      Return latest new StatisticTime (unix time) or None if no new samples found '''
+  latest = None
+  pools = {} # pool name -> totals (see addPoolStats)
 
   ##get volume stats
-  stats = conn.EnumerateInstances(statisticsClass)
+  pages = enumStatistics(conn, statisticsClass, deadline)
+  try:
+    while True:
+      with telemetry.phase('stats'):
+        stats = next(pages, None)
+      if stats is None:
+        break
+      timestamp = processStats(conn, cluster, elementType, elementClass, elementCounters, stats, updates, pools, telemetry)
+      if timestamp is not None and (latest is None or timestamp > latest):
+        latest = timestamp
+  finally:
+    pages.close()
+
+  with telemetry.phase('send'):
+    metrics, all_metrics = poolMetrics(cluster, elementType, pools)
+    outputMetrics(metrics, all_metrics=all_metrics)
+
+  return latest
+
+def processStats(conn, cluster, elementType, elementClass, elementCounters, stats, updates, pools, telemetry):
+  ''' Output stats of list of statistics instances, put new raw counters to updates dict and add element stats to pool totals.
+      Return latest new StatisticTime or None '''
+  latest = None
+  metrics = [] # values to send
+  all_metrics = [] # all values, including those suppressed by deadband
+  telemetry.count('elements', len(stats))
+
+  ##get element names
+  with telemetry.phase('names'):
+    names, element_pools = lookupNames(conn, cluster, elementType, elementClass, [stat.properties['InstanceID'].value.split()[1] for stat in stats])
+
+  parsed = [] # (element ID, StatisticTime, timestamp, cache key, new raw counters)
   for stat in stats:
     ''' parse property InstanceID = "StorageVolumeStats 46" to get element ID '''
-    elementID = stat.properties['InstanceID'].value.split()[1] 
+    elementID = stat.properties['InstanceID'].value.split()[1]
+    if elementID not in names:
+      print >> sys.stderr, 'unknown %s %s of %s, skipping' % (elementType, elementID, cluster)
+      continue
     elementName = names[elementID]
     ps = stat.properties
 
-    
+
     timestamp = calendar.timegm(ps['StatisticTime'].value.datetime.timetuple())
-    
-    ''' get previous samples '''
-    cached_raw_counters = {}
     cache_key = '%s.%s.%s' % (cluster, elementType, elementName)
-    if (cache_key in cache):
-      cached_raw_counters = cache[cache_key]
-    if cached_raw_counters is None:
-      cached_raw_counters = {}
-
-    ''' don't proceed samples with same timestamp to prevent speed calculation errors '''
-    if ('timestamp' in cached_raw_counters) and (timestamp == cached_raw_counters['timestamp']):
-      print >> sys.stderr, 'same sample: %s = %s, skipping' % (cache_key, ps['StatisticTime'].value.datetime)
-      continue
 
     ''' get current samples '''
     new_raw_counters = {}
@@ -136,74 +626,608 @@ def collectStats(connection, elementType, elementClass, statisticsClass, element
       if k in ps and ps[k].value is not None:
         new_raw_counters[k] = ps[k].value
 
-    ''' save current samples to cache '''
-    cache[cache_key] = new_raw_counters
+    parsed.append((elementID, ps['StatisticTime'].value.datetime, timestamp, cache_key, new_raw_counters))
+
+  ''' get previous samples and last sent values '''
+  with telemetry.phase('cache'):
+    cached = [cache.get(cache_key) for (elementID, statisticTime, timestamp, cache_key, new) in parsed]
+    if sent is not None:
+      last_sent = dict((cache_key, sent.get(cache_key)) for (elementID, statisticTime, timestamp, cache_key, new) in parsed)
+    if history is not None:
+      last_samples = dict((cache_key, history.get(cache_key)) for (elementID, statisticTime, timestamp, cache_key, new) in parsed)
+
+  samples = [] # (element ID, timestamp, cache key, cached raw counters, new raw counters)
+  for (elementID, statisticTime, timestamp, cache_key, new_raw_counters), cached_raw_counters in zip(parsed, cached):
+    if cached_raw_counters is None:
+      cached_raw_counters = {}
+
+    ''' don't proceed samples with same timestamp to prevent speed calculation errors '''
+    if ('timestamp' in cached_raw_counters) and (timestamp == cached_raw_counters['timestamp']):
+      print >> sys.stderr, 'same sample: %s = %s, skipping' % (cache_key, statisticTime)
+      telemetry.count('skipped')
+      continue
+
+    if latest is None or timestamp > latest:
+      latest = timestamp
+
+    samples.append((elementID, timestamp, cache_key, cached_raw_counters, new_raw_counters))
+
+  ''' calculate statistics for Zabbix '''
+  with telemetry.phase('compute'):
+    sent_updates = {}
+    history_updates = {}
+    for (elementID, timestamp, cache_key, old, new) in samples:
+      ''' save current samples to cache '''
+      updates[cache_key] = new
+
+      stat_values = calculateStats(old, new)
+      values = dict((s, stat_values[s]) for s in elementCounters if s in stat_values)
+      if history is not None:
+        history_updates[cache_key], rollups = rollupStats(last_samples[cache_key] or [], timestamp, values)
+        if rollups:
+          window_end, rollup_values = rollups
+          for (s, function), value in sorted(rollup_values.items()):
+            metric = Metric(cluster, 'svc.%s.%s[%s,%s]' % (s, function, elementType, elementID), value, window_end)
+            metrics.append(metric)
+            all_metrics.append(metric)
+          telemetry.count('rollups', len(rollup_values))
+
+      sent_values = values
+      if sent is not None:
+        sent_values, sent_updates[cache_key] = deadbandFilter(last_sent[cache_key], values)
+        telemetry.count('suppressed', len(values) - len(sent_values))
+
+      for s in elementCounters:
+        if s in values:
+          metric = Metric(cluster, 'svc.%s[%s,%s]' % (s, elementType, elementID), values[s], timestamp)
+          all_metrics.append(metric)
+          if s in sent_values:
+            metrics.append(metric)
+
+      pool = element_pools.get(elementID)
+      if pool:
+        addPoolStats(pools.setdefault(pool, {}), timestamp, stat_values)
+
+  if sent_updates:
+    with telemetry.phase('cache'):
+      with cache_lock:
+        sent.update(sent_updates)
+  if history_updates:
+    with telemetry.phase('cache'):
+      with cache_lock:
+        history.update(history_updates)
+
+  with telemetry.phase('send'):
+    outputMetrics(metrics, names, element_pools, all_metrics)
+
+  return latest
+
+##############################################################
+def connect(cluster):
+  ''' Connect to Storwize CIM provider '''
+  print >> sys.stderr, 'Connecting to', cluster
+  return pywbem.WBEMConnection(WBEM_URL % cluster, (user, password), 'root/ibm', timeout=timeout)
+
+##############################################################
+def pollCluster(cluster, connections):
+  ''' Collect volume and mdisk stats of cluster in parallel, each statistics class with its own connection.
+      Stats not collected within cluster timeout are not waited for: their thread saves its raw counters to cache
+      when it finishes, as its values are sent already.
+      connections - dict (cluster, element type) -> WBEMConnection, kept between polls in daemon mode
+      Return latest new StatisticTime or None '''
+  deadline = time.time() + timeout
+  results = {} # element type -> (latest StatisticTime, raw counters to be cached)
+  finished = [] # set when results are taken, under cache_lock
+  telemetry = Telemetry('perf', cluster)
+  telemetry.count('elements', 0)
+  telemetry.count('skipped', 0)
+  if sent is not None:
+    telemetry.count('suppressed', 0)
+  if history is not None:
+    telemetry.count('rollups', 0)
+
+  def collect(elementType, elementClass, statisticsClass, elementCounters):
+    updates = {}
+    ''' WBEMConnection is not thread-safe: connection is taken out of connections while in use and returned after
+        successful collection, so a thread still running after the deadline never shares it with the next poll '''
+    conn = connections.pop((cluster, elementType), None)
+    try:
+      if conn is None:
+        with telemetry.phase('connect'):
+          conn = connect(cluster)
+      latest = collectStats(conn, cluster, elementType, elementClass, statisticsClass, elementCounters, updates, deadline, telemetry)
+      connections[(cluster, elementType)] = conn
+    except Exception, err:
+      print >> sys.stderr, 'Error collecting %s stats of %s: %s' % (elementType, cluster, err)
+      ''' reconnect on next poll '''
+      latest = None
+    with cache_lock:
+      if finished:
+        ''' values and sent/history records of this thread are already saved, cache them with their raw counters '''
+        print >> sys.stderr, '%s stats of %s collected after deadline' % (elementType, cluster)
+        cache.update(updates)
+      else:
+        results[elementType] = (latest, updates)
+
+  threads = []
+  for args in STATISTICS_CLASSES[1:]:
+    t = threading.Thread(target=collect, args=args)
+    t.daemon = True
+    t.start()
+    threads.append(t)
+  collect(*STATISTICS_CLASSES[0])
+  for t in threads:
+    t.join(max(0, deadline - time.time()))
+
+  latest = None
+  with telemetry.phase('cache'):
+    with cache_lock:
+      finished.append(True)
+      for (elementType, elementClass, statisticsClass, elementCounters) in STATISTICS_CLASSES:
+        if elementType not in results:
+          print >> sys.stderr, 'Error collecting %s stats of %s: deadline exceeded' % (elementType, cluster)
+          continue
+        timestamp, updates = results[elementType]
+        cache.update(updates)
+        if timestamp is not None and (latest is None or timestamp > latest):
+          latest = timestamp
+
+  ''' collector self-telemetry '''
+  outputMetrics(telemetry.metrics())
+  return latest
+
+##############################################################
+class WorkerPool(object):
+  ''' Bounded pool of worker threads '''
+  def __init__(self, workers):
+    self.tasks = Queue.Queue()
+    for i in range(workers):
+      t = threading.Thread(target=self.run)
+      t.daemon = True
+      t.start()
+
+  def run(self):
+    while True:
+      func, args = self.tasks.get()
+      try:
+        func(*args)
+      except Exception:
+        traceback.print_exc()
+      self.tasks.task_done()
+
+  def submit(self, func, *args):
+    self.tasks.put((func, args))
+
+  def join(self):
+    self.tasks.join()
+
+##############################################################
+class CounterCache(object):
+  ''' Raw counter cache file.
+      File is a hash table (open addressing) of fixed-size records, one record per element:
+        crc32, counter presence mask, key length, key ("<cluster>.<type>.<name>"), fields (RAW_COUNTERS as uint64 by default)
+      Records are read and updated in place through mmap, so opening and saving the cache does not depend on element count.
+      Every record carries CRC32 of its contents: record torn by killed run is ignored (its element skips one sample).
+      File is rewritten only when the table grows; new table is built in temporary file and renamed over the old one. '''
+  MAGIC = 'SVCPERFC'
+  VERSION = 1
+  HEADER = struct.Struct('<8sIIII12x')  # magic, version, record size, capacity, record count
+  KEY_OFFSET = 8
+  KEY_SIZE = 184
+  INITIAL_CAPACITY = 1024
+  MAX_LOAD = 0.7
+
+  def __init__(self, path, fields=RAW_COUNTERS, value_type='Q'):
+    ''' fields - list of record field names (at most 16), value_type - struct format of field values ('Q' or 'd') '''
+    self.path = path
+    self.fields = fields
+    self.value_type = value_type
+    self.RECORD = self.recordStruct()
+    self.lock = threading.RLock()
+    self.map = None
+
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+      self.create(self.INITIAL_CAPACITY, {})
+    elif open(path, 'rb').read(1) == '{':
+      ''' convert JSON cache of previous script versions '''
+      self.create(self.INITIAL_CAPACITY, json.load(open(path, 'r')))
+    else:
+      self.open(path)
+
+  def recordStruct(self):
+    return struct.Struct('<IHH%ds%d%s' % (self.KEY_SIZE, len(self.fields), self.value_type))
+
+  def open(self, path):
+    f = open(path, 'r+b')
+    try:
+      self.map = mmap.mmap(f.fileno(), 0)
+    finally:
+      f.close()
+    magic, version, record_size, self.capacity, self.count = self.HEADER.unpack_from(self.map, 0)
+    if magic != self.MAGIC or version != self.VERSION or record_size != self.RECORD.size or \
+       len(self.map) < self.HEADER.size + self.capacity * self.RECORD.size:
+      self.map.close()
+      self.map = None
+      raise ValueError('%s is not a counter cache file' % path)
+
+  def create(self, capacity, items):
+    ''' Build new table with items in temporary file and atomically replace cache file with it '''
+    while len(items) > capacity * self.MAX_LOAD:
+      capacity *= 2
+
+    tmp = self.path + '.tmp'
+    f = open(tmp, 'wb')
+    f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size, capacity, 0))
+    f.truncate(self.HEADER.size + capacity * self.RECORD.size)
+    f.close()
+
+    if self.map is not None:
+      self.map.close()
+    self.open(tmp)
+    for key, counters in items.iteritems():
+      self.put(key, counters)
+    self.map.flush()
+    os.rename(tmp, self.path)
+
+  def find(self, key):
+    ''' Return (offset of key record, True) or (offset of free record for key, False), (None, False) if table is full '''
+    h = zlib.crc32(key) & 0xffffffff
+    for i in xrange(self.capacity):
+      offset = self.HEADER.size + ((h + i) % self.capacity) * self.RECORD.size
+      key_len = struct.unpack_from('<H', self.map, offset + 6)[0]
+      if not key_len:
+        return offset, False
+      if self.map[offset + self.KEY_OFFSET:offset + self.KEY_OFFSET + key_len] == key:
+        return offset, True
+    return None, False
 
-    ''' calculate statistics for Zabbix '''
-    stat_values = calculateStats(cached_raw_counters, new_raw_counters)
+  def read(self, offset):
+    ''' Return (key, counters dict) of record at offset or (None, None) if record is damaged '''
+    record = self.map[offset:offset + self.RECORD.size]
+    if zlib.crc32(record[4:]) & 0xffffffff != struct.unpack_from('<I', record)[0]:
+      return (None, None)
+    values = self.RECORD.unpack(record)
+    return (values[3][:values[2]].decode('utf-8'), self.unpack(values))
+
+  def unpack(self, values):
+    ''' Return counters dict of unpacked record '''
+    counters = {}
+    for i, k in enumerate(self.fields):
+      if values[1] & (1 << i):
+        counters[k] = values[4 + i]
+    return counters
+
+  def pack(self, key, counters):
+    ''' Return record of counters dict without CRC32 '''
+    mask = 0
+    values = []
+    for i, k in enumerate(self.fields):
+      if counters.get(k) is not None:
+        mask |= 1 << i
+        values.append(int(counters[k]) if self.value_type == 'Q' else float(counters[k]))
+      else:
+        values.append(0)
+    return self.RECORD.pack(0, mask, len(key), key, *values)[4:]
+
+  def get(self, key):
+    ''' Return raw counters dict of element or None '''
+    key = key.encode('utf-8')
+    with self.lock:
+      offset, found = self.find(key)
+      if not found:
+        return None
+      cached_key, counters = self.read(offset)
+      if counters is None:
+        print >> sys.stderr, 'damaged cache record: %s, ignoring' % key
+      return counters
+
+  def put(self, key, counters):
+    ''' Store raw counters dict of element '''
+    key = key.encode('utf-8')
+    if len(key) > self.KEY_SIZE:
+      print >> sys.stderr, 'cache key is too long: %s, not cached' % key
+      return
+
+    record = self.pack(key, counters)
+    record = struct.pack('<I', zlib.crc32(record) & 0xffffffff) + record
+
+    with self.lock:
+      offset, found = self.find(key)
+      if not found and (offset is None or self.count + 1 > self.capacity * self.MAX_LOAD):
+        self.create(self.capacity * 2, dict(self.items()))
+        offset, found = self.find(key)
+      self.map[offset:offset + self.RECORD.size] = record
+      if not found:
+        self.count += 1
+        struct.pack_into('<I', self.map, 20, self.count)
+
+  def update(self, items):
+    for key, counters in items.iteritems():
+      self.put(key, counters)
+
+  def items(self):
+    ''' Return list of (key, counters) of all valid records '''
+    with self.lock:
+      items = []
+      for slot in xrange(self.capacity):
+        offset = self.HEADER.size + slot * self.RECORD.size
+        if struct.unpack_from('<H', self.map, offset + 6)[0]:
+          key, counters = self.read(offset)
+          if counters is not None:
+            items.append((key, counters))
+      return items
+
+  def flush(self):
+    with self.lock:
+      self.map.flush()
+
+class HistoryCache(CounterCache):
+  ''' Ring buffer of recent stats samples of every element, same hash table file as CounterCache with another record:
+        crc32, next slot, key length, key, <slots> samples of (timestamp uint32, fields float32, NaN if undefined)
+      Oldest sample is overwritten by the newest one, so record size (and file size) is fixed. '''
+  MAGIC = 'SVCPERFH'
+
+  def __init__(self, path, fields=HISTORY_FIELDS, slots=8):
+    self.slots = slots
+    self.SAMPLE = struct.Struct('<I%df' % len(fields))
+    CounterCache.__init__(self, path, fields, 'f')
+
+  def recordStruct(self):
+    return struct.Struct('<IHH%ds%s' % (self.KEY_SIZE, self.SAMPLE.format[1:] * self.slots))
+
+  def unpack(self, values):
+    ''' Return list of (timestamp, values dict) from oldest to newest '''
+    width = len(self.fields) + 1
+    samples = []
+    for i in xrange(self.slots):
+      slot = 4 + (values[1] + i) % self.slots * width
+      if values[slot]:
+        samples.append((values[slot], dict((k, v) for (k, v) in zip(self.fields, values[slot + 1:slot + width]) if v == v)))
+    return samples
+
+  def pack(self, key, samples):
+    ''' Return record of list of samples without CRC32, samples are written from the first slot on '''
+    samples = samples[-self.slots:]
+    nan = float('nan')
+    values = []
+    for i in xrange(self.slots):
+      if i < len(samples):
+        timestamp, sample = samples[i]
+        values.append(int(timestamp))
+        values.extend(sample.get(k, nan) for k in self.fields)
+      else:
+        values.extend([0] + [nan] * len(self.fields))
+    return self.RECORD.pack(0, len(samples) % self.slots, len(key), key, *values)[4:]
+
+def writeFile(path, data):
+  ''' Replace file contents atomically '''
+  f = open(path + '.tmp', 'w')
+  f.write(data)
+  f.flush()
+  os.fsync(f.fileno())
+  f.close()
+  os.rename(path + '.tmp', path)
+
+##############################################################
+def loadCache(suffix='', fields=RAW_COUNTERS, value_type='Q', slots=None):
+  ''' Open stats cache file (<cachefile><suffix>), HistoryCache of <slots> samples if slots is set.
+      Cache is kept in memory only if cachefile is "none" '''
+  if 'none' != cachefile:
+    path = cachefile + suffix
+    def openCache():
+      if slots:
+        return HistoryCache(path, fields, slots)
+      return CounterCache(path, fields, value_type)
+    try:
+      return openCache()
+    except Exception, err:
+      print >> sys.stderr, "Can't load cache:", str(err)
+      try:
+        os.remove(path)
+        return openCache()
+      except Exception, err:
+        print >> sys.stderr, "Can't create cache:", str(err)
+  return {}
+
+def saveCache():
+  ''' Save cache to disk if permitted by command line argument '''
+  try:
+    if 'none' != cachefile:
+      with cache_lock:
+        if isinstance(cache, CounterCache):
+          cache.flush()
+        if isinstance(sent, CounterCache):
+          sent.flush()
+        if isinstance(history, CounterCache):
+          history.flush()
+        writeFile(cachefile + '.names', json.dumps(names_cache))
+  except Exception, err:
+    print >> sys.stderr, "Can't save cache:", str(err)
+
+def loadNames():
+  ''' Load element name cache saved next to stats cache '''
+  try:
+    if 'none' != cachefile:
+      return json.load( open(cachefile + '.names', 'r') )
+  except Exception, err:
+    print >> sys.stderr, "Can't load name cache:", str(err)
+  return {}
+
+##############################################################
+def nextPollTime(now, latest):
+  ''' Schedule next poll of cluster against the StatisticTime it returned last time.
+      Cluster clock may differ from ours, so delay is kept within [RETRY_DELAY, interval + POLL_DELAY] '''
+  if latest is None:
+    return now + RETRY_DELAY
+  due = latest + interval + POLL_DELAY
+  return min(max(due, now + RETRY_DELAY), now + interval + POLL_DELAY)
+
+def terminate(signum, frame):
+  sys.exit(0)
+
+def runDaemon():
+  ''' Poll clusters forever keeping WBEM connections between polls '''
+  connections = {}
+  schedule = dict((c, 0) for c in clusters) # cluster -> next poll time, None while cluster is polled
+  wakeup = threading.Condition()
+  pool = WorkerPool(workers)
+  cache_saved = time.time()
+
+  def poll(cluster):
+    latest = None
+    try:
+      latest = pollCluster(cluster, connections)
+    finally:
+      with output_lock:
+        sys.stdout.flush()
+      with wakeup:
+        schedule[cluster] = nextPollTime(time.time(), latest)
+        print >> sys.stderr, '%s: next poll at %s' % (cluster, time.ctime(schedule[cluster]))
+        wakeup.notify()
+
+  signal.signal(signal.SIGTERM, terminate)
+  try:
+    while True:
+      with wakeup:
+        now = time.time()
+        for cluster, t in schedule.items():
+          if t is not None and t <= now:
+            schedule[cluster] = None
+            pool.submit(poll, cluster)
+        pending = [t for t in schedule.values() if t is not None]
+        ''' short waits keep main thread responsive to signals '''
+        wakeup.wait(min(pending + [now + 5]) - now)
+
+      if time.time() - cache_saved >= CACHE_SAVE_INTERVAL:
+        saveCache()
+        cache_saved = time.time()
+  finally:
+    saveCache()
 
-    for s in elementCounters:
-      if s in stat_values:
-        print '%s svc.%s[%s,%s] %d %s' % (cluster, s, elementType, elementID, timestamp, stat_values[s])
-  
 ##############################################################
 
 ''' main script body '''
-try:
-  opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "cluster=", "user=", "password=", "cachefile="])
-except getopt.GetoptError, err:
-  print >> sys.stderr, str(err) # will print something like "option -a not recognized"
-  usage()
-  sys.exit(2)
-
-cluster = []
-user = None
-password = None
-cachefile = None
-for o, a in opts:
-  if o == "--cluster":
-    cluster.append(a)
-  elif o == "--user":
-    user = a;
-  elif o == "--password":
-    password = a;
-  elif o == "--cachefile":
-    cachefile = a;
-  elif o in ("-h", "--help"):
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "cluster=", "user=", "password=", "cachefile=", "daemon", "interval=", "workers=", "timeout=", "zabbix_server=", "chunk=", "names_ttl=", "page_size=", "deadband=", "deadband_pct=", "heartbeat=", "inventory_dir=", "inventory_max_age=", "rollups", "outputs=", "openmetrics_listen="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err) # will print something like "option -a not recognized"
+    usage()
+    sys.exit(2)
+
+  clusters = []
+  user = None
+  password = None
+  cachefile = None
+  daemon = False
+  interval = DEFAULT_STATS_INTERVAL
+  workers = DEFAULT_WORKERS
+  timeout = DEFAULT_CLUSTER_TIMEOUT
+  zabbix_server = None
+  sender_chunk = DEFAULT_SENDER_CHUNK
+  names_ttl = DEFAULT_NAMES_TTL
+  page_size = DEFAULT_PAGE_SIZE
+  deadband = None
+  deadband_pct = None
+  heartbeat = DEFAULT_HEARTBEAT
+  inventory_dir = None
+  inventory_max_age = svc_inventory.DEFAULT_MAX_AGE
+  rollups = False
+  outputs = DEFAULT_OUTPUTS
+  openmetrics_listen = ('', DEFAULT_OPENMETRICS_PORT)
+  for o, a in opts:
+    if o == "--cluster":
+      clusters.append(a)
+    elif o == "--user":
+      user = a;
+    elif o == "--password":
+      password = a;
+    elif o == "--cachefile":
+      cachefile = a;
+    elif o == "--daemon":
+      daemon = True
+    elif o == "--interval":
+      interval = int(a)
+    elif o == "--workers":
+      workers = int(a)
+    elif o == "--timeout":
+      timeout = int(a)
+    elif o == "--zabbix_server":
+      host, port = (a.split(':', 1) + [ZABBIX_TRAPPER_PORT])[:2]
+      zabbix_server = (host, int(port))
+    elif o == "--chunk":
+      sender_chunk = int(a)
+    elif o == "--names_ttl":
+      names_ttl = int(a)
+    elif o == "--page_size":
+      page_size = int(a)
+    elif o == "--deadband":
+      deadband = float(a)
+    elif o == "--deadband_pct":
+      deadband_pct = float(a)
+    elif o == "--heartbeat":
+      heartbeat = int(a)
+    elif o == "--inventory_dir":
+      inventory_dir = a
+    elif o == "--inventory_max_age":
+      inventory_max_age = int(a)
+    elif o == "--rollups":
+      rollups = True
+    elif o == "--outputs":
+      outputs = a.split(',')
+    elif o == "--openmetrics_listen":
+      host, port = ([''] + a.rsplit(':', 1))[-2:]
+      openmetrics_listen = (host, int(port))
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if not clusters or not user or not password or not cachefile:
+    print >> sys.stderr, 'Required argument is not set'
     usage()
+    sys.exit(2)
+
+  unknown = [o for o in outputs if o not in OUTPUT_SINKS]
+  if unknown:
+    print >> sys.stderr, 'Unknown output sink: %s' % ', '.join(unknown)
+    usage()
+    sys.exit(2)
+  if 'openmetrics' in outputs and not daemon:
+    print >> sys.stderr, 'openmetrics output needs --daemon'
+    sys.exit(2)
+
+  output_lock = threading.Lock()
+  cache_lock = threading.Lock()
+  sinks = [OUTPUT_SINKS[o]() for o in outputs]
+
+  ## Loading stats cache from file
+  cache = loadCache()
+  names_cache = loadNames()
+
+  ''' last sent values, deadband mode only '''
+  sent = None
+  if deadband is not None or deadband_pct is not None:
+    deadband = deadband or 0.0
+    deadband_pct = deadband_pct or 0.0
+    sent = loadCache('.sent', SENT_FIELDS, 'd')
+
+  ''' recent samples, rollups mode only '''
+  history = None
+  if rollups:
+    history = loadCache('.history', HISTORY_FIELDS, slots=historySlots())
+
+  if daemon:
+    try:
+      runDaemon()
+    except KeyboardInterrupt:
+      pass
     sys.exit()
 
-if not cluster or not user or not password or not cachefile:
-  print >> sys.stderr, 'Required argument is not set'
-  usage()
-  sys.exit(2)
+  ''' main loop: poll all clusters in parallel '''
+  pool = WorkerPool(min(workers, len(clusters)))
+  for cluster in clusters:
+    pool.submit(pollCluster, cluster, {})
+  pool.join()
 
-## Loading stats cache from file
-cache = None
-try:
-  if 'none' != cachefile:
-    cache = json.load( open(cachefile, 'r') )
-except Exception, err:
-  print >> sys.stderr, "Can't load cache:", str(err)
-
-''' Initialize cache if neccesary '''
-if cache is None:
-  cache = {}
-  
-''' main loop '''
-for cluster in cluster:
-  print >> sys.stderr, 'Connecting to', cluster  
-  
-  conn = pywbem.WBEMConnection('https://'+cluster, (user, password), 'root/ibm') 
-  conn.debug = True
-
-  collectStats(conn, 'volume', 'IBMTSSVC_StorageVolume', 'IBMTSSVC_StorageVolumeStatistics', VOLUME_COUNTERS)
-  collectStats(conn, 'mdisk', 'IBMTSSVC_BackendVolume', 'IBMTSSVC_BackendVolumeStatistics', MDISK_COUNTERS)
-
-
-''' finally save cache to disk if permitted by command line argument '''
-try:
-  if 'none' != cachefile:
-    json.dump( cache, open(cachefile, 'w') )
-except Exception, err:
-  print >> sys.stderr, "Can't save cache:", str(err)
+  ''' finally save cache to disk if permitted by command line argument '''
+  saveCache()
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# IBM SVC/Storwize V7000 event log poller (resident alternative to svc_status.sh external check)
+#
+# Keeps one multiplexed SSH connection per cluster open (OpenSSH ControlMaster started detached with ssh -M -N -f) and runs
+#   lseventlog -delim : -expired no -fixed no -monitoring no -message no -order severity
+# over it every --interval seconds, so there is no ssh key exchange per check.
+# Output is parsed in-process by column name and returned in zabbix_sender format
+# (http://www.zabbix.com/documentation/2.2/manpages/zabbix_sender):
+# <hostname> <key> <timestamp> <value>
+# svc1-blk svc.status.alerts 1365594894 2
+# svc1-blk svc.status.newAlerts 1365594894 1
+#
+#   svc.status.alerts    = number of unfixed alerts with error code (same value as svc_status.sh)
+#   svc.status.newAlerts = number of these alerts logged since the previous poll
+#
+# The highest sequence_number seen is kept per cluster, only events above it are new (and written to the log).
+# lseventlog can't filter by sequence number, open alerts are listed on every poll to notice fixed ones.
+#
+# Collector self-telemetry is returned as svc.collector.*[status,*] items on every poll (see svc_telemetry.py)
+#
+# Use with template _Special_Storwize_Block_Status
+#
+# Usage: svc_status_poller.py [--debug] --clusters <svc1>[,<svc2>...] [--interval <sec>] [--control_dir <path>] [--ssh <command>]
+#
+#   --debug = Enable debug output
+#   --clusters = Comma-separated Storwize node list (DNS name/IP), key-based SSH access is needed (see svc_status.sh)
+#   --interval = Poll interval in seconds (default 180)
+#   --control_dir = Directory of SSH ControlMaster sockets (default /var/cache/zabbix)
+#   --ssh = SSH client command (default ssh)
+#
+import getopt, sys, os, time, signal, threading, subprocess, tempfile, traceback
+from svc_telemetry import Telemetry
+
+def usage():
+  print >> sys.stderr, "Usage: svc_status_poller.py [--debug] --clusters <svc1>[,<svc2>...] [--interval <sec>] [--control_dir <path>] [--ssh <command>]"
+
+DEFAULT_INTERVAL = 180
+DEFAULT_CONTROL_DIR = '/var/cache/zabbix'
+CONNECT_TIMEOUT = 30 # seconds
+COMMAND_TIMEOUT = 120 # seconds, ssh commands running longer are killed (hung master connection)
+DELIM = ':'
+LSEVENTLOG = ['lseventlog', '-delim', DELIM, '-expired', 'no', '-fixed', 'no', '-monitoring', 'no', '-message', 'no', '-order', 'severity']
+
+##############################################################
+def debug_print(message):
+  if debug:
+    print >> sys.stderr, message
+
+def output(lines):
+  ''' Print values in zabbix_sender format, stdout is a pipe to zabbix_sender in real-time mode '''
+  if lines:
+    with output_lock:
+      print '\n'.join(lines)
+      sys.stdout.flush()
+
+def sshCommand(cluster, *args):
+  ''' ssh command line with ControlPath of the master connection of cluster (see ClusterPoller.connect) '''
+  return [ssh, '-q', '-o', 'PasswordAuthentication=no', '-o', 'BatchMode=yes',
+          '-o', 'ConnectTimeout=%d' % CONNECT_TIMEOUT, '-o', 'ServerAliveInterval=%d' % CONNECT_TIMEOUT,
+          '-o', 'ControlPath=%s' % os.path.join(control_dir, 'svc_status.%r@%h:%p')] + list(args)
+
+def runCommand(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+  ''' Run command, kill it after COMMAND_TIMEOUT seconds.
+      Return (exit code or None if command was killed, stdout, stderr) '''
+  devnull = open(os.devnull, 'r')
+  try:
+    p = subprocess.Popen(args, stdin=devnull, stdout=stdout, stderr=stderr)
+  finally:
+    devnull.close()
+  killed = []
+  def kill():
+    killed.append(True)
+    try:
+      p.kill()
+    except OSError:
+      pass
+  watchdog = threading.Timer(COMMAND_TIMEOUT, kill)
+  watchdog.start()
+  try:
+    out, err = p.communicate()
+  finally:
+    watchdog.cancel()
+  return (None if killed else p.returncode), out, err
+
+def parseEventLog(text):
+  ''' Return list of dict{column: value} of "lseventlog -delim" output, first line holds column names '''
+  lines = [l for l in text.splitlines() if l.strip()]
+  if not lines:
+    return []
+  columns = lines[0].split(DELIM)
+  events = []
+  for line in lines[1:]:
+    ''' description is the last column and may contain the delimiter '''
+    values = line.split(DELIM, len(columns) - 1)
+    events.append(dict(zip(columns, values)))
+  return events
+
+class ClusterPoller(object):
+  ''' Event log of one cluster, polled by its own thread '''
+  def __init__(self, cluster):
+    self.cluster = cluster
+    self.last_sequence = None # highest sequence_number seen, None before the first poll
+
+  def connect(self):
+    ''' Start ControlMaster of cluster unless it is running.
+        The master is started detached (-f) with its own stderr file: a master forked by "ControlMaster=auto"
+        inherits stderr pipe of the client that started it, so output of that client would never end. '''
+    code, out, err = runCommand(sshCommand(self.cluster, '-O', 'check', self.cluster))
+    if code == 0:
+      return
+    debug_print('%s: starting SSH master connection' % self.cluster)
+    devnull = open(os.devnull, 'w')
+    errors = tempfile.TemporaryFile()
+    try:
+      code, out, err = runCommand(sshCommand(self.cluster, '-M', '-N', '-f', '-o', 'ControlPersist=yes', self.cluster), stdout=devnull, stderr=errors)
+      if code != 0:
+        errors.seek(0)
+        print >> sys.stderr, "Can't start SSH master connection to %s (ssh exit code %s): %s" % (self.cluster, code, errors.read().strip())
+    finally:
+      devnull.close()
+      errors.close()
+
+  def poll(self):
+    telemetry = Telemetry('status', self.cluster)
+    with telemetry.phase('stats'):
+      self.connect()
+      ''' without master connection ssh connects directly '''
+      code, out, err = runCommand(sshCommand(self.cluster, '-o', 'ControlMaster=no', self.cluster, *LSEVENTLOG))
+    if code != 0:
+      print >> sys.stderr, 'lseventlog of %s failed (ssh exit code %s): %s' % (self.cluster, code, err.strip())
+      output(telemetry.lines())
+      return
+
+    events = parseEventLog(out)
+    alerts = [e for e in events if e.get('error_code', '').strip()]
+    last_sequence = max([int(e['sequence_number']) for e in events if e.get('sequence_number', '').isdigit()] + [self.last_sequence or 0])
+    new = []
+    if self.last_sequence is not None:
+      new = [e for e in alerts if e.get('sequence_number', '').isdigit() and int(e['sequence_number']) > self.last_sequence]
+    for e in new:
+      print >> sys.stderr, '%s: new alert %s %s %s %s %s' % (self.cluster, e['sequence_number'], e.get('last_timestamp'),
+                                                             e.get('object_name'), e.get('error_code'), e.get('description'))
+    debug_print('%s: %d events, %d alerts, %d new, last sequence number %s' % (self.cluster, len(events), len(alerts), len(new), last_sequence))
+    self.last_sequence = last_sequence
+
+    timestamp = int(time.time())
+    telemetry.count('events', len(events))
+    output(['%s svc.status.alerts %d %d' % (self.cluster, timestamp, len(alerts)),
+            '%s svc.status.newAlerts %d %d' % (self.cluster, timestamp, len(new))] + telemetry.lines())
+
+  def run(self):
+    while not stopping.is_set():
+      started = time.time()
+      try:
+        self.poll()
+      except Exception:
+        traceback.print_exc()
+      stopping.wait(max(0, started + interval - time.time()))
+
+  def close(self):
+    ''' Stop ControlMaster of cluster '''
+    devnull = open(os.devnull, 'w')
+    subprocess.call(sshCommand(self.cluster, '-O', 'exit', self.cluster), stdout=devnull, stderr=devnull)
+
+def terminate(signum, frame):
+  sys.exit(0)
+
+def run():
+  pollers = [ClusterPoller(cluster) for cluster in clusters]
+  threads = []
+  signal.signal(signal.SIGTERM, terminate)
+  try:
+    for poller in pollers:
+      t = threading.Thread(target=poller.run)
+      t.daemon = True
+      t.start()
+      threads.append(t)
+    ''' short waits keep main thread responsive to signals '''
+    while True:
+      time.sleep(5)
+  finally:
+    stopping.set()
+    for t in threads:
+      t.join(CONNECT_TIMEOUT)
+    for poller in pollers:
+      poller.close()
+
+##############################################################
+
+''' main script body '''
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "-h", ["help", "clusters=", "debug", "interval=", "control_dir=", "ssh="])
+  except getopt.GetoptError, err:
+    print >> sys.stderr, str(err)
+    usage()
+    sys.exit(2)
+
+  debug = False
+  clusters = []
+  interval = DEFAULT_INTERVAL
+  control_dir = DEFAULT_CONTROL_DIR
+  ssh = 'ssh'
+  for o, a in opts:
+    if o == "--clusters" and not a.startswith('--'):
+      clusters.extend( a.split(','))
+    elif o == "--interval":
+      interval = int(a)
+    elif o == "--control_dir" and not a.startswith('--'):
+      control_dir = a
+    elif o == "--ssh" and not a.startswith('--'):
+      ssh = a
+    elif o == "--debug":
+      debug = True
+    elif o in ("-h", "--help"):
+      usage()
+      sys.exit()
+
+  if not clusters:
+    print >> sys.stderr, '--clusters option must be set'
+    usage()
+    sys.exit(2)
+
+  output_lock = threading.Lock()
+  stopping = threading.Event()
+  run()
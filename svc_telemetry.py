@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Collector self-telemetry for svc_* scripts
+#
+# Measures duration of collector run phases and counts processed elements per cluster.
+# Values are returned as "svc.collector.*" Zabbix items:
+# <hostname> <key> <timestamp> <value>
+# svc1-blk svc.collector.duration[perf,connect] 1356526942 0.0213
+# svc1-blk svc.collector.duration[perf,stats] 1356526942 4.2531
+# svc1-blk svc.collector.duration[perf,total] 1356526942 5.0176
+# svc1-blk svc.collector.count[perf,elements] 1356526942 1520
+# svc1-blk svc.collector.count[perf,skipped] 1356526942 0
+#
+# Collectors: perf (svc_perf_wbem.py), mon (svc_mon.py), discovery (svc_perf_discovery_sender.py), graph (svc_perf_graph.py),
+#             inventory (svc_inventory.py), listener (svc_mon_listener.py), status (svc_status_poller.py)
+# Phases: connect, names (element name/inventory enumeration), stats (statistics/status enumeration), items (Zabbix API item lookup),
+#         compute, cache (cache I/O), send (sending values to Zabbix), total (whole run)
+# Phase durations are summed over all threads of a run, so they may exceed total run time of parallel collectors.
+#
+# Use with template _Special_Storwize_Perf
+#
+import time, threading, contextlib
+from zbxsend import Metric
+
+class Telemetry(object):
+  ''' Phase durations and element counters of one collector run for one cluster '''
+
+  def __init__(self, collector, cluster):
+    self.collector = collector
+    self.cluster = cluster
+    self.started = time.time()
+    self.durations = {}
+    self.counters = {}
+    self.lock = threading.Lock()
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    ''' Measure duration of code block: with telemetry.phase('stats'): ... '''
+    started = time.time()
+    try:
+      yield
+    finally:
+      with self.lock:
+        self.durations[name] = self.durations.get(name, 0) + time.time() - started
+
+  def duration(self, name, seconds):
+    ''' Add duration of phase measured outside of telemetry.phase() (e.g. shared by several clusters) '''
+    with self.lock:
+      self.durations[name] = self.durations.get(name, 0) + seconds
+
+  def count(self, name, n=1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  def metrics(self):
+    ''' Return list of Metric, total duration is measured from Telemetry creation '''
+    timestamp = int(time.time())
+    with self.lock:
+      durations = dict(self.durations, total=time.time() - self.started)
+      counters = dict(self.counters)
+
+    metrics = []
+    for name, value in sorted(durations.items()):
+      metrics.append(Metric(self.cluster, 'svc.collector.duration[%s,%s]' % (self.collector, name), '%.4f' % value, timestamp))
+    for name, value in sorted(counters.items()):
+      metrics.append(Metric(self.cluster, 'svc.collector.count[%s,%s]' % (self.collector, name), value, timestamp))
+    return metrics
+
+  def lines(self):
+    ''' Return metrics in zabbix_sender format '''
+    return ['%s %s %d %s' % (m.host, m.key, m.clock, m.value) for m in self.metrics()]
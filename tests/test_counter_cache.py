@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_wbem.py counter cache file (CounterCache, HistoryCache, loadCache)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, struct, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_wbem
+from svc_perf_wbem import CounterCache, HistoryCache
+
+def counters(n):
+  return {'timestamp': 1356526800 + n, 'KBytesRead': n * 16, 'ReadIOs': n, 'TotalIOs': 2 * n}
+
+class CounterCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp(prefix='svc_perf_test.')
+    self.path = os.path.join(self.tmpdir, 'svc_perf.test.cache')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+  def corrupt(self, key, data):
+    ''' overwrite part of record of key in cache file like a run killed in the middle of the record update '''
+    cache = CounterCache(self.path)
+    offset, found = cache.find(key)
+    self.assertTrue(found)
+    cache.map.close()
+    f = open(self.path, 'r+b')
+    f.seek(offset + cache.KEY_OFFSET + cache.KEY_SIZE)
+    f.write(data)
+    f.close()
+
+  def testReopen(self):
+    cache = CounterCache(self.path)
+    cache.update({'svc1.volume.vol0': counters(0), u'svc1.volume.тест': counters(1)})
+    cache.flush()
+    cache = CounterCache(self.path)
+    self.assertEqual(cache.get('svc1.volume.vol0'), counters(0))
+    self.assertEqual(cache.get(u'svc1.volume.тест'), counters(1))
+    self.assertEqual(cache.get('svc1.volume.vol2'), None)
+    self.assertEqual(sorted(cache.items()), sorted([(u'svc1.volume.vol0', counters(0)), (u'svc1.volume.тест', counters(1))]))
+
+  def testUndefinedCounters(self):
+    ''' counters missing in sample are not read back as 0 '''
+    cache = CounterCache(self.path)
+    cache.put('svc1.mdisk.md0', {'timestamp': 100, 'ReadIOs': 0, 'WriteIOs': None})
+    self.assertEqual(CounterCache(self.path).get('svc1.mdisk.md0'), {'timestamp': 100, 'ReadIOs': 0})
+
+  def testTornRecord(self):
+    ''' damaged record is ignored, other records survive and the record is repaired by the next put '''
+    cache = CounterCache(self.path)
+    cache.update(dict(('svc1.volume.vol%d' % i, counters(i)) for i in range(20)))
+    cache.flush()
+    self.corrupt('svc1.volume.vol7', struct.pack('<Q', 12345))
+
+    cache = CounterCache(self.path)
+    self.assertEqual(cache.get('svc1.volume.vol7'), None)
+    for i in range(20):
+      if i != 7:
+        self.assertEqual(cache.get('svc1.volume.vol%d' % i), counters(i))
+    self.assertEqual(len(cache.items()), 19)
+
+    cache.put('svc1.volume.vol7', counters(70))
+    self.assertEqual(cache.count, 20)
+    self.assertEqual(CounterCache(self.path).get('svc1.volume.vol7'), counters(70))
+
+  def testGrow(self):
+    ''' table is rebuilt in temporary file and renamed over the cache file '''
+    cache = CounterCache(self.path)
+    items = dict(('svc1.volume.vol%d' % i, counters(i)) for i in range(CounterCache.INITIAL_CAPACITY))
+    cache.update(items)
+    cache.flush()
+    self.assertTrue(cache.capacity > CounterCache.INITIAL_CAPACITY)
+    self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    cache = CounterCache(self.path)
+    self.assertEqual(cache.count, len(items))
+    self.assertEqual(dict(cache.items()), items)
+
+  def testNotCacheFile(self):
+    open(self.path, 'wb').write('garbage' * 100)
+    self.assertRaises(ValueError, CounterCache, self.path)
+
+  def testTruncatedFile(self):
+    ''' file cut short by full disk is not mapped beyond its end '''
+    cache = CounterCache(self.path)
+    cache.put('svc1.volume.vol0', counters(0))
+    cache.flush()
+    cache.map.close()
+    f = open(self.path, 'r+b')
+    f.truncate(CounterCache.HEADER.size + 10 * cache.RECORD.size)
+    f.close()
+    self.assertRaises(ValueError, CounterCache, self.path)
+
+  def testJSONCache(self):
+    ''' JSON cache of previous script versions is converted '''
+    open(self.path, 'w').write('{"svc1.volume.vol0": {"timestamp": 1356526800, "ReadIOs": 5}}')
+    cache = CounterCache(self.path)
+    self.assertEqual(cache.get('svc1.volume.vol0'), {'timestamp': 1356526800, 'ReadIOs': 5})
+    self.assertEqual(open(self.path, 'rb').read(8), CounterCache.MAGIC)
+
+  def testLoadCacheRecreatesDamagedFile(self):
+    svc_perf_wbem.cachefile = self.path
+    open(self.path, 'wb').write('garbage' * 100)
+    cache = svc_perf_wbem.loadCache()
+    self.assertTrue(isinstance(cache, CounterCache))
+    self.assertEqual(cache.items(), [])
+    cache.put('svc1.volume.vol0', counters(0))
+    self.assertEqual(svc_perf_wbem.loadCache().get('svc1.volume.vol0'), counters(0))
+
+class HistoryCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp(prefix='svc_perf_test.')
+    self.path = os.path.join(self.tmpdir, 'svc_perf.test.cache.history')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+  def testRingBuffer(self):
+    ''' only the newest <slots> samples are kept, undefined values are not read back '''
+    cache = HistoryCache(self.path, ['ReadIOTime', 'TotalIORate'], 4)
+    samples = [(1000 + 180 * i, {'ReadIOTime': float(i), 'TotalIORate': 0.5 * i}) for i in range(6)]
+    samples[5] = (samples[5][0], {'TotalIORate': 2.5})
+    cache.put('svc1.volume.vol0', samples)
+    cache.flush()
+    self.assertEqual(HistoryCache(self.path, ['ReadIOTime', 'TotalIORate'], 4).get('svc1.volume.vol0'), samples[-4:])
+
+  def testSlotsChanged(self):
+    ''' history file of another slot count is not a valid cache '''
+    HistoryCache(self.path, ['ReadIOTime'], 4).put('svc1.volume.vol0', [(1000, {'ReadIOTime': 1.0})])
+    self.assertRaises(ValueError, HistoryCache, self.path, ['ReadIOTime'], 8)
+
+if __name__ == '__main__':
+  unittest.main()
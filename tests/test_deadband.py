@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_wbem.py deadband filter and heartbeat (deadbandFilter, poolMetrics)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_wbem
+
+class DeadbandTest(unittest.TestCase):
+  def setUp(self):
+    ''' svc_perf_wbem.py globals normally set by its command line '''
+    m = svc_perf_wbem
+    m.deadband = 1.0
+    m.deadband_pct = 10.0
+    m.heartbeat = 3
+    m.sent = None
+    m.cache_lock = threading.Lock()
+
+  def testFirstSample(self):
+    ''' element without last sent values sends everything '''
+    values = {'ReadIORate': 10.0, 'WriteIORate': 0.0}
+    send, record = svc_perf_wbem.deadbandFilter(None, values)
+    self.assertEqual(send, values)
+    self.assertEqual(record, dict(values, age=0))
+
+  def testThreshold(self):
+    ''' value is sent if it differs by more than max(deadband, deadband_pct of last sent value) '''
+    last = {'ReadIORate': 100.0, 'WriteIORate': 5.0, 'ReadIOTime': 2.0, 'age': 0}
+    send, record = svc_perf_wbem.deadbandFilter(last, {'ReadIORate': 109.0, 'WriteIORate': 6.5, 'ReadIOTime': 2.5, 'TotalIORate': 0.0})
+    self.assertEqual(send, {'WriteIORate': 6.5, 'TotalIORate': 0.0})
+    ''' last sent values of suppressed counters are kept, so slow drift is sent once it crosses the threshold '''
+    self.assertEqual(record, {'ReadIORate': 100.0, 'WriteIORate': 6.5, 'ReadIOTime': 2.0, 'TotalIORate': 0.0, 'age': 1})
+    send, record = svc_perf_wbem.deadbandFilter(record, {'ReadIORate': 111.0, 'WriteIORate': 6.5, 'ReadIOTime': 2.5, 'TotalIORate': 0.0})
+    self.assertEqual(send, {'ReadIORate': 111.0})
+
+  def testHeartbeat(self):
+    ''' all values are sent every heartbeat runs even if they do not change '''
+    values = {'ReadIORate': 10.0, 'WriteIORate': 1.0}
+    last = None
+    sent = []
+    for run in range(7):
+      send, last = svc_perf_wbem.deadbandFilter(last, values)
+      sent.append(send == values)
+      if not send:
+        self.assertEqual(last['age'], run % 3)
+    self.assertEqual(sent, [True, False, False, True, False, False, True])
+
+  def testHeartbeatDisabledDeadband(self):
+    ''' heartbeat 1 sends every value on every run '''
+    svc_perf_wbem.heartbeat = 1
+    last = {'ReadIORate': 10.0, 'age': 0}
+    self.assertEqual(svc_perf_wbem.deadbandFilter(last, {'ReadIORate': 10.0})[0], {'ReadIORate': 10.0})
+
+  def testPoolMetrics(self):
+    ''' pool totals are filtered with their own last sent values, all metrics are returned for sinks without deadband '''
+    svc_perf_wbem.sent = {}
+    pools = {'pool0': {'timestamp': 1000, 'ReadIORate': 100.0, 'WriteIORate': 50.0, 'ReadIOTime': 300.0, 'ReadIOTime.weight': 100.0}}
+    metrics, all_metrics = svc_perf_wbem.poolMetrics('svc1', 'volume', pools)
+    self.assertEqual(sorted(m.key for m in metrics), ['svc.pool.ReadIORate[volume,pool0]', 'svc.pool.ReadIOTime[volume,pool0]', 'svc.pool.WriteIORate[volume,pool0]'])
+    self.assertEqual([m.value for m in metrics if m.key.startswith('svc.pool.ReadIOTime')], [3.0])
+    self.assertEqual(svc_perf_wbem.sent['svc1.pool.volume.pool0']['age'], 0)
+
+    pools['pool0'].update(timestamp=1180, WriteIORate=80.0)
+    metrics, all_metrics = svc_perf_wbem.poolMetrics('svc1', 'volume', pools)
+    self.assertEqual([m.key for m in metrics], ['svc.pool.WriteIORate[volume,pool0]'])
+    self.assertEqual(len(all_metrics), 3)
+    self.assertEqual(set(m.clock for m in all_metrics), set([1180]))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_discovery_sender.py LLD payloads and skipping of unchanged payloads
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, json, time, hashlib, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_discovery_sender as sender
+
+def inventory(volumes):
+  return {'volume': dict((str(i), {'name': 'vol%d' % i}) for i in volumes),
+          'mdisk': {'0': {'name': 'mdisk0'}},
+          'pool': {'1': {'name': 'pool1'}}}
+
+class DiscoveryTest(unittest.TestCase):
+  def setUp(self):
+    self.saved = sender.svc_inventory.getInventory
+    self.inventory = inventory([0, 1, 2])
+    sender.svc_inventory.getInventory = lambda snapshot_dir, cluster, connect, max_age: self.inventory
+    sender.debug = False
+    sender.state = {}
+    sender.max_age = 86400
+    sender.inventory_dir = '/nonexistent'
+    sender.inventory_max_age = 900
+    sender.results_lock = threading.Lock()
+
+  def tearDown(self):
+    sender.svc_inventory.getInventory = self.saved
+
+  def discover(self):
+    results = []
+    sender.discoverCluster('svc1', results)
+    cluster, telemetry, metrics, hashes = results[0]
+    ''' sent payloads are saved like after successful send '''
+    sender.state.setdefault(cluster, {}).update(hashes)
+    return dict((m.key, m.value) for m in metrics), hashes
+
+  def testPayloads(self):
+    metrics, hashes = self.discover()
+    self.assertEqual(sorted(metrics), ['svc.discovery.%s' % d for d in sorted(sender.DISCOVERY_TYPES)])
+    self.assertEqual(json.loads(metrics['svc.discovery.volume-mdisk'])['data'],
+                     [{'{#TYPE}': 'mdisk', '{#NAME}': 'mdisk0', '{#ID}': '0'}] +
+                     [{'{#TYPE}': 'volume', '{#NAME}': 'vol%d' % i, '{#ID}': str(i)} for i in range(3)])
+    self.assertEqual(metrics['svc.discovery.pool'], metrics['svc.discovery.pool-perf'])
+    self.assertEqual(hashes['svc.discovery.pool'][0], hashlib.md5(metrics['svc.discovery.pool']).hexdigest())
+
+  def testUnchanged(self):
+    self.discover()
+    ''' element order of inventory does not change payload '''
+    self.inventory = inventory([2, 1, 0])
+    metrics, hashes = self.discover()
+    self.assertEqual(metrics, {})
+    self.assertEqual(hashes, {})
+
+  def testChanged(self):
+    self.discover()
+    self.inventory = inventory([0, 1, 3])
+    metrics, hashes = self.discover()
+    self.assertEqual(sorted(metrics), ['svc.discovery.volume', 'svc.discovery.volume-mdisk'])
+
+  def testMaxAge(self):
+    self.discover()
+    for key in sender.state['svc1']:
+      sender.state['svc1'][key][1] -= 86400
+    metrics, hashes = self.discover()
+    self.assertEqual(len(metrics), len(sender.DISCOVERY_TYPES))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_graph.py graph diff (buildGraphs, syncGraphs) and item map cache (getItems)
+# against in-memory replacement of Zabbix API
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, time, unittest, StringIO
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_graph
+from svc_perf_graph import ZabbixAPIException, VOLUME_GRAPHS, MDISK_GRAPHS
+from svc_telemetry import Telemetry
+
+HOSTID = '10101'
+
+class FakeMethod(object):
+  def __init__(self, api, name):
+    self.api = api
+    self.name = name
+
+  def __getattr__(self, method):
+    def call(*args, **kwargs):
+      self.api.calls.append(('%s.%s' % (self.name, method), len(args)))
+      if method in self.api.fail:
+        raise ZabbixAPIException('%s failed' % method)
+      return getattr(self.api, '%s_%s' % (self.name, method))(*args, **kwargs)
+    return call
+
+class FakeZabbix(object):
+  ''' graphs and items of one host, values are returned as strings like Zabbix API does '''
+  def __init__(self):
+    self.items = {}  # itemid -> key
+    self.graphs = {} # graphid -> graph
+    self.nextid = 1000
+    self.calls = []
+    self.fail = set()
+    self.item = FakeMethod(self, 'item')
+    self.graph = FakeMethod(self, 'graph')
+
+  def newid(self):
+    self.nextid += 1
+    return str(self.nextid)
+
+  def addItems(self, pool):
+    for t in VOLUME_GRAPHS + MDISK_GRAPHS:
+      for key in t['items']:
+        self.items[self.newid()] = key % pool
+
+  def deleteItems(self, pool):
+    for itemid, key in self.items.items():
+      if key.endswith(',%s]' % pool):
+        del self.items[itemid]
+
+  def item_get(self, hostids, search, startSearch, countOutput=False, output=None, sortfield=None, sortorder=None, limit=None):
+    items = [{'itemid': i, 'key_': k, 'name': k} for (i, k) in sorted(self.items.items(), key=lambda i: int(i[0]), reverse=sortorder == 'DESC')
+             if k.startswith(search['key_'])]
+    if countOutput:
+      return str(len(items))
+    return items[:limit] if limit else items
+
+  def graph_get(self, hostids, search, startSearch, output, selectGraphItems):
+    return [dict(g, gitems=[dict((k, str(v)) for (k, v) in i.items()) for i in g['gitems']])
+            for g in self.graphs.values() if g['name'].startswith(search['name'])]
+
+  def store(self, graph):
+    return dict((k, str(v) if k != 'gitems' else v) for (k, v) in graph.items())
+
+  def graph_create(self, *graphs):
+    for g in graphs:
+      graphid = self.newid()
+      self.graphs[graphid] = dict(self.store(g), graphid=graphid)
+
+  def graph_update(self, *graphs):
+    for g in graphs:
+      self.graphs[g['graphid']] = self.store(g)
+
+  def graph_delete(self, *graphids):
+    for graphid in graphids:
+      del self.graphs[graphid]
+
+  def names(self):
+    return sorted(g['name'] for g in self.graphs.values())
+
+class GraphSyncTest(unittest.TestCase):
+  def setUp(self):
+    ''' svc_perf_graph.py globals normally set by its command line '''
+    svc_perf_graph.debug = False
+    svc_perf_graph.items_ttl = 86400
+    svc_perf_graph.GRAPH_BATCH = 4
+    self.zabbix = FakeZabbix()
+
+  def sync(self, pools):
+    zabbix_items, cached = svc_perf_graph.getItems(self.zabbix, HOSTID, None)
+    graphs = []
+    for pool in pools:
+      graphs.extend(svc_perf_graph.buildGraphs(pool, VOLUME_GRAPHS, zabbix_items))
+      graphs.extend(svc_perf_graph.buildGraphs(pool, MDISK_GRAPHS, zabbix_items))
+    self.zabbix.calls = []
+    telemetry = Telemetry('graph', 'svc1')
+    failed = svc_perf_graph.syncGraphs(self.zabbix, HOSTID, graphs, telemetry)
+    return failed, telemetry.counters['changed']
+
+  def writes(self):
+    return [c for c in self.zabbix.calls if c[0] != 'graph.get']
+
+  def testCreate(self):
+    ''' graphs are created in batches, graphs without items are not created '''
+    self.zabbix.addItems('pool0')
+    self.zabbix.addItems('pool1')
+    self.assertEqual(self.sync(['pool0', 'pool1', 'empty']), (0, 12))
+    self.assertEqual(self.writes(), [('graph.create', 4), ('graph.create', 4), ('graph.create', 4)])
+    self.assertEqual(len(self.zabbix.names()), 12)
+    self.assertTrue('Pool - pool0 - Volume IOPS' in self.zabbix.names())
+    graph = [g for g in self.zabbix.graphs.values() if g['name'] == 'Pool - pool1 - MDisk IO Time'][0]
+    self.assertEqual([self.zabbix.items[i['itemid']] for i in graph['gitems']], ['svc.pool.ReadIOTime[mdisk,pool1]', 'svc.pool.WriteIOTime[mdisk,pool1]'])
+
+  def testUnchanged(self):
+    ''' second run compares API strings with built values and writes nothing '''
+    self.zabbix.addItems('pool0')
+    self.sync(['pool0'])
+    self.assertEqual(self.sync(['pool0']), (0, 0))
+    self.assertEqual(self.writes(), [])
+
+  def testUpdate(self):
+    ''' graph is updated in place if its items change '''
+    self.zabbix.addItems('pool0')
+    self.sync(['pool0'])
+    graphids = sorted(self.zabbix.graphs)
+    self.zabbix.deleteItems('pool0')
+    self.zabbix.addItems('pool0')
+    self.assertEqual(self.sync(['pool0']), (0, 6))
+    self.assertEqual(self.writes(), [('graph.update', 4), ('graph.update', 2)])
+    self.assertEqual(sorted(self.zabbix.graphs), graphids)
+    for g in self.zabbix.graphs.values():
+      self.assertTrue(all(i['itemid'] in self.zabbix.items for i in g['gitems']))
+
+  def testDelete(self):
+    ''' graphs of deleted pools and graphs of pools without items are deleted, user graphs are kept '''
+    self.zabbix.addItems('pool0')
+    self.zabbix.addItems('pool1')
+    self.zabbix.addItems('pool2')
+    self.sync(['pool0', 'pool1', 'pool2'])
+    self.zabbix.graph_create({'name': 'Pool - pool1 - My graph', 'height': 100, 'width': 100, 'graphtype': 0, 'gitems': []})
+    self.zabbix.deleteItems('pool2')
+    self.assertEqual(self.sync(['pool0', 'pool2']), (0, 12))
+    self.assertEqual(self.writes(), [('graph.delete', 4), ('graph.delete', 4), ('graph.delete', 4)])
+    self.assertEqual([n for n in self.zabbix.names() if 'pool0' not in n], ['Pool - pool1 - My graph'])
+
+  def testFailure(self):
+    ''' failed batches are counted, other batches are still written '''
+    self.zabbix.addItems('pool0')
+    self.zabbix.addItems('pool1')
+    self.sync(['pool0', 'pool1'])
+    self.zabbix.fail.add('delete')
+    self.zabbix.deleteItems('pool0')
+    self.zabbix.deleteItems('pool1')
+    self.zabbix.addItems('pool2')
+    stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+    try:
+      self.assertEqual(self.sync(['pool2']), (3, 18))
+      self.assertEqual(sys.stderr.getvalue().count('ZabbixAPIException thrown on graphs'), 3)
+    finally:
+      sys.stderr = stderr
+    self.assertEqual(len(self.zabbix.graphs), 18)
+
+class ItemCacheTest(unittest.TestCase):
+  def setUp(self):
+    svc_perf_graph.debug = False
+    svc_perf_graph.items_ttl = 86400
+    self.zabbix = FakeZabbix()
+    self.zabbix.addItems('pool0')
+    self.zabbix.items[self.zabbix.newid()] = 'svc.pool.TotalIORate[volume,pool0]'
+    self.items, self.cached = svc_perf_graph.getItems(self.zabbix, HOSTID, None)
+
+  def testRead(self):
+    ''' only graphed svc.pool.* items are kept '''
+    self.assertEqual(len(self.items), 12)
+    self.assertEqual(self.cached['count'], 13)
+
+  def testReuse(self):
+    self.zabbix.calls = []
+    items, cached = svc_perf_graph.getItems(self.zabbix, HOSTID, self.cached)
+    self.assertTrue(cached is self.cached)
+    self.assertEqual(items, self.items)
+    self.assertEqual(len(self.zabbix.calls), 2)
+
+  def testReplacedItems(self):
+    ''' items deleted and created again keep the count but change the highest itemid '''
+    self.zabbix.deleteItems('pool0')
+    self.zabbix.addItems('pool0')
+    self.zabbix.items[self.zabbix.newid()] = 'svc.pool.TotalIORate[volume,pool0]'
+    items, cached = svc_perf_graph.getItems(self.zabbix, HOSTID, self.cached)
+    self.assertFalse(cached is self.cached)
+    self.assertEqual(set(items.keys()), set(self.items.keys()))
+    self.assertNotEqual(items, self.items)
+
+  def testExpired(self):
+    self.cached['refreshed'] = time.time() - svc_perf_graph.items_ttl - 1
+    self.assertFalse(svc_perf_graph.getItems(self.zabbix, HOSTID, self.cached)[1] is self.cached)
+
+  def testOtherHost(self):
+    self.assertFalse(svc_perf_graph.getItems(self.zabbix, '10102', self.cached)[1] is self.cached)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_inventory.py snapshot files and fallback to cluster enumeration
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, json, time, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_inventory
+
+class Property(object):
+  def __init__(self, value):
+    self.value = value
+
+class Instance(object):
+  def __init__(self, **properties):
+    self.properties = dict((k, Property(v)) for (k, v) in properties.iteritems())
+
+class InventoryConnection(object):
+  ''' WBEM connection with one volume, mdisk and pool '''
+  def ExecQuery(self, language, query):
+    if 'IBMTSSVC_StorageVolume' in query:
+      return [Instance(DeviceID='0', ElementName='vol0', PoolName='pool1', NativeStatus=2, BlockSize=512, NumberOfBlocks=2048)]
+    if 'IBMTSSVC_BackendVolume' in query:
+      return [Instance(DeviceID='1', ElementName='mdisk1', PoolName='pool1', NativeStatus=2, BlockSize=512), Instance(DeviceID=None)]
+    return [Instance(PoolID='5', ElementName='pool1', NativeStatus=2, TotalManagedSpace=10, VirtualCapacity=20, UsedCapacity=5, RealCapacity=6)]
+
+class SnapshotTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.connects = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def connect(self):
+    self.connects += 1
+    return InventoryConnection()
+
+  def testEnumerate(self):
+    snapshot = svc_inventory.getInventory(self.dir, 'svc1', self.connect)
+    self.assertEqual(snapshot['volume'], {'0': {'name': 'vol0', 'pool': 'pool1', 'status': 2, 'capacity': 1048576}})
+    self.assertEqual(snapshot['mdisk'], {'1': {'name': 'mdisk1', 'pool': 'pool1', 'status': 2, 'capacity': None}})
+    self.assertEqual(snapshot['pool']['5']['virtualCapacity'], 20)
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1'), snapshot)
+
+  def testFreshSnapshot(self):
+    svc_inventory.getInventory(self.dir, 'svc1', self.connect)
+    svc_inventory.getInventory(self.dir, 'svc1', self.connect)
+    self.assertEqual(self.connects, 1)
+
+  def testStaleSnapshot(self):
+    ''' stale snapshot is not used, cluster is enumerated and snapshot rewritten '''
+    snapshot = svc_inventory.getInventory(self.dir, 'svc1', self.connect)
+    snapshot['refreshed'] -= 1000
+    svc_inventory.saveSnapshot(self.dir, snapshot)
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1', 900), None)
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1', 1800)['refreshed'], snapshot['refreshed'])
+    fresh = svc_inventory.getInventory(self.dir, 'svc1', self.connect, 900)
+    self.assertEqual(self.connects, 2)
+    self.assertTrue(time.time() - fresh['refreshed'] < 60)
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1', 900), fresh)
+
+  def testInvalidSnapshot(self):
+    path = svc_inventory.snapshotPath(self.dir, 'svc1')
+    open(path, 'w').write('{broken')
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1'), None)
+    json.dump({'version': svc_inventory.SNAPSHOT_VERSION + 1, 'cluster': 'svc1', 'refreshed': int(time.time())}, open(path, 'w'))
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1'), None)
+    json.dump({'version': svc_inventory.SNAPSHOT_VERSION, 'cluster': 'svc2', 'refreshed': int(time.time())}, open(path, 'w'))
+    self.assertEqual(svc_inventory.loadSnapshot(self.dir, 'svc1'), None)
+
+  def testNoSnapshotDir(self):
+    svc_inventory.getInventory(None, 'svc1', self.connect)
+    svc_inventory.getInventory(None, 'svc1', self.connect)
+    self.assertEqual(self.connects, 2)
+    self.assertEqual(os.listdir(self.dir), [])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_mon_listener.py reconciliation of indication subscriptions
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pywbem
+import svc_mon_listener
+
+class FakeProvider(object):
+  ''' Subscriptions stored in CIM provider: set of (filter name, destination name) '''
+  def __init__(self):
+    self.subscriptions = set()
+    self.managers = 0
+
+def subscriptionPath(filter_name, destination_name):
+  return pywbem.CIMInstanceName('CIM_IndicationSubscription', keybindings={
+    'Filter': pywbem.CIMInstanceName('CIM_IndicationFilter', keybindings={'Name': filter_name}),
+    'Handler': pywbem.CIMInstanceName('CIM_ListenerDestinationCIMXML', keybindings={'Name': destination_name})})
+
+class FakeSubscriptionManager(object):
+  ''' WBEMSubscriptionManager with one server, subscriptions stored in provider '''
+  provider = None
+
+  def __init__(self, subscription_manager_id):
+    self.provider.managers += 1
+    self.owned = []
+
+  def add_server(self, server):
+    return server
+
+  def add_listener_destinations(self, server_id, url):
+    return [pywbem.CIMInstance('CIM_ListenerDestinationCIMXML', path=pywbem.CIMInstanceName('CIM_ListenerDestinationCIMXML', keybindings={'Name': url}))]
+
+  def add_filter(self, server_id, namespace, query, filter_id):
+    return pywbem.CIMInstance('CIM_IndicationFilter', path=pywbem.CIMInstanceName('CIM_IndicationFilter', keybindings={'Name': filter_id}))
+
+  def add_subscriptions(self, server_id, filter_path, destination_paths):
+    for d in destination_paths:
+      key = (filter_path.keybindings['Name'], d.keybindings['Name'])
+      self.provider.subscriptions.add(key)
+      self.owned.append(pywbem.CIMInstance('CIM_IndicationSubscription', path=subscriptionPath(*key)))
+
+  def get_owned_subscriptions(self, server_id):
+    return list(self.owned)
+
+  def get_all_subscriptions(self, server_id):
+    return [pywbem.CIMInstance('CIM_IndicationSubscription', path=subscriptionPath(*key)) for key in self.provider.subscriptions]
+
+  def remove_server(self, server_id):
+    for s in self.owned:
+      key = svc_mon_listener.subscriptionKey(s.path)
+      if key not in self.provider.subscriptions:
+        raise pywbem.CIMError(pywbem.CIM_ERR_NOT_FOUND)
+      self.provider.subscriptions.remove(key)
+    self.owned = []
+
+class FakeConnection(object):
+  url = 'http://localhost:5988'
+
+  def EnumerateInstances(self, classname, PropertyList=None):
+    return []
+
+class ReconcileTest(unittest.TestCase):
+  def setUp(self):
+    self.provider = FakeProvider()
+    FakeSubscriptionManager.provider = self.provider
+    self.saved = (pywbem.WBEMSubscriptionManager, pywbem.WBEMServer, svc_mon_listener.connect,
+                  svc_mon_listener.svc_inventory.enumInventory, svc_mon_listener.output)
+    pywbem.WBEMSubscriptionManager = FakeSubscriptionManager
+    pywbem.WBEMServer = lambda conn: conn.url
+    svc_mon_listener.connect = lambda cluster: FakeConnection()
+    svc_mon_listener.svc_inventory.enumInventory = lambda conn, cluster: {'refreshed': 1356530400, 'pool': {},
+                                                                          'volume': {'0': {'status': 2}}, 'mdisk': {}}
+    self.lines = []
+    svc_mon_listener.output = self.lines.extend
+    svc_mon_listener.debug = False
+    svc_mon_listener.listen_host = 'zabbix'
+    svc_mon_listener.listen_port = 5990
+    svc_mon_listener.inventory_dir = None
+    self.state = svc_mon_listener.ClusterState('localhost')
+
+  def tearDown(self):
+    (pywbem.WBEMSubscriptionManager, pywbem.WBEMServer, svc_mon_listener.connect,
+     svc_mon_listener.svc_inventory.enumInventory, svc_mon_listener.output) = self.saved
+
+  def subscribedCount(self):
+    return [l for l in self.lines if 'svc.collector.count[listener,subscribed]' in l][-1].split()[-1]
+
+  def testSubscribe(self):
+    svc_mon_listener.reconcile(self.state)
+    self.assertEqual(len(self.provider.subscriptions), len(svc_mon_listener.INDICATION_QUERIES))
+    self.assertTrue('localhost svc.volume.nativeStatus[0] 1356530400 2' in self.lines)
+    self.assertEqual(self.subscribedCount(), '1')
+    ''' existing subscriptions are kept '''
+    svc_mon_listener.reconcile(self.state)
+    self.assertEqual(self.provider.managers, 1)
+
+  def testLostSubscriptions(self):
+    ''' CIM provider restarted without subscriptions '''
+    svc_mon_listener.reconcile(self.state)
+    self.provider.subscriptions.clear()
+    svc_mon_listener.reconcile(self.state)
+    self.assertEqual(self.provider.managers, 2)
+    self.assertEqual(len(self.provider.subscriptions), len(svc_mon_listener.INDICATION_QUERIES))
+    self.assertEqual(self.subscribedCount(), '1')
+
+  def testLostSubscription(self):
+    svc_mon_listener.reconcile(self.state)
+    self.provider.subscriptions.pop()
+    svc_mon_listener.reconcile(self.state)
+    self.assertEqual(self.provider.managers, 2)
+    self.assertEqual(len(self.provider.subscriptions), len(svc_mon_listener.INDICATION_QUERIES))
+
+  def testUnsubscribe(self):
+    svc_mon_listener.reconcile(self.state)
+    svc_mon_listener.unsubscribe(self.state)
+    self.assertEqual(self.provider.subscriptions, set())
+    self.assertEqual(self.state.server_id, None)
+
+if __name__ == '__main__':
+  unittest.main()
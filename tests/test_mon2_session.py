@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_mon2.py session state: state file merge and login after expired saved session
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, json, time, shutil, tempfile, threading, unittest
+import BaseHTTPServer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_mon2
+
+STATUS_EVENT = {'clazz': 'com.ibm.svc.gui.events.ConnectionStatusEvent', 'id': 42, 'timestamp': 1409819425770,
+                'externalStorage': '0', 'internalStorage': '1', 'remotePartnerships': '2'}
+
+class GUIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  ''' GUI of one cluster: /login starts session "valid", other sessions are redirected to login page '''
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+    if self.path.startswith('/login'):
+      self.server.logins += 1
+      self.send_response(200)
+      self.send_header('Set-Cookie', 'JSESSIONID=valid; Path=/')
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    self.server.polls.append(json.loads(body)['methodArgs'][0])
+    if 'JSESSIONID=valid' not in (self.headers.getheader('cookie') or ''):
+      self.send_response(302)
+      self.send_header('Location', '/login')
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    data = json.dumps({'clazz': 'com.ibm.evo.rpc.RPCResponse', 'messages': None,
+                       'result': {'clazz': 'com.ibm.evo.events.PollResponse', 'events': [STATUS_EVENT, {'id': 50}]}})
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, *args):
+    pass
+
+class SessionTest(unittest.TestCase):
+  def setUp(self):
+    self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), GUIHandler)
+    self.server.logins = 0
+    self.server.polls = []
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    svc_mon2.debug = False
+    svc_mon2.user = 'monitor'
+    svc_mon2.password = 'secret'
+    svc_mon2.timeout = 5
+    svc_mon2.run_deadline = 30
+    svc_mon2.deadline = time.time() + svc_mon2.run_deadline
+    svc_mon2.results_lock = threading.Lock()
+    self.target = svc_mon2.makeTarget('svc1')
+    self.target['url'] = 'http://127.0.0.1:%d' % self.server.server_port
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def monitor(self, state):
+    results = []
+    svc_mon2.monitorTarget(self.target, state, results)
+    self.assertEqual(len(results), 1)
+    return results[0]
+
+  def testExpiredSession(self):
+    state = {self.target['url']: {'user': 'monitor', 'cookies': {'JSESSIONID': 'expired'}, 'lastEventId': 30}}
+    target, metrics, cluster_state = self.monitor(state)
+    ''' saved session is tried first, whole backlog is read after login '''
+    self.assertEqual(self.server.polls, [30, 1])
+    self.assertEqual(self.server.logins, 1)
+    self.assertEqual(cluster_state['lastEventId'], 50)
+    self.assertEqual(cluster_state['cookies'], {'JSESSIONID': 'valid'})
+    self.assertEqual(sorted((m.key, m.value) for m in metrics),
+                     [('custom.svc.status.externalStorage', '0'), ('custom.svc.status.internalStorage', '1'),
+                      ('custom.svc.status.remotePartnerships', '2')])
+    ''' state of caller is not changed by thread '''
+    self.assertEqual(state[self.target['url']]['lastEventId'], 30)
+
+  def testSavedSession(self):
+    state = {self.target['url']: {'user': 'monitor', 'cookies': {'JSESSIONID': 'valid'}, 'lastEventId': 30}}
+    target, metrics, cluster_state = self.monitor(state)
+    self.assertEqual(self.server.polls, [30])
+    self.assertEqual(self.server.logins, 0)
+    self.assertEqual(cluster_state['lastEventId'], 50)
+
+  def testOtherUser(self):
+    state = {self.target['url']: {'user': 'admin', 'cookies': {'JSESSIONID': 'valid'}, 'lastEventId': 30}}
+    self.monitor(state)
+    self.assertEqual(self.server.polls, [1])
+    self.assertEqual(self.server.logins, 1)
+
+class StateFileTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    svc_mon2.statefile = os.path.join(self.dir, 'svc_mon2.state')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def testMerge(self):
+    ''' block and unified runs of one cluster save their states to the same file '''
+    self.assertEqual(svc_mon2.loadState(), {})
+    svc_mon2.saveState({'https://svc1': {'lastEventId': 10}})
+    svc_mon2.saveState({'https://svc1:1081': {'lastEventId': 20}})
+    svc_mon2.saveState({'https://svc1': {'lastEventId': 11}})
+    self.assertEqual(svc_mon2.loadState(), {'https://svc1': {'lastEventId': 11}, 'https://svc1:1081': {'lastEventId': 20}})
+    self.assertEqual(os.stat(svc_mon2.statefile).st_mode & 0777, 0600)
+
+  def testBrokenFile(self):
+    open(svc_mon2.statefile, 'w').write('{broken')
+    self.assertEqual(svc_mon2.loadState(), {})
+    svc_mon2.saveState({'https://svc1': {'lastEventId': 10}})
+    self.assertEqual(svc_mon2.loadState(), {'https://svc1': {'lastEventId': 10}})
+
+  def testNoStateFile(self):
+    svc_mon2.statefile = None
+    svc_mon2.saveState({'https://svc1': {'lastEventId': 10}})
+    self.assertEqual(svc_mon2.loadState(), {})
+    self.assertEqual(os.listdir(self.dir), [])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_mon2.py --targets parsing and deadline of cluster polling
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, time, socket, threading, unittest
+import BaseHTTPServer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_mon2
+
+class ParseTargetTest(unittest.TestCase):
+  def testSvc(self):
+    self.assertEqual(svc_mon2.parseTarget('svc1'), {'svc': 'svc1', 'host': 'svc1', 'unified': False, 'url': 'https://svc1'})
+
+  def testHost(self):
+    self.assertEqual(svc_mon2.parseTarget('svc1.example.com/svc1'),
+                     {'svc': 'svc1.example.com', 'host': 'svc1', 'unified': False, 'url': 'https://svc1.example.com'})
+
+  def testUnified(self):
+    self.assertEqual(svc_mon2.parseTarget('ifs1/unified'), {'svc': 'ifs1', 'host': 'ifs1', 'unified': True, 'url': 'https://ifs1:1081'})
+    self.assertEqual(svc_mon2.parseTarget('ifs1/ifs1-file/unified'), svc_mon2.parseTarget('ifs1/unified/ifs1-file'))
+    self.assertEqual(svc_mon2.parseTarget('ifs1/ifs1-file/unified')['host'], 'ifs1-file')
+
+class TrickleHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  ''' GUI sending poll response slowly: every read returns in time, whole response takes 10 seconds '''
+  def do_POST(self):
+    self.rfile.read(int(self.headers.getheader('content-length') or 0))
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(100 * 16384))
+    self.end_headers()
+    try:
+      for i in range(100):
+        self.wfile.write(' ' * 16384)
+        self.wfile.flush()
+        time.sleep(0.1)
+    except socket.error:
+      pass
+
+  def log_message(self, *args):
+    pass
+
+class QuietServer(BaseHTTPServer.HTTPServer):
+  def handle_error(self, request, client_address):
+    ''' client closes connection of the slow response '''
+    pass
+
+class DeadlineTest(unittest.TestCase):
+  def setUp(self):
+    self.server = QuietServer(('127.0.0.1', 0), TrickleHandler)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    svc_mon2.debug = False
+    svc_mon2.timeout = 5
+    svc_mon2.run_deadline = 1
+    self.target = svc_mon2.makeTarget('svc1')
+    self.target['url'] = 'http://127.0.0.1:%d' % self.server.server_port
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def testSlowResponse(self):
+    started = time.time()
+    svc_mon2.deadline = started + svc_mon2.run_deadline
+    s = svc_mon2.requests.Session()
+    self.assertRaises(svc_mon2.RPCError, svc_mon2.poll, s, self.target, 1)
+    self.assertTrue(time.time() - started < 3)
+
+  def testDeadlinePassed(self):
+    svc_mon2.deadline = time.time() - 1
+    self.assertRaises(svc_mon2.RPCError, svc_mon2.requestTimeout)
+
+  def testRequestTimeout(self):
+    svc_mon2.deadline = time.time() + 100
+    self.assertEqual(svc_mon2.requestTimeout(), 5)
+    svc_mon2.deadline = time.time() + 2
+    self.assertTrue(1 < svc_mon2.requestTimeout() <= 2)
+
+if __name__ == '__main__':
+  unittest.main()
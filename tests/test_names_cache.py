@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_wbem.py element name cache (lookupNames)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, json, time, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_wbem
+
+class Property(object):
+  def __init__(self, value):
+    self.value = value
+
+class Instance(object):
+  def __init__(self, **properties):
+    self.properties = dict((k, Property(v)) for (k, v) in properties.iteritems())
+
+class NamesConnection(object):
+  ''' WBEM connection answering DeviceID, ElementName, PoolName queries of volumes '''
+  def __init__(self, count):
+    self.volumes = [Instance(DeviceID=str(i), ElementName='vol%d' % i, PoolName='pool%d' % (i % 2)) for i in range(count)]
+    self.queries = []
+
+  def ExecQuery(self, language, query):
+    self.queries.append(query)
+    if ' WHERE ' not in query:
+      return self.volumes
+    return [v for v in self.volumes if "DeviceID = '%s'" % v.properties['DeviceID'].value in query]
+
+class LookupNamesTest(unittest.TestCase):
+  def setUp(self):
+    svc_perf_wbem.names_cache = {}
+    svc_perf_wbem.names_ttl = 3600
+    svc_perf_wbem.inventory_dir = None
+    svc_perf_wbem.cache_lock = threading.Lock()
+
+  def lookup(self, conn, ids):
+    return svc_perf_wbem.lookupNames(conn, 'svc1', 'volume', 'IBMTSSVC_StorageVolume', ids)
+
+  def testEnumerate(self):
+    conn = NamesConnection(4)
+    names, pools = self.lookup(conn, ['0', '3'])
+    self.assertEqual(names, {'0': 'vol0', '1': 'vol1', '2': 'vol2', '3': 'vol3'})
+    self.assertEqual(pools['3'], 'pool1')
+    self.lookup(conn, ['0', '3'])
+    self.assertEqual(len(conn.queries), 1)
+
+  def testMissing(self):
+    conn = NamesConnection(2)
+    self.lookup(conn, ['0'])
+    entry = svc_perf_wbem.names_cache['svc1.volume']
+    saved = json.dumps(svc_perf_wbem.names_cache, sort_keys=True)
+    conn.volumes = NamesConnection(4).volumes
+    names, pools = self.lookup(conn, ['0', '3'])
+    self.assertEqual(names['3'], 'vol3')
+    self.assertFalse('2' in names)
+    self.assertEqual(conn.queries[-1], "SELECT DeviceID, ElementName, PoolName FROM IBMTSSVC_StorageVolume WHERE DeviceID = '3'")
+    ''' entry saved by a concurrent saveCache is not changed, new entry replaces it '''
+    self.assertEqual(json.dumps({'svc1.volume': entry}, sort_keys=True), saved)
+    self.assertEqual(svc_perf_wbem.names_cache['svc1.volume']['names']['3'], 'vol3')
+    self.assertEqual(svc_perf_wbem.names_cache['svc1.volume']['refreshed'], entry['refreshed'])
+
+  def testExpired(self):
+    conn = NamesConnection(2)
+    self.lookup(conn, ['0'])
+    svc_perf_wbem.names_cache['svc1.volume']['refreshed'] = int(time.time()) - 7200
+    self.lookup(conn, ['0'])
+    self.assertEqual(len(conn.queries), 2)
+    self.assertTrue(time.time() - svc_perf_wbem.names_cache['svc1.volume']['refreshed'] < 60)
+
+if __name__ == '__main__':
+  unittest.main()
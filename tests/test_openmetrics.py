@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_wbem.py OpenMetrics sink: series labels, escaping and stale series
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, gzip, cStringIO, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_wbem
+from svc_perf_wbem import OpenMetricsSink
+from zbxsend import Metric
+
+class Clock(object):
+  ''' time module replacement of svc_perf_wbem '''
+  def __init__(self, now):
+    self.now = now
+
+  def time(self):
+    return self.now
+
+class OpenMetricsSinkTest(unittest.TestCase):
+  def setUp(self):
+    svc_perf_wbem.interval = 180
+    self.clock = Clock(1356530400)
+    self.saved_time = svc_perf_wbem.time
+    svc_perf_wbem.time = self.clock
+    self.sink = OpenMetricsSink(('127.0.0.1', 0))
+
+  def tearDown(self):
+    svc_perf_wbem.time = self.saved_time
+    self.sink.server.shutdown()
+    self.sink.server.server_close()
+
+  def lines(self):
+    text, gzipped = self.sink.render()
+    self.assertEqual(gzip.GzipFile(fileobj=cStringIO.StringIO(gzipped)).read(), text)
+    return text.decode('utf-8').splitlines()
+
+  def testLabels(self):
+    self.sink.write([Metric('svc1', 'svc.TotalIORate[volume,7]', 12.5, 1356530400),
+                     Metric('svc1', 'svc.pool.TotalIORate[volume,pool,1]', 20, 1356530400),
+                     Metric('svc1', 'svc.collector.count[perf,elements]', 220, 1356530400)],
+                    {'7': u'vol "7"\\ä\nx'}, {'7': 'pool,1'})
+    self.assertEqual(self.lines(), [
+      u'# TYPE svc_TotalIORate gauge',
+      u'svc_TotalIORate{cluster="svc1",type="volume",id="7",name="vol \\"7\\"\\\\ä\\nx",pool="pool,1"} 12.5 1356530400',
+      u'# TYPE svc_collector_count gauge',
+      u'svc_collector_count{cluster="svc1",collector="perf",counter="elements"} 220.0 1356530400',
+      u'# TYPE svc_pool_TotalIORate gauge',
+      u'svc_pool_TotalIORate{cluster="svc1",type="volume",pool="pool,1"} 20.0 1356530400',
+      u'# EOF'])
+
+  def testNumbers(self):
+    self.assertEqual(OpenMetricsSink.number(float('nan')), 'NaN')
+    self.assertEqual(OpenMetricsSink.number(float('-inf')), '-Inf')
+    self.assertEqual(OpenMetricsSink.number('7'), '7.0')
+
+  def testStale(self):
+    ''' rollups written once an hour stay until the next window, other series are dropped after 3 intervals '''
+    self.sink.write([Metric('svc1', 'svc.TotalIORate[volume,7]', 12.5, 1356530400),
+                     Metric('svc1', 'svc.TotalIORate.max[volume,7]', 30, 1356530400)])
+    self.clock.now += 3 * 180 + 1
+    self.sink.write([Metric('svc1', 'svc.TotalIORate[volume,8]', 1, self.clock.now)])
+    self.assertEqual([l.split('{')[0] for l in self.lines() if not l.startswith('#')], ['svc_TotalIORate', 'svc_TotalIORate_max'])
+    self.assertTrue('id="8"' in self.lines()[1])
+    self.clock.now = 1356530400 + 3600 + 179
+    self.sink.write([Metric('svc1', 'svc.TotalIORate[volume,8]', 1, self.clock.now)])
+    self.assertEqual(len([l for l in self.lines() if 'svc_TotalIORate_max' in l]), 2)
+    self.clock.now += 2
+    self.sink.write([Metric('svc1', 'svc.TotalIORate[volume,8]', 1, self.clock.now)])
+    self.assertEqual([l.split('{')[0] for l in self.lines() if not l.startswith('#')], ['svc_TotalIORate'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_wbem.py parallel collection of statistics classes of a cluster (pollCluster)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, time, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_wbem
+
+class PollClusterTest(unittest.TestCase):
+  def setUp(self):
+    self.saved = svc_perf_wbem.collectStats, svc_perf_wbem.outputMetrics
+    svc_perf_wbem.cache_lock = threading.Lock()
+    svc_perf_wbem.cache = {}
+    svc_perf_wbem.sent = None
+    svc_perf_wbem.history = None
+    svc_perf_wbem.timeout = 0.3
+    svc_perf_wbem.outputMetrics = lambda *args: None
+    self.delays = {}
+    self.done = threading.Event()
+    svc_perf_wbem.collectStats = self.collectStats
+    self.connections = {('svc1', 'volume'): object(), ('svc1', 'mdisk'): object()}
+
+  def tearDown(self):
+    svc_perf_wbem.collectStats, svc_perf_wbem.outputMetrics = self.saved
+
+  def collectStats(self, conn, cluster, elementType, elementClass, statisticsClass, elementCounters, updates, deadline, telemetry):
+    time.sleep(self.delays.get(elementType, 0))
+    updates['%s.%s.0' % (cluster, elementType)] = {'timestamp': 100}
+    if elementType == 'mdisk':
+      self.done.set()
+    return 100
+
+  def testInTime(self):
+    self.assertEqual(svc_perf_wbem.pollCluster('svc1', self.connections), 100)
+    self.assertEqual(sorted(svc_perf_wbem.cache), ['svc1.mdisk.0', 'svc1.volume.0'])
+    self.assertEqual(len(self.connections), 2)
+
+  def testLateThread(self):
+    ''' raw counters of thread finished after deadline are cached when it finishes '''
+    self.delays['mdisk'] = 0.6
+    self.assertEqual(svc_perf_wbem.pollCluster('svc1', self.connections), 100)
+    self.assertEqual(sorted(svc_perf_wbem.cache), ['svc1.volume.0'])
+    ''' connection of the running thread is not shared with the next poll '''
+    self.assertEqual(self.connections.keys(), [('svc1', 'volume')])
+    self.assertTrue(self.done.wait(5))
+    for i in range(50):
+      if len(svc_perf_wbem.cache) == 2:
+        break
+      time.sleep(0.1)
+    self.assertEqual(sorted(svc_perf_wbem.cache), ['svc1.mdisk.0', 'svc1.volume.0'])
+    self.assertEqual(len(self.connections), 2)
+
+if __name__ == '__main__':
+  unittest.main()
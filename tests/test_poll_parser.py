@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_mon2.py streaming parser of PollingManager.poll response (PollResponseParser)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, json, random, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from svc_mon2 import PollResponseParser, CONNECTION_STATUS_EVENTS
+
+def statusEvent(event_id, status):
+  return {'clazz': CONNECTION_STATUS_EVENTS[1], 'id': event_id, 'status': status,
+          'node': {'id': 1000 + event_id, 'name': u'node1 "A" {x} [y], \\ z: тест'}}
+
+def otherEvent(event_id):
+  return {'id': event_id, 'clazz': 'com.ibm.svc.gui.events.TaskEvent', 'args': [[], {}, [{'id': 99999}], u'}]"\\'],
+          'empty': {}, 'number': -1.5e3, 'flag': True, 'none': None}
+
+def response(events):
+  return {'clazz': 'com.ibm.evo.rpc.RPCResponse', 'messages': [{'id': 'msg', 'text': '[events]'}],
+          'result': {'clazz': 'com.ibm.evo.events.PollingManager$PollResponse', 'events': events, 'pid': 7}}
+
+def parse(chunks):
+  parser = PollResponseParser()
+  for chunk in chunks:
+    parser.feed(chunk)
+  parser.feed(u'', final=True)
+  return parser
+
+def split(text, sizes):
+  chunks = []
+  pos = 0
+  while pos < len(text):
+    size = sizes.next()
+    chunks.append(text[pos:pos + size])
+    pos += size
+  return chunks
+
+def randomSizes(rnd, largest):
+  while True:
+    yield rnd.randint(1, largest)
+
+def fixedSizes(size):
+  while True:
+    yield size
+
+def randomValue(rnd, depth=0):
+  kind = rnd.randint(0, 7 if depth < 3 else 4)
+  if kind == 0:
+    return rnd.choice([None, True, False])
+  if kind == 1:
+    return rnd.choice([0, -7, 12345678901234, 1.5, -2e-3])
+  if kind <= 4:
+    return u''.join(rnd.choice(u'ab "\\/{}[]:,\n\tт') for i in range(rnd.randint(0, 8)))
+  if kind == 5:
+    return [randomValue(rnd, depth + 1) for i in range(rnd.randint(0, 3))]
+  return dict((randomValue(rnd, 3) if rnd.randint(0, 1) else rnd.choice([u'id', u'clazz', u'events', u'result']), randomValue(rnd, depth + 1))
+              for i in range(rnd.randint(0, 3)))
+
+def randomEvent(rnd):
+  if rnd.randint(0, 9) == 0:
+    return randomValue(rnd)
+  event = dict((u'k%d' % i, randomValue(rnd, 1)) for i in range(rnd.randint(0, 3)))
+  event[u'id'] = rnd.choice([rnd.randint(0, 10 ** 6), u'x', 1.5, None])
+  event[u'clazz'] = rnd.choice(CONNECTION_STATUS_EVENTS + [u'com.ibm.evo.events.ResourceEvent'])
+  return event
+
+class PollResponseParserTest(unittest.TestCase):
+  def setUp(self):
+    self.events = [otherEvent(1), statusEvent(5, 'online'), otherEvent(12), statusEvent(3, 'offline'), otherEvent(8)]
+    self.text = json.dumps(response(self.events), ensure_ascii=False)
+    self.expected = response([e for e in self.events if e['clazz'] in CONNECTION_STATUS_EVENTS])
+
+  def check(self, parser, expected=None):
+    self.assertEqual(parser.response(), expected or self.expected)
+    self.assertEqual(parser.count, len(self.events))
+    self.assertEqual(parser.last_id, 12)
+
+  def testWhole(self):
+    self.check(parse([self.text]))
+
+  def testChunks(self):
+    ''' chunk boundaries at every position of strings, keys, numbers and nesting '''
+    for size in (1, 2, 3, 5, 7, 64):
+      self.check(parse(split(self.text, fixedSizes(size))))
+    rnd = random.Random(1)
+    for i in range(50):
+      self.check(parse(split(self.text, randomSizes(rnd, 40))))
+
+  def testLineContinuations(self):
+    ''' non-standard "\\<newline>" is removed, also if backslash and newline are in different chunks '''
+    rnd = random.Random(2)
+    for i in range(50):
+      text = list(self.text)
+      for pos in sorted(rnd.sample(xrange(len(text)), 20), reverse=True):
+        text.insert(pos, u'\\\n')
+      text = u''.join(text)
+      self.check(parse(split(text, randomSizes(rnd, 10))))
+
+  def testRandom(self):
+    ''' random responses give the same result as json.loads of the whole response '''
+    rnd = random.Random(3)
+    for i in range(300):
+      data = randomValue(rnd, 1) if rnd.randint(0, 1) else {}
+      if isinstance(data, dict):
+        events = [randomEvent(rnd) for j in range(rnd.randint(0, 5))]
+        result = randomValue(rnd, 2)
+        data[u'result'] = dict(result if isinstance(result, dict) else {}, events=events)
+      text = json.dumps(data, ensure_ascii=rnd.randint(0, 1), indent=rnd.choice([None, 1]))
+      text = u''.join(c + (u'\\\n' if rnd.randint(0, 20) == 0 else u'') for c in text)
+      parser = parse(split(text, randomSizes(rnd, 12)))
+      expected = json.loads(text.replace(u'\\\n', u''))
+      if isinstance(expected, dict):
+        events = expected[u'result'][u'events']
+        expected[u'result'][u'events'] = [e for e in events if isinstance(e, dict) and e.get('clazz') in CONNECTION_STATUS_EVENTS]
+        ids = [e['id'] for e in events if isinstance(e, dict) and type(e.get('id')) in (int, long)]
+        self.assertEqual((parser.count, parser.last_id), (len(events), max(ids) if ids else None))
+      self.assertEqual(parser.response(), expected)
+
+  def testEscapedBackslashAtChunkEnd(self):
+    ''' escaped backslash followed by a newline outside of string is not a line continuation '''
+    text = u'{"result": {"events": [{"id": 4, "path": "c:\\\\"}\n]}}'
+    for size in range(1, len(text)):
+      parser = parse(split(text, fixedSizes(size)))
+      self.assertEqual(parser.response(), {'result': {'events': []}})
+      self.assertEqual((parser.count, parser.last_id), (1, 4))
+
+  def testLineContinuationInEscape(self):
+    ''' "\\<newline>" between backslashes of escaped backslash leaves the escape split at chunk end '''
+    text = u'{"result": {"events": [{"id": 4, "path": "c:\\\\\n\\", "clazz": "%s"}]}}' % CONNECTION_STATUS_EVENTS[0]
+    for size in range(1, len(text)):
+      parser = parse(split(text, fixedSizes(size)))
+      self.assertEqual(parser.response(), {'result': {'events': [{'id': 4, 'path': 'c:\\', 'clazz': CONNECTION_STATUS_EVENTS[0]}]}})
+
+  def testNestedIds(self):
+    ''' only top-level "id" of events is counted, ids of nested objects and non-integer ids are ignored '''
+    events = [{'id': 2, 'node': {'id': 50}}, {'id': 'x'}, {'nodes': [{'id': 70}]}]
+    parser = parse([json.dumps(response(events))])
+    self.assertEqual((parser.count, parser.last_id), (3, 2))
+
+  def testEventsOutsideResult(self):
+    ''' "events" arrays outside of result are parsed as usual '''
+    data = {'events': [statusEvent(1, 'online'), otherEvent(2)], 'result': {'events': [otherEvent(3)], 'x': {'events': [otherEvent(4)]}}}
+    parser = parse(split(json.dumps(data), fixedSizes(3)))
+    self.assertEqual(parser.response(), dict(data, result={'events': [], 'x': {'events': [otherEvent(4)]}}))
+    self.assertEqual((parser.count, parser.last_id), (1, 3))
+
+  def testNoEvents(self):
+    ''' error response without result.events is returned as is '''
+    data = {'clazz': 'com.ibm.evo.rpc.RPCResponse', 'result': None, 'exceptionMessage': 'Not authorized [x]'}
+    parser = parse(split(json.dumps(data), fixedSizes(4)))
+    self.assertEqual(parser.response(), data)
+    self.assertEqual((parser.count, parser.last_id), (0, None))
+
+  def testNotJSON(self):
+    self.assertRaises(ValueError, parse(['<html><body>Login</body></html>']).response)
+    self.assertRaises(ValueError, parse, ['{"result": {"events": []}}}'])
+    self.assertRaises(ValueError, parse(['{"result": {"events": [{"id": 1}']).response)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_perf_wbem.py hourly rollups (percentile, rollupStats)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_perf_wbem
+from svc_perf_wbem import percentile, rollupStats, ROLLUP_WINDOW
+
+HOUR = 1356526800 // ROLLUP_WINDOW * ROLLUP_WINDOW
+
+def sample(read_time, rate=None):
+  values = {'ReadIOTime': float(read_time), 'WriteIOTime': 1.0}
+  if rate is not None:
+    values['TotalIORate'] = float(rate)
+  return values
+
+class PercentileTest(unittest.TestCase):
+  def testNearestRank(self):
+    series = range(1, 21)
+    self.assertEqual(percentile(series, 95), 19)
+    self.assertEqual(percentile(series, 50), 10)
+    self.assertEqual(percentile(series, 100), 20)
+    self.assertEqual(percentile(series, 0), 1)
+    self.assertEqual(percentile(range(1, 11), 95), 10)
+    self.assertEqual(percentile([7.5], 95), 7.5)
+
+class RollupTest(unittest.TestCase):
+  def setUp(self):
+    ''' svc_perf_wbem.py globals normally set by its command line '''
+    svc_perf_wbem.interval = 180
+
+  def feed(self, samples, values):
+    ''' feed samples one by one, return history and list of rollups '''
+    rollups = []
+    for (timestamp, v) in values:
+      samples, r = rollupStats(samples, timestamp, v)
+      if r:
+        rollups.append(r)
+    return samples, rollups
+
+  def testSlots(self):
+    self.assertEqual(svc_perf_wbem.historySlots(), 24)
+    svc_perf_wbem.interval = 60
+    self.assertEqual(svc_perf_wbem.historySlots(), 64)
+
+  def testWindow(self):
+    ''' rollups of the finished hour are returned with the first sample of the next hour '''
+    values = [(HOUR + 180 * i, sample(i + 1, 10 * (i % 4))) for i in range(20)]
+    samples, rollups = self.feed([], values)
+    self.assertEqual(rollups, [])
+    self.assertEqual(len(samples), 20)
+
+    samples, rollups = self.feed(samples, [(HOUR + ROLLUP_WINDOW + 5, sample(1000, 1000))])
+    self.assertEqual(rollups, [(HOUR + ROLLUP_WINDOW, {('ReadIOTime', 'max'): 20.0, ('ReadIOTime', 'p95'): 19.0,
+                                                        ('WriteIOTime', 'max'): 1.0, ('WriteIOTime', 'p95'): 1.0,
+                                                        ('TotalIORate', 'max'): 30.0, ('TotalIORate', 'avg'): 15.0})])
+    self.assertEqual(samples[-1], (HOUR + ROLLUP_WINDOW + 5, sample(1000, 1000)))
+
+  def testPreviousWindowExcluded(self):
+    ''' history keeps samples of the previous hour, they are not part of the next rollup '''
+    values = [(HOUR + 1800 + 180 * i, sample(100)) for i in range(10)]
+    values += [(HOUR + ROLLUP_WINDOW + 180 * i, sample(i)) for i in range(20)]
+    values += [(HOUR + 2 * ROLLUP_WINDOW, sample(0))]
+    samples, rollups = self.feed([], values)
+    self.assertEqual([r[0] for r in rollups], [HOUR + ROLLUP_WINDOW, HOUR + 2 * ROLLUP_WINDOW])
+    self.assertEqual(rollups[1][1][('ReadIOTime', 'max')], 19.0)
+    self.assertEqual(len(samples), svc_perf_wbem.historySlots())
+
+  def testUndefinedValues(self):
+    ''' counters undefined in all samples of the window have no rollups, other fields are not kept in history '''
+    values = [(HOUR + 180 * i, dict(sample(2), ReadIORate=5.0)) for i in range(3)]
+    samples, rollups = self.feed([], values + [(HOUR + ROLLUP_WINDOW, sample(2))])
+    self.assertEqual(sorted(rollups[0][1]), [('ReadIOTime', 'max'), ('ReadIOTime', 'p95'), ('WriteIOTime', 'max'), ('WriteIOTime', 'p95')])
+    self.assertTrue(all('ReadIORate' not in v for (t, v) in samples))
+
+  def testGap(self):
+    ''' samples missing for hours: rollups of the last hour with samples only '''
+    values = [(HOUR + 180 * i, sample(i, i)) for i in range(3)] + [(HOUR + 3 * ROLLUP_WINDOW + 60, sample(50, 50))]
+    samples, rollups = self.feed([], values)
+    self.assertEqual(rollups, [(HOUR + ROLLUP_WINDOW, {('ReadIOTime', 'max'): 2.0, ('ReadIOTime', 'p95'): 2.0,
+                                                       ('WriteIOTime', 'max'): 1.0, ('WriteIOTime', 'p95'): 1.0,
+                                                       ('TotalIORate', 'max'): 2.0, ('TotalIORate', 'avg'): 1.0})])
+
+if __name__ == '__main__':
+  unittest.main()
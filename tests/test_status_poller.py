@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*- # coding: utf-8
+#
+# Unit tests of svc_status_poller.py event log parsing, ssh command watchdog and alert counting (parseEventLog, runCommand, ClusterPoller)
+#
+# Usage: python -m unittest discover -s tests
+#
+import os, sys, shutil, tempfile, threading, time, unittest, StringIO
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import svc_status_poller
+from svc_status_poller import parseEventLog, runCommand, ClusterPoller
+
+HEADER = 'sequence_number:last_timestamp:object_type:object_id:object_name:copy_id:status:fixed:event_id:error_code:description'
+
+''' ssh replacement: prints event log file of cluster for lseventlog, "-O check" fails until a master is started '''
+SSH_STUB = '''#!/bin/sh
+dir=$(dirname "$0")
+for a in "$@"; do host="$last"; last="$a"; [ "$a" = lseventlog ] && exec cat "$dir/events.$host"; done
+case " $* " in
+  *" -O check "*) [ -f "$dir/master" ] && exit 0; exit 255;;
+  *" -M "*) touch "$dir/master";;
+esac
+exit 0
+'''
+
+class ParseEventLogTest(unittest.TestCase):
+  def testColumns(self):
+    events = parseEventLog(HEADER + '\n120:260101120000:mdisk:3:md3::alert:no:010018:1370:Managed disk error: path failed\n\n' +
+                           '110:260101110000:node:1:node1::alert:no:074002::Node warmstarted\n')
+    self.assertEqual(len(events), 2)
+    self.assertEqual(events[0]['error_code'], '1370')
+    self.assertEqual(events[0]['description'], 'Managed disk error: path failed')
+    self.assertEqual(events[1]['error_code'], '')
+    self.assertEqual(events[1]['sequence_number'], '110')
+
+  def testEmpty(self):
+    self.assertEqual(parseEventLog(''), [])
+    self.assertEqual(parseEventLog(HEADER + '\n'), [])
+
+class RunCommandTest(unittest.TestCase):
+  def setUp(self):
+    self.timeout = svc_status_poller.COMMAND_TIMEOUT
+
+  def tearDown(self):
+    svc_status_poller.COMMAND_TIMEOUT = self.timeout
+
+  def testOutput(self):
+    self.assertEqual(runCommand(['sh', '-c', 'echo out; echo err >&2; exit 3']), (3, 'out\n', 'err\n'))
+
+  def testWatchdog(self):
+    ''' hung command is killed '''
+    svc_status_poller.COMMAND_TIMEOUT = 0.5
+    started = time.time()
+    code, out, err = runCommand(['sh', '-c', 'echo started; exec sleep 30'])
+    self.assertEqual((code, out), (None, 'started\n'))
+    self.assertTrue(time.time() - started < 10)
+
+class ClusterPollerTest(unittest.TestCase):
+  def setUp(self):
+    ''' svc_status_poller.py globals normally set by its command line '''
+    self.tmpdir = tempfile.mkdtemp(prefix='svc_status_test.')
+    m = svc_status_poller
+    m.debug = False
+    m.control_dir = self.tmpdir
+    m.ssh = os.path.join(self.tmpdir, 'ssh')
+    m.output_lock = threading.Lock()
+    open(m.ssh, 'w').write(SSH_STUB)
+    os.chmod(m.ssh, 0755)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+  def poll(self, poller, events):
+    open(os.path.join(self.tmpdir, 'events.svc1'), 'w').write('\n'.join([HEADER] + events) + '\n')
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+    try:
+      poller.poll()
+      ''' <host> <key> <timestamp> <value> lines '''
+      values = dict((f[1], f[3]) for f in (l.split(' ') for l in sys.stdout.getvalue().splitlines()) if f[1].startswith('svc.status.'))
+      return values, sys.stderr.getvalue()
+    finally:
+      sys.stdout, sys.stderr = stdout, stderr
+
+  def testNewAlerts(self):
+    ''' alerts above the highest sequence number seen are new, the first poll only sets the sequence number '''
+    poller = ClusterPoller('svc1')
+    events = ['120:260101120000:mdisk:3:md3::alert:no:010018:1370:Managed disk error: path failed',
+              '110:260101110000:node:1:node1::alert:no:074002::Node warmstarted']
+    self.assertEqual(self.poll(poller, events), ({'svc.status.alerts': '1', 'svc.status.newAlerts': '0'}, ''))
+    self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'master')))
+
+    events.insert(0, '130:260101130000:mdisk:4:md4::alert:no:010018:1370:Managed disk error')
+    events.insert(0, '131:260101130500:node:2:node2::message:no:074002::Node warmstarted')
+    values, log = self.poll(poller, events)
+    self.assertEqual(values, {'svc.status.alerts': '2', 'svc.status.newAlerts': '1'})
+    self.assertTrue('svc1: new alert 130 ' in log)
+    self.assertEqual(poller.last_sequence, 131)
+
+  def testFailure(self):
+    ''' failed ssh sends no status values '''
+    os.remove(svc_status_poller.ssh)
+    open(svc_status_poller.ssh, 'w').write('#!/bin/sh\necho "Permission denied" >&2\nexit 255\n')
+    os.chmod(svc_status_poller.ssh, 0755)
+    values, log = self.poll(ClusterPoller('svc1'), [])
+    self.assertEqual(values, {})
+    self.assertTrue('lseventlog of svc1 failed (ssh exit code 255): Permission denied' in log)
+
+if __name__ == '__main__':
+  unittest.main()